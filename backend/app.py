@@ -1,18 +1,26 @@
 """
 Flask Backend for Smart Campus Assistant - Multi-User Supported
 """
-from flask import Flask, request, jsonify, render_template, Response
-from werkzeug.utils import secure_filename
+from flask import Flask, request, jsonify, render_template, Response, g
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
 import logging
+import json
 import secrets
 import datetime
+import time
+from contextlib import ExitStack
 from functools import wraps
 
 from model.assistant import SmartCampusAssistant
-from database import users_collection
+from model.startup import WarmupOrchestrator
+from model.utils import LLMGovernor, MemoryMonitor, RateLimiter, RateLimitExceeded
+from database import users_collection, check_connection
+from uploads import UploadError, UploadLimiter, receive_files
+from http_cache import ResponseCache, UserVersions, compress_response, negotiate
+import metrics
 from auth import get_password_hash, verify_password, create_access_token, create_refresh_token, decode_token
 
 # Load environment variables
@@ -25,13 +33,62 @@ CORS(app)
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# One JSON line per request with its stage timings (REQUEST_TIMING_LOG=0 disables)
+timing_logger = logging.getLogger("campus.timing")
+if os.getenv("REQUEST_TIMING_LOG", "1") == "0":
+    timing_logger.disabled = True
+
+@app.before_request
+def start_request_trace():
+    g.request_started = time.perf_counter()
+    metrics.begin_request()
+    resource_monitor.ensure_started()
+    # MEMORY_TRACING=1 lets a request ask for a tracemalloc diff of itself
+    if MEMORY_TRACING and request.headers.get("X-Trace-Memory") == "1":
+        g.memory_trace = ExitStack()
+        g.memory_trace.enter_context(resource_monitor.trace_allocations(f"{request.method} {request.path}"))
+
+@app.teardown_request
+def finish_memory_trace(exc):
+    trace = g.pop("memory_trace", None)
+    if trace is not None:
+        trace.close()
+
+@app.after_request
+def finish_request_trace(response):
+    started = g.pop("request_started", None)
+    if started is None:
+        return response
+    seconds = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    spans = metrics.end_request(route, request.method, response.status_code, seconds)
+    if timing_logger.isEnabledFor(logging.INFO):
+        timing_logger.info(json.dumps({
+            "route": route,
+            "method": request.method,
+            "status": response.status_code,
+            "user_id": getattr(request, "user_id", None),
+            "ms": round(seconds * 1000, 2),
+            "spans": [[stage, round(elapsed * 1000, 2)] for stage, elapsed in spans]
+        }))
+    return response
+
+@app.after_request
+def compress(response):
+    return compress_response(response, request.headers.get("Accept-Encoding", ""))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Histograms are per process; with serve.py each worker reports its own
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route('/')
 def home():
     return jsonify({
         "status": "online",
         "message": "Smart Campus Assistant API is running 🚀",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "ready": warmup.ready
     })
 
 # Initialize assistant
@@ -40,15 +97,100 @@ if not GROQ_API_KEY:
     logger.error("GROQ_API_KEY not found!")
     raise ValueError("GROQ_API_KEY environment variable not set!")
 
-assistant = SmartCampusAssistant(GROQ_API_KEY)
+# RETRIEVAL_SOCKET is set by serve.py when workers share one retrieval sidecar
+# PRECOMPUTE_ON_UPLOAD=1 pre-generates summaries and quiz pools for the main
+# topics of each upload so later requests for them skip retrieval and the LLM;
+# it uses at most PRECOMPUTE_LLM_SHARE (default 0.25) of LLM_REQUESTS_PER_MINUTE
+# PDF_WORKERS > 1 loads page ranges of large PDFs in that many processes
+# VECTOR_STORE=int8 or float16 keeps embeddings quantized in memory-mapped
+# files (model.compact_store) instead of Chroma; the default is chroma
+# EMBED_QUERY_BATCH concurrent questions share one embedding forward pass,
+# waiting up to EMBED_QUERY_WAIT_MS for each other under load (1 disables)
+# Identical summary/quiz requests in flight share one LLM call; callers give
+# up after COALESCE_TIMEOUT_SECONDS waiting for the shared result
+# LLM_MODEL answers every task unless LLM_ROUTES ("task=model,...") names
+# another for it (tasks: format, summarize, quiz, answer). Tasks listed in
+# LLM_CASCADE try LLM_SMALL_MODEL first and escalate when its result is
+# unusable; the default cascades only the Wikipedia formatting
+# WIKI_CONTEXT_TOKENS bounds the Wikipedia text sent for formatting to the
+# sentences most similar to the question (0 sends it whole)
+# LLM_MAX_CONCURRENT and LLM_REQUESTS_PER_MINUTE bound the Groq calls of this
+# process; USER_REQUESTS_PER_MINUTE limits each user's ask/summary/quiz calls
+# (0 turns either per-minute limit off)
+# Status, dashboard and history are answered with 304 or from a per-user
+# cache until the user's data changes; RESPONSE_CACHE_ENTRIES bounds the cache
+user_versions = UserVersions()
+response_cache = ResponseCache(user_versions, max_entries=int(os.getenv("RESPONSE_CACHE_ENTRIES", "4096")))
+llm_rpm = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "60"))
+llm_governor = LLMGovernor(
+    max_concurrent=int(os.getenv("LLM_MAX_CONCURRENT", "4")),
+    rate_limiter=RateLimiter(rate=llm_rpm / 60, capacity=max(1.0, llm_rpm / 6)) if llm_rpm > 0 else None
+)
+user_rpm = float(os.getenv("USER_REQUESTS_PER_MINUTE", "20"))
+user_limiter = RateLimiter(rate=user_rpm / 60, capacity=max(1.0, user_rpm / 4)) if user_rpm > 0 else None
+
+assistant = SmartCampusAssistant(
+    GROQ_API_KEY,
+    retrieval_socket=os.getenv("RETRIEVAL_SOCKET"),
+    precompute=os.getenv("PRECOMPUTE_ON_UPLOAD", "0") == "1",
+    pdf_workers=int(os.getenv("PDF_WORKERS", "1")),
+    llm_governor=llm_governor,
+    vector_storage=os.getenv("VECTOR_STORE", "chroma"),
+    query_batch_size=int(os.getenv("EMBED_QUERY_BATCH", "16")),
+    query_batch_wait_ms=float(os.getenv("EMBED_QUERY_WAIT_MS", "2")),
+    coalesce_timeout=float(os.getenv("COALESCE_TIMEOUT_SECONDS", "120")),
+    llm_model=os.getenv("LLM_MODEL", "llama-3.3-70b-versatile"),
+    small_llm_model=os.getenv("LLM_SMALL_MODEL", "llama-3.1-8b-instant"),
+    llm_routes=dict(r.split("=", 1) for r in os.getenv("LLM_ROUTES", "").replace(" ", "").split(",") if "=" in r),
+    llm_cascade=[t.strip() for t in os.getenv("LLM_CASCADE", "format").split(",")],
+    wiki_context_tokens=int(os.getenv("WIKI_CONTEXT_TOKENS", "350")),
+    on_writes_saved=user_versions.bump,
+    data_version=user_versions.get,
+    precompute_calls_per_minute=llm_rpm * float(os.getenv("PRECOMPUTE_LLM_SHARE", "0.25")) if llm_rpm > 0 else 0.0
+)
+
+# Resource sampling for /api/admin/resources. Uploads are refused while this
+# process's RSS is above MEMORY_WATERMARK_MB.
+watermark = os.getenv("MEMORY_WATERMARK_MB")
+resource_monitor = MemoryMonitor(
+    interval=float(os.getenv("RESOURCE_SAMPLE_SECONDS", "30")),
+    watermark_mb=float(watermark) if watermark else None,
+    chroma_dir=assistant.persist_directory
+)
+MEMORY_TRACING = os.getenv("MEMORY_TRACING", "0") == "1"
+# Comma-separated user ids allowed to call the admin endpoints
+ADMIN_USER_IDS = {u.strip() for u in os.getenv("ADMIN_USER_IDS", "").split(",") if u.strip()}
 
-# File upload configuration
+# Warm the embedding model, vector store and LLM client in background threads
+# so '/' and the auth routes answer immediately after startup. Other routes
+# block on the component they need until it is ready.
+warmup = WarmupOrchestrator()
+warmup.add_task("database", check_connection)
+for name, task in assistant.warmup_tasks().items():
+    warmup.add_task(name, task)
+
+if os.getenv("WARMUP_ON_STARTUP", "1") != "0":
+    warmup.start()
+
+@app.route('/api/warmup', methods=['GET'])
+def warmup_status():
+    return jsonify(warmup.status())
+
+# File upload configuration (accepted types are listed in uploads.EXPECTED_KINDS)
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploaded_docs")
-ALLOWED_EXTENSIONS = {"pdf", "doc", "docx", "ppt", "pptx", "txt", "md"}
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-def allowed_file(filename: str) -> bool:
-    return "." in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+MB = 1024 * 1024
+UPLOAD_MAX_FILES = int(os.getenv("UPLOAD_MAX_FILES", "5"))
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_MB", "50")) * MB
+# Larger request bodies are refused by werkzeug before any of them is read
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("UPLOAD_MAX_REQUEST_MB", "100")) * MB
+# Limits are per worker process
+upload_limiter = UploadLimiter(
+    max_concurrent=int(os.getenv("UPLOAD_MAX_CONCURRENT", "4")),
+    max_per_user=int(os.getenv("UPLOAD_MAX_PER_USER", "2")),
+    max_user_bytes=int(os.getenv("UPLOAD_MAX_USER_MB", "150")) * MB
+)
 
 # --- Auth Middleware ---
 def login_required(f):
@@ -60,7 +202,8 @@ def login_required(f):
         
         try:
             token = auth_header.split(" ")[1]
-            payload = decode_token(token)
+            with metrics.span("auth"):
+                payload = decode_token(token)
             if not payload or payload.get("type") != "access":
                 return jsonify({'message': 'Invalid or Expired Token'}), 401
             
@@ -71,6 +214,80 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def admin_required(f):
+    @wraps(f)
+    @login_required
+    def decorated_function(*args, **kwargs):
+        if request.user_id not in ADMIN_USER_IDS:
+            return jsonify({'message': 'Admin access required'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+def too_many_requests(e: RateLimitExceeded):
+    response = jsonify({'success': False, 'error': str(e), 'retry_after': round(e.retry_after, 1)})
+    response.headers['Retry-After'] = str(max(1, round(e.retry_after)))
+    return response, 429
+
+def rate_limited(f):
+    """Per-user token bucket; apply after login_required"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if user_limiter is not None:
+            try:
+                user_limiter.acquire(request.user_id)
+            except RateLimitExceeded as e:
+                return too_many_requests(e)
+        return f(*args, **kwargs)
+    return decorated_function
+
+def cached_per_user(f):
+    """ETag and cached body tied to the user's data version; apply after login_required
+
+    Only views whose response depends on nothing but the user's documents,
+    history, quiz results and course libraries (and the query string) may
+    use this.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Libraries are re-ingested out of process, so they carry their own version
+        version = (user_versions.get(request.user_id), assistant.libraries.version())
+        key = (request.path, request.query_string)
+        etag = response_cache.etag(request.user_id, key, version)
+        if request.if_none_match.contains_weak(etag):
+            response_cache.record_not_modified()
+            response = Response(status=304)
+        else:
+            cached = response_cache.get(request.user_id, key, version)
+            if cached is None:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                cached = response_cache.put(request.user_id, key, version, response.get_data(), response.mimetype)
+            body, encoding = cached.encoded(negotiate(request.headers.get("Accept-Encoding", "")))
+            response = Response(body, mimetype=cached.mimetype)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag, weak=True)
+        # Browsers keep the body but check back every time
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.update(('Authorization', 'Accept-Encoding'))
+        return response
+    return decorated_function
+
+def changes_user_data(f):
+    """Invalidate the user's cached responses once the view has run
+
+    Apply after login_required and rate_limited, so rejected requests keep
+    the cache.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        finally:
+            user_versions.bump(request.user_id)
+    return decorated_function
+
 # --- Auth Endpoints ---
 
 @app.route('/api/auth/signup', methods=['POST'])
@@ -144,6 +361,7 @@ def login():
 
 @app.route('/api/status', methods=['GET'])
 @login_required
+@cached_per_user
 def get_status():
     try:
         status = assistant.get_upload_status(request.user_id)
@@ -160,6 +378,7 @@ def get_status():
 
 @app.route('/api/dashboard', methods=['GET'])
 @login_required
+@cached_per_user
 def get_dashboard_stats():
     try:
         stats = assistant.get_dashboard_stats(request.user_id)
@@ -173,48 +392,57 @@ def get_dashboard_stats():
 
 @app.route('/api/upload_files', methods=['POST'])
 @login_required
+@changes_user_data
 def upload_files():
     try:
-        logger.info(f"Upload request received. Files: {request.files}, Form: {request.form}")
-        if 'files' not in request.files:
-            logger.error(f"No 'files' key in request.files. Keys: {list(request.files.keys())}, Form Keys: {list(request.form.keys())}, Content-Type: {request.content_type}")
-            return jsonify({'success': False, 'error': f'No files part in request. Content-Type: {request.content_type}'}), 400
-
-        files = request.files.getlist('files')
-        if not files:
-            return jsonify({'success': False, 'error': 'No files provided'}), 400
+        if request.mimetype != 'multipart/form-data' or 'boundary' not in request.mimetype_params:
+            return jsonify({'success': False, 'error': f'Expected a multipart upload. Content-Type: {request.content_type}'}), 400
+        logger.info(f"Upload request received from {request.user_id} ({request.content_length} bytes)")
+        if resource_monitor.over_watermark():
+            logger.warning("Refusing upload: memory is above the configured watermark")
+            return jsonify({'success': False, 'error': 'Server is low on memory, please try again later'}), 503
 
-        saved_paths = []
-        
-        # Create user specific upload dir to avoid collision? 
-        # Or just use unique filenames. Let's append timestamp/uuid to filename or keep simple for now.
-        # To keep simple and compatible with existing logic, we just save to UPLOAD_DIR.
-        # But for multi-user, we should ideally separate. 
-        # For now, we rely on the fact that we store the path in DB.
-        
-        for f in files:
-            filename = secure_filename(f.filename)
-            if not filename or not allowed_file(filename):
-                continue
-            
+        # Reserve the declared size (or the request limit for chunked bodies)
+        size = request.content_length or app.config["MAX_CONTENT_LENGTH"]
+        with upload_limiter.reserve(request.user_id, size):
             # Make unique to avoid overwriting other users' files with same name
-            unique_filename = f"{request.user_id}_{int(datetime.datetime.now().timestamp())}_{filename}"
-            target_path = os.path.abspath(os.path.join(UPLOAD_DIR, unique_filename))
-            f.save(target_path)
-            saved_paths.append(target_path)
+            saved, rejected = receive_files(
+                request.stream,
+                request.mimetype_params['boundary'].encode('latin-1'),
+                UPLOAD_DIR,
+                prefix=f"{request.user_id}_{int(datetime.datetime.now().timestamp())}_",
+                max_files=UPLOAD_MAX_FILES,
+                max_file_bytes=UPLOAD_MAX_FILE_BYTES
+            )
 
-        if not saved_paths:
-            return jsonify({'success': False, 'error': 'No valid files processed'}), 400
+            if not saved:
+                return jsonify({'success': False, 'error': 'No valid files processed', 'invalid_files': rejected}), 400
 
-        result = assistant.upload_materials(request.user_id, saved_paths)
+            with resource_monitor.track_job("upload", user_id=request.user_id, files=len(saved),
+                                            bytes=sum(f.size for f in saved)):
+                result = assistant.upload_materials(
+                    request.user_id,
+                    [f.path for f in saved],
+                    [f.name for f in saved],
+                    digests=[f.sha256 for f in saved]
+                )
+        if rejected:
+            result['invalid_files'] = rejected
 
         return jsonify({'success': result['status'] in ['success', 'warning'], 'result': result})
+    except UploadError as e:
+        logger.warning(f"Upload rejected for {request.user_id}: {e}")
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    except RequestEntityTooLarge:
+        return jsonify({'success': False, 'error': 'Upload is too large'}), 413
     except Exception as e:
         logger.error(f"Upload files error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/ask', methods=['POST'])
 @login_required
+@rate_limited
+@changes_user_data
 def ask_question():
     try:
         data = request.json
@@ -223,9 +451,9 @@ def ask_question():
         if not question:
             return jsonify({'success': False, 'error': 'No question provided'}), 400
         
-        # Check if user has documents
+        # Check if user has documents (their own or in a course library)
         status = assistant.get_upload_status(request.user_id)
-        if status.get("uploaded_documents", 0) == 0:
+        if status.get("uploaded_documents", 0) + status.get("library_documents", 0) == 0:
              # Use Wikipedia directly if no documents
              result = assistant.rag_system.search_wikipedia(question)
              return jsonify({
@@ -275,12 +503,15 @@ def ask_question():
             'sources': result.get('sources', []),
             'type': 'documents'
         })
+    except RateLimitExceeded as e:
+        return too_many_requests(e)
     except Exception as e:
         logger.error(f"Question error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/summarize', methods=['POST'])
 @login_required
+@rate_limited
 def summarize_topic():
     try:
         data = request.json
@@ -290,10 +521,10 @@ def summarize_topic():
             return jsonify({'success': False, 'error': 'No topic provided'}), 400
         
         status = assistant.get_upload_status(request.user_id)
-        if status.get("uploaded_documents", 0) == 0:
+        if status.get("uploaded_documents", 0) + status.get("library_documents", 0) == 0:
             return jsonify({
                 'success': False, 
-                'error': '📤 No documents uploaded yet. Please upload course materials first to generate summaries!'
+                'error': '📤 No documents uploaded yet. Please upload course materials or subscribe to a course library first to generate summaries!'
             }), 200
         
         summary = assistant.summarize_notes(request.user_id, topic)
@@ -302,12 +533,15 @@ def summarize_topic():
             'success': True,
             'summary': summary
         })
+    except RateLimitExceeded as e:
+        return too_many_requests(e)
     except Exception as e:
         logger.error(f"Summarize error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/quiz', methods=['POST'])
 @login_required
+@rate_limited
 def generate_quiz():
     try:
         data = request.json
@@ -318,10 +552,10 @@ def generate_quiz():
             return jsonify({'success': False, 'error': 'No topic provided'}), 400
         
         status = assistant.get_upload_status(request.user_id)
-        if status.get("uploaded_documents", 0) == 0:
+        if status.get("uploaded_documents", 0) + status.get("library_documents", 0) == 0:
             return jsonify({
                 'success': False,
-                'error': '📤 No documents uploaded yet. Please upload course materials first to generate quizzes!'
+                'error': '📤 No documents uploaded yet. Please upload course materials or subscribe to a course library first to generate quizzes!'
             }), 200
         
         quiz = assistant.generate_practice_quiz(request.user_id, topic, num_questions)
@@ -330,12 +564,15 @@ def generate_quiz():
             'success': True,
             'quiz': quiz
         })
+    except RateLimitExceeded as e:
+        return too_many_requests(e)
     except Exception as e:
         logger.error(f"Quiz error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/quiz/submit', methods=['POST'])
 @login_required
+@changes_user_data
 def submit_quiz_result():
     try:
         data = request.json
@@ -358,6 +595,7 @@ def submit_quiz_result():
 
 @app.route('/api/history', methods=['GET'])
 @login_required
+@cached_per_user
 def get_history():
     try:
         limit = request.args.get('limit', 10, type=int)
@@ -373,6 +611,7 @@ def get_history():
 
 @app.route('/api/clear', methods=['POST'])
 @login_required
+@changes_user_data
 def clear_documents():
     try:
         result = assistant.clear_all_documents(request.user_id)
@@ -384,8 +623,50 @@ def clear_documents():
         logger.error(f"Clear error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# --- Course Libraries ---
+
+@app.route('/api/libraries', methods=['GET'])
+@login_required
+def list_libraries():
+    try:
+        subscribed = set(assistant.libraries.subscriptions(request.user_id))
+        libraries = [{**library, 'subscribed': library['id'] in subscribed}
+                     for library in assistant.libraries.list()]
+        return jsonify({'success': True, 'libraries': libraries})
+    except Exception as e:
+        logger.error(f"Library list error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/libraries/<library_id>/subscribe', methods=['POST', 'DELETE'])
+@login_required
+@changes_user_data
+def library_subscription(library_id):
+    try:
+        if request.method == 'DELETE':
+            assistant.unsubscribe_library(request.user_id, library_id)
+            return jsonify({'success': True, 'message': f'Unsubscribed from {library_id}'})
+        if not assistant.subscribe_library(request.user_id, library_id):
+            return jsonify({'success': False, 'error': 'Library not found'}), 404
+        return jsonify({'success': True, 'message': f'Subscribed to {library_id}'})
+    except Exception as e:
+        logger.error(f"Library subscription error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/admin/resources', methods=['GET'])
+@admin_required
+def resource_report():
+    try:
+        return jsonify({'success': True, 'resources': resource_monitor.report(), 'llm': llm_governor.status(),
+                        'coalescing': assistant.in_flight.status(), 'models': assistant.llm_router.stats(),
+                        'writes': assistant.writes.stats(), 'http_cache': response_cache.stats()})
+    except Exception as e:
+        logger.error(f"Resource report error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 if __name__ == '__main__':
     print("Starting Smart Campus Assistant Server (Multi-User)...")
+    from model.retrieval_service import claim_store
     from waitress import serve
+    claim_store(assistant.persist_directory)
     serve(app, host='0.0.0.0', port=5000)
 
@@ -0,0 +1,4 @@
+"""
+Smart Campus Assistant - Benchmarks
+Run from the backend directory, e.g. ``python -m benchmarks.startup_importtime``
+"""
@@ -0,0 +1,144 @@
+"""
+Query-embedding throughput and latency with and without micro-batching.
+
+Concurrent clients call EmbeddingManager.embed_query with a question each,
+as waitress threads do for /api/ask (or sidecar threads for every worker).
+Each concurrency level runs with batching off (query_batch_size=1) and on,
+and reports queries/sec, p50/p95 latency and the mean batch size.
+
+The real MiniLM model is used when it can be loaded. Otherwise (no cached
+model offline) a randomly initialised BERT of the same shape stands in:
+6 layers, hidden size 384, 12 heads, with words hashed to token ids. Its
+forward pass costs the same, so timings carry over; the vectors do not.
+
+    python -m benchmarks.embedding_batching [--concurrency 1 4 16 32] [--queries 256] [--wait-ms 2]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.embeddings import Embeddings
+
+from benchmarks.load_test import _git_commit, _percentile
+from benchmarks.splitter_throughput import WORDS
+from model.embeddings import EmbeddingManager
+
+
+class MiniLMShapedEncoder(Embeddings):
+    """all-MiniLM-L6-v2 architecture with random weights"""
+
+    def __init__(self):
+        import torch
+        from transformers import BertConfig, BertModel
+
+        self.torch = torch
+        self.model = BertModel(BertConfig(hidden_size=384, num_hidden_layers=6, num_attention_heads=12,
+                                          intermediate_size=1536, vocab_size=30522)).eval()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        torch = self.torch
+        ids = [[101] + [1000 + zlib.crc32(w.encode()) % 29000 for w in t.lower().split()][:254] + [102]
+               for t in texts]
+        width = max(len(i) for i in ids)
+        input_ids = torch.tensor([i + [0] * (width - len(i)) for i in ids])
+        mask = (input_ids != 0).long()
+        with torch.inference_mode():
+            hidden = self.model(input_ids=input_ids, attention_mask=mask).last_hidden_state
+            pooled = (hidden * mask[..., None]).sum(1) / mask.sum(1, keepdim=True)
+            return torch.nn.functional.normalize(pooled, dim=1).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def manager(batch_size: int, wait_ms: float, encoder) -> EmbeddingManager:
+    m = EmbeddingManager(lazy=True, query_batch_size=batch_size, query_batch_wait_ms=wait_ms)
+    m._embeddings = encoder
+    return m
+
+
+def run(m: EmbeddingManager, concurrency: int, questions: List[str]) -> dict:
+    latencies = []
+    lock = threading.Lock()
+    pending = list(questions)
+
+    def client():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                question = pending.pop()
+            start = time.perf_counter()
+            m.embed_query(question)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    seconds = time.perf_counter() - start
+    stats = m.query_batcher.stats() if m.query_batcher else {"mean_batch_size": 1.0}
+    return {
+        "qps": round(len(latencies) / seconds, 1),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+        "mean_batch_size": stats["mean_batch_size"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--queries", type=int, default=256, help="queries per run")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--wait-ms", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    try:
+        encoder = EmbeddingManager().embeddings
+        model = encoder.model_name
+    except Exception:
+        encoder = MiniLMShapedEncoder()
+        model = "random-weight MiniLM-shaped BERT"
+
+    rng = random.Random(args.seed)
+    questions = [f"What is {' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 14)))}?"
+                 for _ in range(args.queries)]
+    encoder.embed_documents(questions[:8])  # warm up
+
+    rows = []
+    for concurrency in args.concurrency:
+        single = run(manager(1, args.wait_ms, encoder), concurrency, questions)
+        batched = run(manager(args.batch_size, args.wait_ms, encoder), concurrency, questions)
+        rows.append({
+            "concurrency": concurrency,
+            "unbatched": single,
+            "batched": batched,
+            "throughput_gain": round(batched["qps"] / single["qps"], 2),
+        })
+
+    print(json.dumps({
+        "commit": _git_commit(),
+        "model": model,
+        "cpus": os.cpu_count(),
+        "batch_size": args.batch_size,
+        "wait_ms": args.wait_ms,
+        "results": rows,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Loading throughput of EnhancedDocumentLoader per file format.
+
+Writes a synthetic corpus per format (the generators of offline_app), loads
+every file with EnhancedDocumentLoader and reports files/sec, MB/sec and
+documents produced. For .docx the previous path, unstructured's
+UnstructuredWordDocumentLoader, is timed on the same files when installed.
+
+    python -m benchmarks.format_throughput [--files 20] [--size 12]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import _git_commit
+from benchmarks.offline_app import write_docx, write_pdf, write_pptx, write_text
+from model.document_loader import EnhancedDocumentLoader
+
+# Extension -> writer(path, size, rng); size is pages, slides, sections or paragraphs
+WRITERS = {
+    "pdf": write_pdf,
+    "docx": write_docx,
+    "pptx": write_pptx,
+    "txt": lambda path, size, rng: write_text(path, size * 3, rng),
+}
+
+
+def timed(load, paths: list) -> dict:
+    start = time.perf_counter()
+    documents = sum(len(load(path)) for path in paths)
+    seconds = time.perf_counter() - start
+    mb = sum(os.path.getsize(path) for path in paths) / 1e6
+    return {
+        "seconds": round(seconds, 3),
+        "files_per_sec": round(len(paths) / seconds, 1),
+        "mb_per_sec": round(mb / seconds, 2),
+        "documents": documents,
+    }
+
+
+def unstructured_load(path: str) -> list:
+    from langchain_community.document_loaders import UnstructuredWordDocumentLoader
+
+    return UnstructuredWordDocumentLoader(path).load()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=20, help="files per format")
+    parser.add_argument("--size", type=int, default=12, help="pages, slides or sections per file")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for extension, write in WRITERS.items():
+            paths = [os.path.join(tmp, f"{extension}_{i}.{extension}") for i in range(args.files)]
+            for path in paths:
+                write(path, args.size, rng)
+            results[extension] = {
+                "mb": round(sum(os.path.getsize(p) for p in paths) / 1e6, 2),
+                "loader": timed(lambda p: EnhancedDocumentLoader(p).load(), paths),
+            }
+            if extension == "docx":
+                try:
+                    import unstructured  # noqa: F401
+                    results[extension]["unstructured"] = timed(unstructured_load, paths)
+                except ImportError:
+                    results[extension]["unstructured"] = "not installed"
+
+    print(json.dumps({
+        "commit": _git_commit(),
+        "files_per_format": args.files,
+        "size": args.size,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
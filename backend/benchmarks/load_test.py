@@ -0,0 +1,209 @@
+"""
+Offline load test of the backend: ingestion throughput, /api/ask latency
+under concurrency and memory, with no network services.
+
+The app runs in-process behind Flask's test client with the stand-ins from
+benchmarks.offline_app (fake LLM with a fixed latency, stub Wikipedia,
+mongomock, temporary Chroma directory). A seeded corpus of PDFs, PPTX decks
+and text notes is uploaded through /api/upload_files, then /api/ask is
+driven at each concurrency level. Results are JSON keyed by the current git
+commit, so runs can be diffed between commits (keep the same arguments).
+
+    python -m benchmarks.load_test [--concurrency 1 4 16] [--requests 48] [--output results.json]
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psutil
+
+from benchmarks.offline_app import boot_app, build_corpus
+from benchmarks.splitter_throughput import WORDS
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 2**20
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def _rss_mb() -> float:
+    return round(psutil.Process().memory_info().rss / MB, 1)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def signup(client) -> str:
+    resp = client.post("/api/auth/signup", json={
+        "email": f"load-{uuid.uuid4().hex[:8]}@example.com", "password": "benchmark", "name": "Load Test"
+    })
+    return resp.get_json()["accessToken"]
+
+
+def ingest(flask_app, token: str, paths: list, batch: int) -> dict:
+    client = flask_app.app.test_client()
+    headers = {"Authorization": f"Bearer {token}"}
+    total_bytes = sum(os.path.getsize(p) for p in paths)
+    chunks, failures = 0, []
+
+    start = time.perf_counter()
+    for i in range(0, len(paths), batch):
+        files = [(open(p, "rb"), os.path.basename(p)) for p in paths[i:i + batch]]
+        try:
+            resp = client.post("/api/upload_files", headers=headers, data={"files": files},
+                               content_type="multipart/form-data")
+        finally:
+            for handle, _ in files:
+                handle.close()
+        body = resp.get_json() or {}
+        if resp.status_code != 200 or not body.get("success"):
+            failures.append({"status": resp.status_code, "error": body.get("error") or body.get("result")})
+            continue
+        chunks += body["result"].get("added", 0)
+    seconds = time.perf_counter() - start
+
+    jobs = [j for j in flask_app.resource_monitor.jobs if j["kind"] == "upload"]
+    return {
+        "files": len(paths),
+        "mb": round(total_bytes / MB, 2),
+        "seconds": round(seconds, 2),
+        "files_per_sec": round(len(paths) / seconds, 2),
+        "mb_per_sec": round(total_bytes / MB / seconds, 2),
+        "chunks_added": chunks,
+        "chunks_per_sec": round(chunks / seconds, 1),
+        "peak_rss_mb": max((j["peak_rss_mb"] for j in jobs), default=None),
+        "peak_delta_mb": max((j["peak_delta_mb"] for j in jobs), default=None),
+        "failures": failures,
+    }
+
+
+def questions(seed: int, n: int) -> list:
+    rng = random.Random(seed)
+    openers = ["What is", "Explain", "Summarise what the notes say about", "How does"]
+    asked = []
+    for i in range(n):
+        if asked and i % 4 == 3:
+            asked.append("What are its main uses?")  # follow-up, exercises conversation memory
+        else:
+            asked.append(f"{rng.choice(openers)} {rng.choice(WORDS)} {rng.choice(WORDS)}?")
+    return asked
+
+
+def run_ask(flask_app, token: str, concurrency: int, asked: list) -> dict:
+    latencies, errors = [], []
+    lock = threading.Lock()
+    queue = list(asked)
+
+    def worker():
+        client = flask_app.app.test_client()
+        headers = {"Authorization": f"Bearer {token}"}
+        while True:
+            with lock:
+                if not queue:
+                    return
+                question = queue.pop()
+            start = time.perf_counter()
+            resp = client.post("/api/ask", headers=headers, json={"question": question})
+            elapsed = time.perf_counter() - start
+            with lock:
+                if resp.status_code == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(resp.status_code)
+
+    rss_before = _rss_mb()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    seconds = time.perf_counter() - start
+
+    ms = lambda v: None if v is None else round(v * 1000, 1)  # noqa: E731
+    return {
+        "concurrency": concurrency,
+        "requests": len(asked),
+        "ok": len(latencies),
+        "errors": len(errors),
+        "error_statuses": sorted(set(errors)),
+        "rps": round(len(latencies) / seconds, 2),
+        "p50_ms": ms(_percentile(latencies, 50)),
+        "p95_ms": ms(_percentile(latencies, 95)),
+        "p99_ms": ms(_percentile(latencies, 99)),
+        "rss_before_mb": rss_before,
+        "rss_after_mb": _rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pdfs", type=int, default=6)
+    parser.add_argument("--pdf-pages", type=int, default=12)
+    parser.add_argument("--pptx", type=int, default=4)
+    parser.add_argument("--texts", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=5, help="files per upload request")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=48, help="/api/ask requests per concurrency level")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="LLM_MAX_CONCURRENT")
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="use hash embeddings even if sentence-transformers is installed")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        rss_start = _rss_mb()
+        flask_app, fake_embeddings = boot_app(workdir, args.llm_latency, args.llm_concurrency,
+                                              fake_embeddings=args.fake_embeddings or None)
+        paths = build_corpus(os.path.join(workdir, "corpus"), args.pdfs, args.pptx, args.texts,
+                             pdf_pages=args.pdf_pages, seed=args.seed)
+        token = signup(flask_app.app.test_client())
+
+        ingestion = ingest(flask_app, token, paths, args.batch)
+        ask = [run_ask(flask_app, token, c, questions(args.seed + c, args.requests)) for c in args.concurrency]
+        flask_app.assistant.writes.flush()
+
+        results = {
+            "commit": _git_commit(),
+            "timestamp": int(time.time()),
+            "config": {k: v for k, v in vars(args).items() if k != "output"},
+            "embeddings": "fake" if fake_embeddings else "sentence-transformers",
+            "ingestion": ingestion,
+            "ask": ask,
+            "memory": {
+                "rss_start_mb": rss_start,
+                "rss_end_mb": _rss_mb(),
+                "chroma_disk_mb": flask_app.resource_monitor.sample().get("chroma_disk_mb"),
+            },
+        }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
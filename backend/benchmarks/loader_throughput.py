@@ -0,0 +1,100 @@
+"""
+PDF loading throughput of EnhancedDocumentLoader on the sample PDFs.
+
+Compares the original loader (pdfplumber extract_text() and
+extract_tables() on every page) with the current one (pdfium text,
+pdfplumber only on pages with ruling lines), serially and with page-range
+sharding. The sample PDFs are concatenated --repeat times into one file so
+sharding has pages to spread. "has_tables_agree" checks that both loaders
+flag the same pages as containing tables.
+
+    python -m benchmarks.loader_throughput [--repeat 20] [--workers 4]
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdfplumber
+import pypdfium2
+
+from model.document_loader import EnhancedDocumentLoader
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sample_pdfs() -> list:
+    return sorted(glob.glob(os.path.join(BACKEND_DIR, "uploaded_docs", "*.pdf")))
+
+
+def concatenate(paths: list, repeat: int, out_path: str) -> int:
+    combined = pypdfium2.PdfDocument.new()
+    for _ in range(repeat):
+        for path in paths:
+            source = pypdfium2.PdfDocument(path)
+            combined.import_pages(source)
+            source.close()
+    pages = len(combined)
+    combined.save(out_path)
+    combined.close()
+    return pages
+
+
+def legacy_load(path: str) -> list:
+    """The original loader: text and tables extracted from every page"""
+    flags = []
+    with pdfplumber.open(path) as pdf:
+        for page in pdf.pages:
+            text = page.extract_text() or ""
+            tables = page.extract_tables()
+            if text.strip() or tables:
+                flags.append((page.page_number, len(tables) > 0))
+    return flags
+
+
+def timed(fn, pages: int) -> dict:
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    return {"seconds": round(seconds, 3), "pages_per_sec": round(pages / seconds, 1)}, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    paths = sample_pdfs()
+    if not paths:
+        sys.exit("No PDFs found in uploaded_docs/")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "combined.pdf")
+        pages = concatenate(paths, args.repeat, path)
+
+        legacy, legacy_flags = timed(lambda: legacy_load(path), pages)
+        serial, docs = timed(lambda: EnhancedDocumentLoader(path).load(), pages)
+        sharded, sharded_docs = timed(lambda: EnhancedDocumentLoader(path, max_workers=args.workers).load(), pages)
+
+    flags = [(d.metadata["page"], d.metadata["has_tables"]) for d in docs]
+    print(json.dumps({
+        "sample_files": len(paths),
+        "pages": pages,
+        "legacy": legacy,
+        "fast_path": serial,
+        f"fast_path_{args.workers}_workers": sharded,
+        "speedup": round(legacy["seconds"] / serial["seconds"], 1),
+        "pages_with_tables": sum(1 for _, has in legacy_flags if has),
+        "has_tables_agree": flags == legacy_flags,
+        "sharded_matches_serial": [d.page_content for d in docs] == [d.page_content for d in sharded_docs],
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+The Flask app wired to offline stand-ins, plus a synthetic upload corpus.
+
+Used by the load-test benchmark so runs need no Groq key, Wikipedia, MongoDB
+server or network:
+
+- ChatGroq is replaced by FakeChatModel, which sleeps for a configurable
+  latency and returns a fixed-length answer (or quiz JSON for quiz prompts)
+- Wikipedia is replaced by StubWikipedia
+- pymongo.MongoClient is replaced by mongomock before the app is imported
+- Chroma and uploads go to a temporary directory
+- Embeddings use sentence-transformers when installed, otherwise
+  deterministic hash embeddings of the same size (reported in the results)
+"""
+import json
+import os
+import random
+import re
+import sys
+import time
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from benchmarks.splitter_throughput import WORDS
+
+EMBEDDING_SIZE = 384  # all-MiniLM-L6-v2
+
+
+class FakeChatModel(BaseChatModel):
+    """Stand-in for ChatGroq with a simulated completion latency"""
+
+    latency: float = 0.2
+    jitter: float = 0.05
+    answer_words: int = 120
+    seed: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        prompt = "\n".join(str(m.content) for m in messages)
+        rng = random.Random(hash(prompt) ^ self.seed)
+        time.sleep(max(0.0, rng.gauss(self.latency, self.jitter)))
+
+        match = re.search(r"multiple choice quiz with (\d+) questions", prompt)
+        if match:
+            content = json.dumps([self._question(rng, i) for i in range(int(match.group(1)))])
+        else:
+            content = "- " + " ".join(rng.choice(WORDS) for _ in range(self.answer_words))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    @staticmethod
+    def _question(rng: random.Random, i: int) -> dict:
+        options = [" ".join(rng.choice(WORDS) for _ in range(3)) for _ in range(4)]
+        return {
+            "question": f"Question {i} about " + " ".join(rng.choice(WORDS) for _ in range(8)) + "?",
+            "options": options,
+            "correct_answer": options[0],
+            "explanation": " ".join(rng.choice(WORDS) for _ in range(12)),
+        }
+
+
+class StubWikipedia:
+    """Stand-in for WikipediaQueryRun: three page summaries, cut at 4000 characters"""
+
+    def __init__(self, latency: float = 0.1):
+        self.latency = latency
+
+    def run(self, query: str) -> str:
+        time.sleep(self.latency)
+        rng = random.Random(query)
+        pages = []
+        for title in (query, f"{query} (theory)", f"History of {query}"):
+            sentences = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 22))).capitalize() + "."
+                         for _ in range(12)]
+            sentences[0] = f"{query.capitalize()} is a {sentences[0][0].lower()}{sentences[0][1:]}"
+            pages.append(f"Page: {title}\nSummary: " + " ".join(sentences))
+        return "\n\n".join(pages)[:4000]
+
+
+def boot_app(workdir: str, llm_latency: float = 0.2, llm_concurrency: int = 4,
+             fake_embeddings: Optional[bool] = None):
+    """Import app.py against mongomock and a temporary data directory
+
+    Returns:
+        (app module, whether embeddings are faked)
+    """
+    import mongomock
+    import pymongo
+
+    pymongo.MongoClient = lambda *args, **kwargs: mongomock.MongoClient()
+    # mongomock 4.3 predates the sort argument newer pymongo passes for
+    # bulk_write updates
+    from mongomock.collection import BulkOperationBuilder
+    add_update = BulkOperationBuilder.add_update
+    BulkOperationBuilder.add_update = lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs)
+    os.environ.update({
+        "GROQ_API_KEY": "offline-benchmark",
+        "WARMUP_ON_STARTUP": "0",
+        "REQUEST_TIMING_LOG": "0",
+        "ANONYMIZED_TELEMETRY": "False",
+        "USER_REQUESTS_PER_MINUTE": "1000000",
+        "LLM_REQUESTS_PER_MINUTE": "1000000",
+        "LLM_MAX_CONCURRENT": str(llm_concurrency),
+        "UPLOAD_MAX_PER_USER": "64",
+        "UPLOAD_MAX_CONCURRENT": "64",
+    })
+
+    import app as flask_app
+
+    uploads = os.path.join(workdir, "uploads")
+    os.makedirs(uploads, exist_ok=True)
+    flask_app.UPLOAD_DIR = uploads
+
+    assistant = flask_app.assistant
+    assistant.persist_directory = os.path.join(workdir, "campus_rag_db")
+    os.makedirs(assistant.persist_directory, exist_ok=True)
+    flask_app.resource_monitor.chroma_dir = assistant.persist_directory
+    assistant.chat_model_factory = lambda name: FakeChatModel(latency=llm_latency)
+    assistant._components["wiki_tool"] = StubWikipedia()
+
+    if fake_embeddings is None:
+        try:
+            # sentence-transformers may be installed without the model cached
+            assistant.embedding_manager.warm()
+            fake_embeddings = False
+        except Exception:
+            fake_embeddings = True
+    if fake_embeddings:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        manager = assistant.embedding_manager
+        manager._embeddings = DeterministicFakeEmbedding(size=EMBEDDING_SIZE)
+
+    _quiet_logging()
+    return flask_app, fake_embeddings
+
+
+def _quiet_logging():
+    import logging
+    for name in ("app", "model", "uploads", "chromadb", "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+# --- Synthetic corpus -------------------------------------------------------
+
+def _sentence(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 18))).capitalize() + "."
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: int, rng: random.Random, table_every: int = 4,
+              page_sentences: Optional[List[List[str]]] = None):
+    """Text PDF with one Helvetica line per sentence and a ruled table on some pages
+
+    ``page_sentences`` gives the sentences of each page instead of random ones.
+    """
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        lines = [f"BT /F1 14 Tf 72 740 Td ({_pdf_escape(f'Unit {page + 1}: ' + rng.choice(WORDS).title())}) Tj ET"]
+        y = 710
+        sentences = page_sentences[page] if page_sentences else [_sentence(rng) for _ in range(24)]
+        for sentence in sentences:
+            lines.append(f"BT /F1 10 Tf 72 {y} Td ({_pdf_escape(sentence)}) Tj ET")
+            y -= 14
+        if table_every and page % table_every == 0:
+            top, rows = y - 10, 4
+            for r in range(rows + 1):
+                lines.append(f"72 {top - r * 18} m 472 {top - r * 18} l S")
+            for x in (72, 272, 472):
+                lines.append(f"{x} {top} m {x} {top - rows * 18} l S")
+            for r in range(rows):
+                for x in (76, 276):
+                    lines.append(f"BT /F1 9 Tf {x} {top - r * 18 - 13} Td ({rng.choice(WORDS)}) Tj ET")
+        stream = "\n".join(lines)
+        content_id = len(objects) + 1
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {content_id} 0 R "
+                       f"/Resources << /Font << /F1 3 0 R >> >> >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+
+    out, offsets = "%PDF-1.4\n", []
+    for i, obj in enumerate(objects):
+        offsets.append(len(out.encode("latin-1")))
+        out += f"{i + 1} 0 obj\n{obj}\nendobj\n"
+    xref = len(out.encode("latin-1"))
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF"
+    with open(path, "wb") as f:
+        f.write(out.encode("latin-1"))
+
+
+def write_pptx(path: str, slides: int, rng: random.Random):
+    from pptx import Presentation
+
+    prs = Presentation()
+    layout = prs.slide_layouts[1]  # Title and Content
+    for i in range(slides):
+        slide = prs.slides.add_slide(layout)
+        slide.shapes.title.text = f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}"
+        body = slide.placeholders[1].text_frame
+        body.text = _sentence(rng)
+        for _ in range(4):
+            body.add_paragraph().text = _sentence(rng)
+    prs.save(path)
+
+
+def write_docx(path: str, sections: int, rng: random.Random, table_every: int = 3):
+    import docx
+
+    document = docx.Document()
+    document.add_paragraph(f"{rng.choice(WORDS).title()} notes", style="Title")
+    for i in range(sections):
+        document.add_heading(f"{rng.choice(WORDS).title()} {rng.choice(WORDS)}", level=1 + i % 2)
+        for _ in range(4):
+            document.add_paragraph(" ".join(_sentence(rng) for _ in range(rng.randint(2, 5))))
+        document.add_paragraph(_sentence(rng), style="List Bullet")
+        if i % table_every == 0:
+            table = document.add_table(rows=4, cols=3)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = " ".join(rng.choice(WORDS) for _ in range(2))
+    document.save(path)
+
+
+def write_text(path: str, paragraphs: int, rng: random.Random):
+    parts = []
+    for i in range(paragraphs):
+        if path.endswith(".md") and i % 5 == 0:
+            parts.append(f"## {rng.choice(WORDS).title()} {rng.choice(WORDS)}")
+        parts.append(" ".join(_sentence(rng) for _ in range(rng.randint(3, 7))))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(parts))
+
+
+def build_corpus(directory: str, pdfs: int = 6, pptx: int = 4, texts: int = 4,
+                 pdf_pages: int = 12, slides: int = 15, seed: int = 7) -> List[str]:
+    """Write a deterministic mix of PDFs, PPTX decks and text/markdown notes"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(pdfs):
+        paths.append(os.path.join(directory, f"lecture_{i}.pdf"))
+        write_pdf(paths[-1], pdf_pages, rng)
+    for i in range(pptx):
+        paths.append(os.path.join(directory, f"slides_{i}.pptx"))
+        write_pptx(paths[-1], slides, rng)
+    for i in range(texts):
+        paths.append(os.path.join(directory, f"notes_{i}.{'md' if i % 2 else 'txt'}"))
+        write_text(paths[-1], 30, rng)
+    return paths
@@ -0,0 +1,269 @@
+"""
+Retrieval quality and latency across splitter, retriever and embedding settings.
+
+Indexes a corpus once per (embedding backend, chunk_size, chunk_overlap,
+parent_chunk_size) with the production IngestionPipeline, then runs every
+labelled question through ParentChildRetriever for each (k,
+fetch_multiplier). Reported side by side per configuration:
+
+- recall@k: share of a question's expected sources among the k results
+- hit@k: questions with at least one expected source in the results
+- MRR: mean of 1 / rank of the first expected source (0 if none)
+- index size (chunks, parents, disk) and ingestion time
+- query latency (p50/p95 of the retriever call)
+
+Rows are sorted by recall, then MRR, then p50 latency, so the top row is
+the most accurate configuration and ties go to the faster one.
+
+The labelled set is a JSON list of {"question": ..., "sources": [...]}, where
+each source is a file name in the corpus directory, optionally with
+"#<page or slide>" to require that page, e.g. "lecture_2.pdf#5". Without
+--questions a synthetic set is generated: PDFs whose pages each describe a
+made-up term, asked about by that term. It is a reproducible smoke test of
+the pipeline, not a substitute for real course material.
+
+Embedding backends are HuggingFace model names, or "hashing" for a bag of
+words baseline that needs no model download.
+
+    python -m benchmarks.retrieval_eval [--questions labels.json --corpus docs/]
+        [--embeddings hashing sentence-transformers/all-MiniLM-L6-v2]
+        [--chunk-sizes 150 250] [--overlaps 0 30] [--parent-sizes 800] [--k 2 4 6]
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import zlib
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from benchmarks.load_test import _git_commit, _percentile
+from benchmarks.offline_app import write_pdf
+from benchmarks.splitter_throughput import WORDS
+from model.utils import directory_size
+
+MB = 2**20
+OWNER = "eval"
+TOKEN = re.compile(r"\w+")
+
+
+class HashingEmbeddings(Embeddings):
+    """Normalised set-of-words vectors with hashed token buckets
+
+    Presence rather than counts, so words common to every chunk do not
+    drown out the rare ones a question is about.
+    """
+
+    def __init__(self, size: int = 1024):
+        self.size = size
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for token in set(TOKEN.findall(text.lower())):
+            vector[zlib.crc32(token.encode("utf-8")) % self.size] = 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def load_embeddings(backend: str) -> Embeddings:
+    if backend == "hashing":
+        return HashingEmbeddings()
+    from model.embeddings import EmbeddingManager
+    return EmbeddingManager(backend).embeddings
+
+
+def synthetic_set(directory: str, files: int, pages: int, seed: int) -> list:
+    """PDFs with one made-up term per page, and a question per page naming it"""
+    rng = random.Random(seed)
+    syllables = ["ka", "lo", "mi", "ren", "tor", "vex", "zu", "pha", "dri", "nol", "sen", "qua"]
+    terms = set()
+    while len(terms) < files * pages:
+        terms.add("".join(rng.choice(syllables) for _ in range(3)))
+    terms = sorted(terms)
+    rng.shuffle(terms)
+
+    def sentence(extra: str = "") -> str:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 12))]
+        if extra:
+            words.insert(rng.randrange(len(words)), extra)
+        return " ".join(words).capitalize() + "."
+
+    os.makedirs(directory, exist_ok=True)
+    labels = []
+    for f in range(files):
+        name = f"unit_{f}.pdf"
+        page_sentences = []
+        for p in range(pages):
+            term, related = terms[f * pages + p], rng.choice(WORDS)
+            body = [sentence() for _ in range(18)]
+            # The term appears in a few places on its page, once next to the
+            # word the question pairs it with
+            for i in rng.sample(range(len(body)), 3):
+                body[i] = sentence(term)
+            body[rng.randrange(len(body))] = sentence(f"{term} {related}")
+            page_sentences.append(body)
+            labels.append({"question": f"What is {term} in {related}?", "sources": [f"{name}#{p + 1}"]})
+        write_pdf(os.path.join(directory, name), pages, rng, table_every=0, page_sentences=page_sentences)
+    return labels
+
+
+def _labels(doc) -> set:
+    """The source labels a retrieved document satisfies: its file, and its file#page"""
+    name = doc.metadata.get("document_name") or doc.metadata.get("source_file", "")
+    page = doc.metadata.get("page", doc.metadata.get("slide"))
+    return {name, f"{name}#{page}"} if page is not None else {name}
+
+
+def score(ranked: List[list], labels: list) -> dict:
+    """recall@k, hit@k and MRR of ranked results against the expected sources"""
+    recalls, hits, reciprocal = [], [], []
+    for docs, label in zip(ranked, labels):
+        expected = set(label["sources"])
+        relevant = [bool(_labels(d) & expected) for d in docs]
+        matched = expected & set().union(*(_labels(d) for d in docs))
+        recalls.append(len(matched) / len(expected))
+        hits.append(any(relevant))
+        reciprocal.append(next((1 / (i + 1) for i, r in enumerate(relevant) if r), 0.0))
+    n = len(labels)
+    return {
+        "recall": round(sum(recalls) / n, 4),
+        "hit_rate": round(sum(hits) / n, 4),
+        "mrr": round(sum(reciprocal) / n, 4),
+    }
+
+
+def build_index(workdir: str, paths: List[str], embeddings: Embeddings, splitter_config: dict) -> tuple:
+    import mongomock
+    from langchain_chroma import Chroma
+
+    from model.ingestion import IngestionPipeline
+    from model.parent_retrieval import ParentStore
+    from model.text_splitter import SmartTextSplitter
+
+    os.makedirs(workdir)
+    vector_store = Chroma(persist_directory=workdir, embedding_function=embeddings)
+    parent_store = ParentStore(os.path.join(workdir, "parents.sqlite3"))
+    pipeline = IngestionPipeline(SmartTextSplitter(**splitter_config), vector_store, parent_store,
+                                 mongomock.MongoClient().db.manifests)
+
+    chunks = parents = 0
+    start = time.perf_counter()
+    for path in paths:
+        stats = pipeline.ingest_file(OWNER, path, os.path.basename(path))
+        if stats:
+            chunks += stats["chunks"]
+    seconds = time.perf_counter() - start
+    for manifest in pipeline.manifests.find({"user_id": OWNER}):
+        parents += len(manifest["parents"])
+
+    index = {
+        "ingest_seconds": round(seconds, 2),
+        "chunks": chunks,
+        "parents": parents,
+        "chunks_per_sec": round(chunks / seconds, 1),
+        "index_mb": round(directory_size(workdir) / MB, 2),
+    }
+    return vector_store, parent_store, index
+
+
+def evaluate(vector_store, parent_store, labels: list, k: int, fetch_multiplier: int) -> dict:
+    from model.parent_retrieval import ParentChildRetriever
+
+    retriever = ParentChildRetriever(vector_store=vector_store, parent_store=parent_store, k=k,
+                                     fetch_multiplier=fetch_multiplier, search_filter={"user_id": OWNER})
+    ranked, latencies = [], []
+    for label in labels:
+        start = time.perf_counter()
+        ranked.append(retriever.invoke(label["question"]))
+        latencies.append(time.perf_counter() - start)
+    return {
+        **score(ranked, labels),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+        "context_tokens": round(sum(d.metadata.get("token_count", 0) for docs in ranked for d in docs) / len(labels)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--questions", help="labelled questions (JSON); synthetic if omitted")
+    parser.add_argument("--corpus", help="directory of the documents the labels refer to")
+    parser.add_argument("--embeddings", nargs="+", default=["hashing", "sentence-transformers/all-MiniLM-L6-v2"])
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[150, 250])
+    parser.add_argument("--overlaps", type=int, nargs="+", default=[0, 30])
+    parser.add_argument("--parent-sizes", type=int, nargs="+", default=[800])
+    parser.add_argument("--k", type=int, nargs="+", default=[2, 4, 6])
+    parser.add_argument("--fetch-multipliers", type=int, nargs="+", default=[3])
+    parser.add_argument("--synthetic-files", type=int, default=8)
+    parser.add_argument("--synthetic-pages", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="also write the results to this file")
+    args = parser.parse_args()
+    if bool(args.questions) != bool(args.corpus):
+        parser.error("--questions and --corpus go together")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.questions:
+            with open(args.questions) as f:
+                labels = json.load(f)
+            corpus = args.corpus
+        else:
+            corpus = os.path.join(tmp, "corpus")
+            labels = synthetic_set(corpus, args.synthetic_files, args.synthetic_pages, args.seed)
+        paths = sorted(p for p in glob.glob(os.path.join(corpus, "*")) if os.path.isfile(p))
+
+        rows, skipped = [], {}
+        for b, backend in enumerate(args.embeddings):
+            try:
+                embeddings = load_embeddings(backend)
+            except Exception as e:
+                skipped[backend] = str(e)
+                continue
+            for run, (size, overlap, parent) in enumerate(
+                    itertools.product(args.chunk_sizes, args.overlaps, args.parent_sizes)):
+                if overlap >= size or size > parent:
+                    continue
+                splitter_config = {"chunk_size": size, "chunk_overlap": overlap, "parent_chunk_size": parent}
+                workdir = os.path.join(tmp, f"index-{b}-{run}")
+                vector_store, parent_store, index = build_index(workdir, paths, embeddings, splitter_config)
+                for k, multiplier in itertools.product(args.k, args.fetch_multipliers):
+                    rows.append({
+                        "embeddings": backend, **splitter_config, "k": k, "fetch_multiplier": multiplier,
+                        **evaluate(vector_store, parent_store, labels, k, multiplier), **index,
+                    })
+
+    rows.sort(key=lambda r: (-r["recall"], -r["mrr"], r["p50_ms"]))
+    results = {
+        "commit": _git_commit(),
+        "timestamp": int(time.time()),
+        "labels": args.questions or "synthetic",
+        "questions": len(labels),
+        "files": len(paths),
+        "skipped_embeddings": skipped,
+        "results": rows,
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Chunking throughput of SmartTextSplitter on a synthetic corpus.
+
+Compares the original implementation (1200/200 character chunks, a new
+RecursiveCharacterTextSplitter per document and six uncompiled re.search
+calls per chunk) with the current token-based parent/child splitter,
+serially and across processes. "chunks" is the number of vectors to embed.
+
+    python -m benchmarks.splitter_throughput [--pages 10000] [--workers 4]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from model.text_splitter import SmartTextSplitter, CLASSIFY_ORDER, MULTILINE_PATTERNS
+
+WORDS = (
+    "the of and to in is for on that by with as are from this be an data model learning "
+    "network gradient function process system management analysis design theory value"
+).split()
+
+
+def synthetic_pages(count: int, seed: int = 7) -> list:
+    """Lecture-like pages: paragraphs plus occasional lists, tables, formulas and headings"""
+    rng = random.Random(seed)
+
+    def sentence():
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+        return " ".join(words).capitalize() + "."
+
+    pages = []
+    for page in range(count):
+        parts = [f"Unit {page % 12 + 1} Topic {page % 40}:"]
+        for _ in range(rng.randint(3, 6)):
+            parts.append(" ".join(sentence() for _ in range(rng.randint(3, 7))))
+            roll = rng.random()
+            if roll < 0.15:
+                parts.append("\n".join(f"- {sentence()}" for _ in range(4)))
+            elif roll < 0.22:
+                parts.append("[TABLE 1]\nHeaders: Term | Meaning | Example\n" + "-" * 50 + "\n"
+                             + "\n".join(f"{rng.choice(WORDS)} | {sentence()} | {rng.choice(WORDS)}" for _ in range(4))
+                             + "\n[END TABLE]")
+            elif roll < 0.26:
+                parts.append(f"The cost is $x^{rng.randint(2, 5)} + c$ for each step.")
+        pages.append(Document(page_content="\n\n".join(parts), metadata={"page": page + 1}))
+    return pages
+
+
+def legacy_split(splitter: SmartTextSplitter, documents: list) -> list:
+    """The original splitter: 1200/200 characters, per-document splitter, uncompiled patterns"""
+    patterns = splitter.structure_patterns
+    chunks = []
+    for doc in documents:
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1200, chunk_overlap=200, length_function=len,
+            separators=["\n\n\n", "\n\n", "\n", ". ", " ", ""]
+        )
+        for i, split in enumerate(text_splitter.split_text(doc.page_content)):
+            content_type = "paragraph"
+            for name in CLASSIFY_ORDER:
+                if re.search(patterns[name], split, re.MULTILINE if name in MULTILINE_PATTERNS else 0):
+                    content_type = name
+                    break
+            chunks.append(Document(page_content=split, metadata={
+                **doc.metadata, "chunk_index": i, "content_type": content_type, "word_count": len(split.split())
+            }))
+    return chunks
+
+
+def timed(label: str, fn, count_tokens) -> dict:
+    start = time.perf_counter()
+    chunks = fn()
+    elapsed = time.perf_counter() - start
+    # MiniLM truncates at 256 tokens: embedding cost is what fits the window,
+    # anything beyond it is never embedded at all
+    tokens = [count_tokens(c.page_content) for c in chunks]
+    return {"variant": label, "chunks": len(chunks), "seconds": round(elapsed, 3),
+            "chunks_per_second": round(len(chunks) / elapsed, 1),
+            "embedded_tokens": sum(min(t, 254) for t in tokens),
+            "truncated_chunks": sum(1 for t in tokens if t > 254)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    pages = synthetic_pages(args.pages)
+    splitter = SmartTextSplitter()
+
+    results = [
+        timed("legacy", lambda: legacy_split(splitter, pages), splitter._length),
+        timed("current", lambda: splitter.split_documents(pages), splitter._length),
+    ]
+    if args.workers > 1:
+        results.append(timed(f"current x{args.workers} processes",
+                             lambda: splitter.split_documents(pages, max_workers=args.workers),
+                             splitter._length))
+
+    classify_texts = [d.page_content for d in splitter.split_documents(pages[:2000])]
+    start = time.perf_counter()
+    for text in classify_texts:
+        splitter._classify_content(text)
+    classify_rate = len(classify_texts) / (time.perf_counter() - start)
+
+    text = json.dumps({"pages": args.pages, "results": results,
+                       "classify_chunks_per_second": round(classify_rate, 1)}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Startup benchmark: import time of app.py and time until warm-up completes.
+
+Runs ``python -X importtime -c "import app"`` in a fresh interpreter, parses
+the per-module timings and reports the slowest imports, then (optionally)
+measures how long the background warm-up takes to become ready.
+
+    python -m benchmarks.startup_importtime [--warmup] [--top 15] [--output startup.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WARMUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get('/')
+first_response = time.perf_counter()
+app.warmup.wait()
+print(json.dumps({
+    "import_seconds": imported - start,
+    "first_response_seconds": first_response - start,
+    "warmup": app.warmup.status(),
+}))
+"""
+
+
+def _env(warmup: bool) -> dict:
+    env = dict(os.environ)
+    env.setdefault("GROQ_API_KEY", "benchmark-placeholder")
+    env["WARMUP_ON_STARTUP"] = "1" if warmup else "0"
+    return env
+
+
+def parse_importtime(stderr: str) -> list:
+    """Parse '-X importtime' lines into (module, self_us, cumulative_us)"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, module = line.split(":", 1)[1].split("|", 2)
+            rows.append({
+                "module": module.rstrip()[1:],
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+            })
+        except ValueError:
+            continue
+    return rows
+
+
+def measure_importtime(top: int) -> dict:
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=BACKEND_DIR, env=_env(warmup=False), capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"import app failed:\n{proc.stderr[-2000:]}")
+
+    rows = parse_importtime(proc.stderr)
+    top_level = [r for r in rows if not r["module"].startswith(" ")]
+    return {
+        "wall_seconds": round(wall, 3),
+        "total_import_seconds": round(sum(r["cumulative_us"] for r in top_level) / 1e6, 3),
+        "modules_imported": len(rows),
+        "slowest": sorted(rows, key=lambda r: r["cumulative_us"], reverse=True)[:top],
+    }
+
+
+def measure_warmup() -> dict:
+    proc = subprocess.run(
+        [sys.executable, "-c", WARMUP_SCRIPT],
+        cwd=BACKEND_DIR, env=_env(warmup=True), capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"warm-up run failed:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to report")
+    parser.add_argument("--warmup", action="store_true", help="Also measure time until warm-up is ready")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {"python": sys.version.split()[0], "importtime": measure_importtime(args.top)}
+    if args.warmup:
+        report["warmup"] = measure_warmup()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
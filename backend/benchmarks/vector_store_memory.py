@@ -0,0 +1,219 @@
+"""
+Memory and recall of the compact vector store against Chroma.
+
+Builds Chroma and CompactVectorStore (int8 and float16) indexes over the
+same synthetic 384-dim embeddings. The embeddings are clustered and
+normalised like MiniLM output and spread across users. Then, in a fresh
+process per store, it opens the index and runs per-user filtered queries,
+as ParentChildRetriever does. Reported per store:
+
+- recall@k against exact float32 search over the same user's vectors (the
+  compact store also without its float32 rescoring step)
+- query latency
+- memory after opening and querying, extrapolated to a million chunks:
+  anonymous RSS (private heap) and file-backed RSS (page cache the OS can
+  share between processes and reclaim), plus bytes on disk. File-backed
+  RSS grows with the share of vectors the queries touched: a user's
+  quantized rows are scanned on every query, while float32 rows are read
+  only for rescored candidates, so it approaches the file size once most
+  users have queried. "scanned_mb_per_million" is the quantized data a
+  search reads, i.e. the working set that has to stay in memory to keep
+  searches off the disk.
+
+    python -m benchmarks.vector_store_memory [--vectors 100000] [--users 100] [--queries 300]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from benchmarks.load_test import _git_commit, _percentile
+from model.utils import directory_size
+
+DIM = 384
+MB = 2**20
+STORES = ["chroma", "int8", "int8_no_rescore", "float16"]
+
+
+class _NoEmbeddings:
+    """Vectors are passed in directly; nothing should be embedded"""
+
+    def embed_documents(self, texts):
+        raise RuntimeError("benchmark adds precomputed vectors")
+
+    def embed_query(self, text):
+        raise RuntimeError("benchmark searches by vector")
+
+
+def synthetic_vectors(n: int, users: int, seed: int) -> tuple:
+    """Clustered unit vectors (one topic mix per user) and their owners"""
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((max(8, users // 2), DIM)).astype(np.float32)
+    # Sorted: each user's chunks arrive together, as one upload's do
+    owners = np.sort(rng.integers(0, users, n))
+    vectors = topics[rng.integers(0, len(topics), n)] + 0.6 * rng.standard_normal((n, DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors, owners
+
+
+def queries(vectors: np.ndarray, owners: np.ndarray, count: int, seed: int) -> tuple:
+    """Perturbed copies of stored vectors, each searched within its owner's chunks"""
+    rng = np.random.default_rng(seed + 1)
+    picks = rng.integers(0, len(vectors), count)
+    q = vectors[picks] + 0.5 * rng.standard_normal((count, DIM)).astype(np.float32) / np.sqrt(DIM)
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    return q, owners[picks]
+
+
+def exact_top_k(vectors, owners, q, q_owners, k) -> list:
+    truth = []
+    for vector, owner in zip(q, q_owners):
+        rows = np.flatnonzero(owners == owner)
+        scores = vectors[rows] @ vector
+        truth.append({f"c{r}" for r in rows[np.argsort(-scores)[:k]]})
+    return truth
+
+
+def _open(kind: str, directory: str):
+    if kind == "chroma":
+        from langchain_chroma import Chroma
+        return Chroma(persist_directory=directory, embedding_function=_NoEmbeddings())
+    from model.compact_store import CompactVectorStore
+    return CompactVectorStore(directory, _NoEmbeddings(), dtype=kind.split("_")[0],
+                              rescore_multiplier=1 if kind.endswith("no_rescore") else 4)
+
+
+def build(kind: str, directory: str, vectors, owners, batch: int = 5000):
+    store = _open(kind, directory)
+    for start in range(0, len(vectors), batch):
+        ids = [f"c{i}" for i in range(start, min(start + batch, len(vectors)))]
+        metadatas = [{"user_id": f"u{owners[i]}"} for i in range(start, start + len(ids))]
+        texts = [""] * len(ids)
+        if kind == "chroma":
+            store._collection.upsert(ids=ids, embeddings=vectors[start:start + len(ids)].tolist(),
+                                     metadatas=metadatas, documents=texts)
+        else:
+            store.add_vectors(vectors[start:start + len(ids)], texts, metadatas, ids)
+
+
+def _rss() -> dict:
+    """Anonymous and file-backed resident memory of this process (Linux)"""
+    fields = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("RssAnon", "RssFile"):
+                    fields[key] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return fields
+
+
+def _measure(kind, directory, q, q_owners, k, out):
+    # Libraries are loaded first so only the index itself is measured
+    import langchain_chroma  # noqa: F401
+    import model.compact_store  # noqa: F401
+    before = _rss()
+    store = _open(kind, directory)
+
+    def search(vector, owner):
+        if kind == "chroma":
+            result = store._collection.query(query_embeddings=[vector.tolist()], n_results=k,
+                                             where={"user_id": f"u{owner}"}, include=[])
+            return result["ids"][0]
+        return [d.id for d in store.similarity_search_by_vector(vector.tolist(), k=k, filter={"user_id": f"u{owner}"})]
+
+    search(q[0], q_owners[0])
+    found, latencies = [], []
+    for vector, owner in zip(q, q_owners):
+        start = time.perf_counter()
+        found.append(search(vector, owner))
+        latencies.append(time.perf_counter() - start)
+    after = _rss()
+    scanned = DIM * 4 if kind == "chroma" else store.stats()["scanned_bytes_per_vector"]
+    out.put({
+        "scanned_mb_per_million": round(scanned * 1e6 / MB),
+        "found": found,
+        "latencies": latencies,
+        "anon_bytes": after.get("RssAnon", 0) - before.get("RssAnon", 0),
+        "file_bytes": after.get("RssFile", 0) - before.get("RssFile", 0),
+    })
+
+
+def measure(kind: str, directory: str, q, q_owners, k: int) -> dict:
+    # A fresh process per store, so each starts with nothing loaded
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(kind, directory, q, q_owners, k, out))
+    process.start()
+    result = out.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=12, help="ParentChildRetriever fetches k * fetch_multiplier")
+    parser.add_argument("--stores", nargs="+", default=STORES, choices=STORES)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="also write the results to this file")
+    args = parser.parse_args()
+
+    vectors, owners = synthetic_vectors(args.vectors, args.users, args.seed)
+    q, q_owners = queries(vectors, owners, args.queries, args.seed)
+    truth = exact_top_k(vectors, owners, q, q_owners, args.k)
+    per_million = 1e6 / args.vectors
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        built = {}
+        for kind in args.stores:
+            # The no-rescore variant searches the int8 files with a different setting
+            source = kind.split("_")[0]
+            directory = os.path.join(tmp, source)
+            if source not in built:
+                start = time.perf_counter()
+                build(source, directory, vectors, owners)
+                built[source] = round(time.perf_counter() - start, 1)
+
+            result = measure(kind, directory, q, q_owners, args.k)
+            recall = np.mean([len(set(f) & t) / len(t) for f, t in zip(result["found"], truth)])
+            rows.append({
+                "store": kind,
+                "recall_at_k": round(float(recall), 4),
+                "p50_ms": round(_percentile(result["latencies"], 50) * 1000, 2),
+                "p95_ms": round(_percentile(result["latencies"], 95) * 1000, 2),
+                "build_seconds": built[source],
+                "disk_mb_per_million": round(directory_size(directory) / MB * per_million),
+                "anon_rss_mb_per_million": round(result["anon_bytes"] / MB * per_million),
+                "file_rss_mb_per_million": round(result["file_bytes"] / MB * per_million),
+                "scanned_mb_per_million": result["scanned_mb_per_million"],
+            })
+
+    output = json.dumps({
+        "commit": _git_commit(),
+        "vectors": args.vectors,
+        "users": args.users,
+        "queries": args.queries,
+        "k": args.k,
+        "results": rows,
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Throughput scaling of the multi-process server (serve.py).
+
+For each worker count, starts ``serve.py --workers N`` on a free port, signs
+up a throwaway user, drives the chosen endpoint with concurrent clients for a
+fixed duration and records requests/sec, latency percentiles and memory
+(RSS of the parent and sidecar, unique set size of each worker).
+
+    python -m benchmarks.worker_scaling --workers 1 2 4 --clients 32 --duration 20
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import psutil
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def _wait_ready(base_url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base_url + "/", timeout=2).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("Server did not start in time")
+
+
+def _memory(server_pid: int) -> dict:
+    parent = psutil.Process(server_pid)
+    report = {"parent_rss_mb": round(parent.memory_info().rss / 2**20, 1), "sidecar_rss_mb": None, "worker_uss_mb": []}
+    for child in parent.children(recursive=False):
+        try:
+            info = child.memory_full_info()
+        except psutil.Error:
+            continue
+        if "spawn_main" in " ".join(child.cmdline()):
+            report["sidecar_rss_mb"] = round(info.rss / 2**20, 1)
+        else:
+            report["worker_uss_mb"].append(round(info.uss / 2**20, 1))
+    return report
+
+
+def run_load(base_url: str, token: str, endpoint: str, payload: dict, clients: int, duration: float) -> dict:
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        session = requests.Session()
+        session.headers["Authorization"] = f"Bearer {token}"
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                if payload is None:
+                    resp = session.get(base_url + endpoint, timeout=120)
+                else:
+                    resp = session.post(base_url + endpoint, json=payload, timeout=120)
+                ok = resp.status_code < 500
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                (latencies if ok else errors).append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_second": round(len(latencies) / wall, 2),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 1) if latencies else None,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1) if latencies else None,
+    }
+
+
+def bench_workers(workers: int, args) -> dict:
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    proc = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--threads", str(args.threads),
+         "--port", str(port), "--host", "127.0.0.1",
+         "--socket", os.path.join("/tmp", f"campus_bench_{port}.sock")],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        _wait_ready(base_url, args.startup_timeout)
+        signup = requests.post(base_url + "/api/auth/signup", json={
+            "email": f"bench-{uuid.uuid4().hex[:8]}@example.com", "password": "benchmark", "name": "Benchmark"
+        }, timeout=60).json()
+        token = signup["accessToken"]
+
+        payload = None if args.method == "GET" else json.loads(args.payload)
+        # Short warm-up so each worker has finished its own lazy initialisation
+        run_load(base_url, token, args.endpoint, payload, workers, min(3.0, args.duration))
+        result = run_load(base_url, token, args.endpoint, payload, args.clients, args.duration)
+        result["workers"] = workers
+        result["memory"] = _memory(proc.pid)
+        return result
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--endpoint", default="/api/ask")
+    parser.add_argument("--method", choices=["GET", "POST"], default="POST")
+    parser.add_argument("--payload", default='{"question": "What are the key concepts in the course?"}')
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    results = [bench_workers(n, args) for n in args.workers]
+    base = results[0]["requests_per_second"] or 1.0
+    for r in results:
+        r["speedup"] = round(r["requests_per_second"] / base, 2)
+
+    text = json.dumps({"cpu_count": os.cpu_count(), "endpoint": args.endpoint, "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
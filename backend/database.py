@@ -21,12 +21,19 @@ client = MongoClient(
     tlsCAFile=certifi.where()
 )
 
-try:
-    # Send a ping to confirm a successful connection
-    client.admin.command('ping')
-    print("Pinged your deployment. You successfully connected to MongoDB!")
-except Exception as e:
-    print(f"MongoDB connection error: {e}")
-
 db = client["smart_campus_db"]
 users_collection = db["users"]
+precomputed_collection = db["precomputed_content"]
+manifests_collection = db["ingestion_manifests"]
+libraries_collection = db["course_libraries"]
+
+def check_connection() -> bool:
+    """Ping the deployment; called from the startup warm-up instead of at import"""
+    try:
+        # Send a ping to confirm a successful connection
+        client.admin.command('ping')
+        print("Pinged your deployment. You successfully connected to MongoDB!")
+        return True
+    except Exception as e:
+        print(f"MongoDB connection error: {e}")
+        raise
@@ -0,0 +1,173 @@
+"""
+Conditional requests, per-user response caching and compression
+
+Read endpoints (status, dashboard, history) only change when the user
+uploads, asks, submits a quiz or clears their data. Each of those bumps the
+user's version in UserVersions, and the ETag and cached body of a read are
+tied to the version they were produced at. A poll with a matching
+If-None-Match gets 304 without touching Mongo, and one without gets the
+cached body while the version is unchanged. Callers may fold other shared
+versions into the one they pass (app.py adds the course libraries' version,
+which the bulk ingestion CLI changes from outside the server).
+
+Versions live in shared memory that forked serve.py workers inherit, so a
+write in one worker invalidates the others. Cached bodies are per process.
+"""
+import gzip
+import hashlib
+import mmap
+import multiprocessing
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Responses smaller than this are sent as is
+COMPRESS_MIN_BYTES = 1024
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+class UserVersions:
+    """Per-user data version counters shared by forked worker processes
+
+    Users hash into a fixed number of slots, so memory stays constant; two
+    users sharing a slot only invalidate each other's caches more often.
+    """
+
+    def __init__(self, slots: int = 65536):
+        self.slots = slots
+        # Anonymous shared mapping: created before fork, seen by every worker
+        self._memory = mmap.mmap(-1, slots * 8)
+        self._lock = multiprocessing.Lock()
+        # Versions restart at 0 with the server; the boot id keeps ETags
+        # from an earlier run from matching
+        self.boot_id = os.urandom(8).hex()
+
+    def _slot(self, user_id: str) -> int:
+        digest = hashlib.blake2b(user_id.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little") % self.slots * 8
+
+    def get(self, user_id: str) -> int:
+        return struct.unpack_from("<Q", self._memory, self._slot(user_id))[0]
+
+    def bump(self, user_id: str):
+        offset = self._slot(user_id)
+        with self._lock:
+            value = struct.unpack_from("<Q", self._memory, offset)[0]
+            struct.pack_into("<Q", self._memory, offset, value + 1)
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Preferred content coding the client accepts: br, then gzip"""
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip()] = q
+    if brotli is not None and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def encode(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+class CachedBody:
+    """A response body and its compressed forms, made on first request"""
+
+    def __init__(self, body: bytes, mimetype: str):
+        self.body = body
+        self.mimetype = mimetype
+        self._encoded: Dict[str, bytes] = {}
+
+    def encoded(self, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        if encoding is None or len(self.body) < COMPRESS_MIN_BYTES:
+            return self.body, None
+        data = self._encoded.get(encoding)
+        if data is None:
+            data = self._encoded[encoding] = encode(self.body, encoding)
+        return data, encoding
+
+
+class ResponseCache:
+    """LRU of response bodies, each valid for one user data version
+
+    A version is any hashable value that changes whenever the response may.
+    """
+
+    def __init__(self, versions: UserVersions, max_entries: int = 4096, max_body_bytes: int = 1024 * 1024):
+        self.versions = versions
+        self.max_entries = max_entries
+        self.max_body_bytes = max_body_bytes
+        self._entries: "OrderedDict[tuple, Tuple[Hashable, CachedBody]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.not_modified = 0
+
+    def etag(self, user_id: str, key: tuple, version: Hashable) -> str:
+        raw = "|".join([self.versions.boot_id, user_id, repr(key), str(version)])
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=12).hexdigest()
+
+    def get(self, user_id: str, key: tuple, version: Hashable) -> Optional[CachedBody]:
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((user_id, key))
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id: str, key: tuple, version: Hashable, body: bytes, mimetype: str) -> CachedBody:
+        cached = CachedBody(body, mimetype)
+        if len(body) <= self.max_body_bytes:
+            with self._lock:
+                self._entries[(user_id, key)] = (version, cached)
+                self._entries.move_to_end((user_id, key))
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return cached
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "not_modified": self.not_modified, "encodings": ["br", "gzip"] if brotli else ["gzip"]}
+
+
+def compress_response(response, accept_encoding: str):
+    """Compress a large text or JSON response in place (for after_request)"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or not response.mimetype.startswith(COMPRESSIBLE_TYPES)):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(encode(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
@@ -0,0 +1,279 @@
+"""
+Bulk ingestion of a directory of course materials for a course library or one user
+
+    python ingest_library.py /srv/materials/bio101 --library bio101 --title "Biology 101" [--workers 8]
+    python ingest_library.py ~/notes --user student@example.edu
+
+A library (model.libraries) is indexed once and searched by every user who
+subscribes to it; it is created on first use.
+
+Walks the directory for the formats uploads accept and indexes every file
+straight into campus_rag_db and Mongo, as /api/upload_files would, without
+going through HTTP. Worker processes (all cores by default) hash, load and
+split files while the main process embeds and stores the ones already
+split, so loading overlaps with embedding.
+
+Each finished file is appended to a checkpoint (one JSON line per file). An
+interrupted run started again with the same arguments skips the files
+listed there and continues with the rest; --restart ignores it. Files that
+failed are not checkpointed and are retried. A throughput summary is printed
+at the end.
+
+While serve.py runs with several workers, chunks are embedded and stored by
+its retrieval sidecar (found through campus_rag_db/holder.json), so the
+server searches them as soon as each file is done. A single-process server
+keeps its own copy of the index open and would not see chunks another
+process writes, so the CLI refuses to run next to one; stop it first. With
+no server running it opens campus_rag_db itself, so give it the server's
+VECTOR_STORE (read from the environment by default); a server started
+before it finishes refuses to start.
+
+Library changes reach a running server's cached responses at once, through
+the libraries' version file. With --user, the server keeps answering
+/api/status and /api/dashboard for that user from its response cache until
+their next upload, question or quiz submission, or a restart.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("ingest_library")
+
+# Text splitter of each worker process, built once by _init_worker
+_splitter = None
+
+
+def _init_worker(splitter_config: dict):
+    global _splitter
+    from model.text_splitter import SmartTextSplitter
+    _splitter = SmartTextSplitter(**splitter_config)
+
+
+def _prepare(owner_id: str, path: str, name: str, known_digest: Optional[str]) -> Dict[str, Any]:
+    """Hash, load and split one file (runs in a worker process)"""
+    from model.ingestion import file_digest, load_documents
+
+    start = time.perf_counter()
+    digest = file_digest(path)
+    if digest == known_digest:
+        return {"digest": digest, "unchanged": True, "documents": 0, "seconds": time.perf_counter() - start}
+    docs = load_documents(owner_id, path, name)
+    parents, children = _splitter.split_with_parents(docs) if docs else ([], [])
+    return {"digest": digest, "unchanged": False, "documents": len(docs), "parents": parents,
+            "children": children, "seconds": time.perf_counter() - start}
+
+
+def find_files(directory: str, extensions) -> List[Tuple[str, str]]:
+    """(path, name relative to the directory) of every supported file, sorted"""
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for filename in sorted(files):
+            if filename.rsplit(".", 1)[-1].lower() in extensions and not filename.startswith("."):
+                path = os.path.join(root, filename)
+                found.append((path, os.path.relpath(path, directory).replace(os.sep, "/")))
+    return found
+
+
+class Checkpoint:
+    """Files finished by earlier runs, keyed by name, size and modification time"""
+
+    def __init__(self, path: str, restart: bool = False):
+        self.path = path
+        self._done = set()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if restart and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    self._done.add((entry["name"], entry["size"], entry["mtime_ns"]))
+
+    @staticmethod
+    def _key(path: str, name: str) -> tuple:
+        stat = os.stat(path)
+        return name, stat.st_size, stat.st_mtime_ns
+
+    def done(self, path: str, name: str) -> bool:
+        return self._key(path, name) in self._done
+
+    def record(self, path: str, name: str, status: str, **fields):
+        key = self._key(path, name)
+        entry = {"name": key[0], "size": key[1], "mtime_ns": key[2], "status": status, **fields}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._done.add(key)
+
+
+def resolve_user(users_collection, user: str) -> Optional[str]:
+    """User id for an id or an email address"""
+    from bson.objectid import ObjectId
+
+    query = {"_id": ObjectId(user)} if ObjectId.is_valid(user) else {"email": user}
+    found = users_collection.find_one(query, {"_id": 1})
+    return str(found["_id"]) if found else None
+
+
+def ingest(assistant, owner_id: str, files: List[Tuple[str, str]], checkpoint: Checkpoint,
+           workers: int) -> Dict[str, Any]:
+    """Index files with loading and splitting spread over worker processes"""
+    totals = {"indexed": 0, "unchanged": 0, "empty": 0, "failed": 0, "bytes": 0, "documents": 0,
+              "added": 0, "kept": 0, "removed": 0, "prepare_seconds": 0.0, "index_seconds": 0.0}
+    # Files whose content is already indexed are only hashed
+    known = {m["name"]: m.get("sha256") for m in
+             assistant.ingestion.manifests.find({"user_id": owner_id}, {"name": 1, "sha256": 1})}
+    # Built before the pool forks so workers inherit the loaded tokenizer
+    splitter_config = assistant.text_splitter.config
+
+    queue = list(reversed(files))
+    running = {}
+    finished = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(splitter_config,)) as pool:
+        try:
+            while queue or running:
+                # Keep a few files split ahead of the embedding, but not the whole directory
+                while queue and len(running) < workers * 2:
+                    path, name = queue.pop()
+                    running[pool.submit(_prepare, owner_id, path, name, known.get(name))] = (path, name)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, name = running.pop(future)
+                    finished += 1
+                    status = _index(assistant, owner_id, path, name, future, checkpoint, totals)
+                    logger.info(f"[{finished}/{len(files)}] {name}: {status}")
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            totals["interrupted"] = True
+    return totals
+
+
+def _index(assistant, owner_id: str, path: str, name: str, future, checkpoint: Checkpoint,
+           totals: Dict[str, Any]) -> str:
+    try:
+        prepared = future.result()
+        totals["prepare_seconds"] += prepared["seconds"]
+        if prepared["unchanged"]:
+            status, stats = "unchanged", {}
+        elif not prepared["children"]:
+            status, stats = "empty", {}
+        else:
+            start = time.perf_counter()
+            stats = assistant.index_split_file(owner_id, path, name, prepared["digest"],
+                                               prepared["parents"], prepared["children"])
+            totals["index_seconds"] += time.perf_counter() - start
+            status = "indexed"
+    except Exception as e:
+        logger.error(f"Could not ingest {name}: {e}")
+        totals["failed"] += 1
+        return "failed"
+
+    totals[status] += 1
+    totals["bytes"] += os.path.getsize(path)
+    totals["documents"] += prepared["documents"]
+    for key in ("added", "kept", "removed"):
+        totals[key] += stats.get(key, 0)
+    checkpoint.record(path, name, status, sha256=prepared["digest"], chunks=stats.get("chunks", 0))
+    if status == "indexed":
+        return f"{stats['added']} chunks added, {stats['kept']} kept, {stats['removed']} removed"
+    return status
+
+
+def print_summary(totals: Dict[str, Any], skipped: int, seconds: float, workers: int):
+    mb = totals["bytes"] / 1e6
+    print(f"Files:      {totals['indexed']} indexed, {totals['unchanged']} unchanged, {totals['empty']} without "
+          f"text, {totals['failed']} failed, {skipped} skipped (checkpoint)"
+          + ("  [interrupted]" if totals.get("interrupted") else ""))
+    print(f"Content:    {mb:.1f} MB, {totals['documents']} pages/slides/sections, {totals['added']} chunks "
+          f"added, {totals['kept']} kept, {totals['removed']} removed")
+    print(f"Time:       {seconds:.1f}s wall; load+split {totals['prepare_seconds']:.1f}s over {workers} "
+          f"processes, embed+store {totals['index_seconds']:.1f}s")
+    seconds = max(seconds, 1e-9)
+    files = totals["indexed"] + totals["unchanged"] + totals["empty"]
+    print(f"Throughput: {files / seconds:.2f} files/s, {mb / seconds:.2f} MB/s, "
+          f"{totals['added'] / seconds:.1f} chunks/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index a directory of course materials")
+    parser.add_argument("directory", help="Directory to walk (subdirectories included)")
+    owner = parser.add_mutually_exclusive_group(required=True)
+    owner.add_argument("--library", help="Course library id (lowercase, digits, '-' and '_')")
+    owner.add_argument("--user", help="Index for one user: user id or email address")
+    parser.add_argument("--title", help="Library title shown to users")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes loading and splitting files")
+    parser.add_argument("--vector-store", default=os.getenv("VECTOR_STORE", "chroma"),
+                        help="chroma, int8 or float16, as the server's VECTOR_STORE "
+                             "(unused when writing through a running server's sidecar)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: one per user and directory "
+                                             "in campus_rag_db/checkpoints)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint of earlier runs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from database import users_collection
+    from model.assistant import SmartCampusAssistant
+    from model.libraries import library_owner
+    from model.retrieval_service import claim_store, store_holder
+    from uploads import EXPECTED_KINDS
+
+    directory = os.path.abspath(args.directory)
+    if not os.path.isdir(directory):
+        sys.exit(f"Not a directory: {args.directory}")
+
+    assistant = SmartCampusAssistant(None, vector_storage=args.vector_store)
+    holder = store_holder(assistant.persist_directory)
+    if holder and holder.get("socket"):
+        # The sidecar's index is the one the server searches
+        logger.info(f"Writing through the retrieval sidecar of the running server ({holder['socket']})")
+        assistant = SmartCampusAssistant(None, retrieval_socket=holder["socket"])
+    elif holder:
+        sys.exit(f"A single-process server (pid {holder['pid']}) has campus_rag_db open and would not search "
+                 f"chunks written from here. Stop it first, or run it with serve.py --workers 2 or more.")
+    else:
+        # Servers started meanwhile wait for us instead of opening a half-written store
+        claim_store(assistant.persist_directory, ingesting=True)
+    if args.library:
+        try:
+            assistant.libraries.create(args.library, title=args.title)
+        except ValueError as e:
+            sys.exit(str(e))
+        owner_id = library_owner(args.library)
+    else:
+        owner_id = resolve_user(users_collection, args.user)
+        if owner_id is None:
+            sys.exit(f"No user {args.user}")
+
+    checkpoint_path = args.checkpoint or os.path.join(
+        assistant.persist_directory, "checkpoints",
+        f"{owner_id.replace(':', '-')}-{hashlib.sha1(directory.encode('utf-8')).hexdigest()[:12]}.jsonl")
+    checkpoint = Checkpoint(checkpoint_path, restart=args.restart)
+
+    files = find_files(directory, EXPECTED_KINDS)
+    pending = [(path, name) for path, name in files if not checkpoint.done(path, name)]
+    logger.info(f"{len(files)} files in {directory}, {len(files) - len(pending)} done in earlier runs; "
+                f"checkpoint {checkpoint_path}")
+
+    start = time.perf_counter()
+    totals = ingest(assistant, owner_id, pending, checkpoint, max(1, args.workers))
+    print_summary(totals, len(files) - len(pending), time.perf_counter() - start, max(1, args.workers))
+    if totals.get("interrupted"):
+        sys.exit(130)
+
+
+if __name__ == "__main__":
+    main()
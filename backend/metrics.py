@@ -0,0 +1,106 @@
+"""
+Request tracing and latency histograms, exported in Prometheus text format
+
+Stages are timed with ``span``. Each observation goes into a per-process
+histogram and, while a request is being traced, into that request's list
+of spans for the timing log. Spans nest: a stage includes the time of any
+stages timed inside it.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+# Upper bounds in seconds, from a quick Mongo lookup to a slow LLM call
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_trace: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("trace", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram keyed by label values"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...], buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: tuple, seconds: float):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), then sum and count
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+
+        for label_values, series in sorted(snapshot.items()):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram(
+    "campus_request_duration_seconds", "HTTP request latency by route", ("route", "method", "status")
+)
+STAGE_SECONDS = Histogram(
+    "campus_stage_duration_seconds", "Latency of RAG pipeline stages", ("stage",)
+)
+LLM_SECONDS = Histogram(
+    "campus_llm_duration_seconds", "Latency of LLM calls by task and model", ("task", "model")
+)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe((stage,), elapsed)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, elapsed))
+
+
+def begin_request():
+    """Start collecting the spans of the current request"""
+    _trace.set([])
+
+
+def end_request(route: str, method: str, status: int, seconds: float) -> List[Tuple[str, float]]:
+    """Record the request latency and return its spans"""
+    REQUEST_SECONDS.observe((route, method, str(status)), seconds)
+    spans = _trace.get() or []
+    _trace.set(None)
+    return spans
+
+
+def render() -> str:
+    """All histograms of this process in Prometheus text exposition format"""
+    return "\n".join(REQUEST_SECONDS.render() + STAGE_SECONDS.render() + LLM_SECONDS.render()) + "\n"
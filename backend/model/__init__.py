@@ -1,20 +1,30 @@
 """
 Smart Campus Assistant - Model Package
 Contains all core functionality for the RAG system
+
+Submodules are imported on first attribute access so that importing the
+package does not pull in LangChain, sentence-transformers or Chroma.
 """
 
-from model.assistant import SmartCampusAssistant
-from model.document_loader import EnhancedDocumentLoader
-from model.text_splitter import SmartTextSplitter
-from model.embeddings import EmbeddingManager
-from model.utils import ConversationManager, MemoryMonitor, RateLimiter
+import importlib
+
+_EXPORTS = {
+    'SmartCampusAssistant': 'model.assistant',
+    'EnhancedDocumentLoader': 'model.document_loader',
+    'SmartTextSplitter': 'model.text_splitter',
+    'EmbeddingManager': 'model.embeddings',
+    'ConversationMemory': 'model.conversation',
+    'MemoryMonitor': 'model.utils',
+    'RateLimiter': 'model.utils',
+    'WarmupOrchestrator': 'model.startup',
+}
+
+__all__ = list(_EXPORTS)
+
 
-__all__ = [
-    'SmartCampusAssistant',
-    'EnhancedDocumentLoader',
-    'SmartTextSplitter',
-    'EmbeddingManager',
-    'ConversationManager',
-    'MemoryMonitor',
-    'RateLimiter'
-]
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module 'model' has no attribute '{name}'")
@@ -1,93 +1,431 @@
 import os
 import datetime
-import json
-from typing import List, Dict, Any
+import logging
+import random
+import re
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 from bson.objectid import ObjectId
 
-from langchain_groq import ChatGroq
-from langchain_chroma import Chroma
-
-from langchain_core.prompts import PromptTemplate
-from langchain_core.documents import Document
-from langchain_community.tools import WikipediaQueryRun
-from langchain_community.utilities import WikipediaAPIWrapper
-
-from model.document_loader import EnhancedDocumentLoader
-from model.text_splitter import SmartTextSplitter
-from model.embeddings import EmbeddingManager
 from database import users_collection
+from metrics import span
+from model.libraries import library_id_of
+from model.utils import (LLMGovernor, RateLimitExceeded, PRIORITY_INTERACTIVE, PRIORITY_QUIZ,
+                         PRIORITY_SUMMARY, SingleFlight)
+
+logger = logging.getLogger(__name__)
 
 class SmartCampusAssistant:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: Optional[str], retrieval_socket: Optional[str] = None,
+                 precompute: bool = False, pdf_workers: int = 1,
+                 llm_governor: Optional[LLMGovernor] = None, vector_storage: str = "chroma",
+                 query_batch_size: int = 16, query_batch_wait_ms: float = 2.0,
+                 coalesce_timeout: float = 120.0, llm_model: str = "llama-3.3-70b-versatile",
+                 small_llm_model: str = "llama-3.1-8b-instant", llm_routes: Optional[Dict[str, str]] = None,
+                 llm_cascade: Iterable[str] = ("format",),
+                 chat_model_factory: Optional[Callable[[str], Any]] = None, wiki_context_tokens: int = 350,
+                 on_writes_saved: Optional[Callable[[str], None]] = None,
+                 precompute_calls_per_minute: float = 0.0,
+                 data_version: Optional[Callable[[str], int]] = None):
         self.api_key = api_key
-        # Initialize Groq LLM
-        self.llm = ChatGroq(
-            temperature=0.3, 
-            groq_api_key=api_key, 
-            model_name="llama-3.3-70b-versatile"
-        )
-        
-        self.embedding_manager = EmbeddingManager()
-        self.text_splitter = SmartTextSplitter()
-        
+        self.pdf_workers = pdf_workers
+        # Concurrent question embeddings share forward passes (EmbeddingManager)
+        self.query_batch_size = query_batch_size
+        self.query_batch_wait_ms = query_batch_wait_ms
+        # "chroma", or "int8" / "float16" for the memory-mapped
+        # model.compact_store.CompactVectorStore
+        self.vector_storage = vector_storage
+        # Every LLM call takes a slot: bounded concurrency, interactive first
+        self.llm_governor = llm_governor or LLMGovernor()
+        # Model per task (see model.llm_router); tasks in llm_cascade try the
+        # small model first. The factory builds a chat model from its name.
+        self.llm_model = llm_model
+        self.small_llm_model = small_llm_model
+        self.llm_routes = llm_routes or {}
+        self.llm_cascade = tuple(llm_cascade)
+        self.chat_model_factory = chat_model_factory or self._groq_model
+        # Wikipedia text is cut down to the sentences closest to the question,
+        # within this many tokens, before it is sent for formatting (0 keeps all)
+        self.wiki_context_tokens = wiki_context_tokens
+        # Called with a user id when their buffered history or quiz results
+        # reach Mongo (app.py invalidates cached responses with it)
+        self.on_writes_saved = on_writes_saved
+        # Returns a user's data version (app.py's UserVersions, shared by the
+        # workers), so conversation memory notices turns added elsewhere
+        self.data_version = data_version
+        # Identical summaries and quizzes requested at the same time (a whole
+        # class asking about one unit) share a single retrieval and LLM call
+        self.in_flight = SingleFlight(timeout=coalesce_timeout)
+        # When set, embeddings and vector search are served by the shared
+        # retrieval sidecar (model.retrieval_service) instead of in-process
+        self.retrieval_socket = retrieval_socket
+        self._retrieval_client = None
+
         # Vector Store Path
         self.persist_directory = os.path.join(os.path.dirname(os.path.dirname(__file__)), "campus_rag_db")
         os.makedirs(self.persist_directory, exist_ok=True)
-        
-        # Initialize Chroma
-        self.vector_store = Chroma(
-            persist_directory=self.persist_directory,
-            embedding_function=self.embedding_manager.get_embeddings()
+
+        # Heavy components (LLM client, embedding model, Chroma, Wikipedia) are
+        # built on first use so the server can start accepting requests while
+        # they warm up in the background (see model.startup).
+        self._components: Dict[str, Any] = {}
+        # Pre-generate summaries and quiz pools for the main topics after upload,
+        # within this many LLM calls per minute (0 leaves it to the governor)
+        self.precompute_enabled = precompute
+        self.precompute_calls_per_minute = precompute_calls_per_minute
+        self._component_locks = {
+            name: threading.Lock()
+            for name in ("llm", "embedding_manager", "text_splitter", "vector_store", "wiki_tool", "quiz_engine",
+                         "precomputed", "precomputer", "parent_store", "ingestion", "conversations", "llm_router",
+                         "wiki_compressor", "writes", "libraries")
+        }
+
+    def _component(self, name: str, factory):
+        component = self._components.get(name)
+        if component is None:
+            with self._component_locks[name]:
+                component = self._components.get(name)
+                if component is None:
+                    component = factory()
+                    self._components[name] = component
+        return component
+
+    def _groq_model(self, model_name: str):
+        from langchain_groq import ChatGroq
+        return ChatGroq(
+            temperature=0.3,
+            groq_api_key=self.api_key,
+            model_name=model_name
         )
-        
-        # Initialize Wikipedia tool
-        self.wiki_tool = WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper())
 
-    def upload_materials(self, user_id: str, file_paths: List[str]) -> Dict[str, Any]:
+    @property
+    def llm(self):
+        return self._component("llm", lambda: self.chat_model_factory(self.llm_model))
+
+    @property
+    def llm_router(self):
+        def build():
+            from model.llm_router import ModelRouter
+            # The default model is the shared self.llm instance
+            return ModelRouter(
+                lambda name: self.llm if name == self.llm_model else self.chat_model_factory(name),
+                routes=self.llm_routes,
+                cascade=self.llm_cascade,
+                small_model=self.small_llm_model,
+                default_model=self.llm_model,
+                governor=self.llm_governor
+            )
+        return self._component("llm_router", build)
+
+    @property
+    def retrieval_client(self):
+        if self._retrieval_client is None and self.retrieval_socket:
+            from model.retrieval_service import RetrievalClient
+            self._retrieval_client = RetrievalClient(self.retrieval_socket)
+        return self._retrieval_client
+
+    @property
+    def embedding_manager(self):
+        def build():
+            if self.retrieval_client:
+                from model.retrieval_service import RemoteEmbeddingManager
+                return RemoteEmbeddingManager(self.retrieval_client)
+            from model.embeddings import EmbeddingManager
+            return EmbeddingManager(lazy=True, query_batch_size=self.query_batch_size,
+                                    query_batch_wait_ms=self.query_batch_wait_ms)
+        return self._component("embedding_manager", build)
+
+    @property
+    def text_splitter(self):
+        def build():
+            from model.text_splitter import SmartTextSplitter
+            return SmartTextSplitter()
+        return self._component("text_splitter", build)
+
+    @property
+    def vector_store(self):
+        def build():
+            if self.retrieval_client:
+                from model.retrieval_service import RemoteVectorStore
+                return RemoteVectorStore(self.retrieval_client)
+            from langchain_chroma import Chroma
+            # The lazy embedding function lets Chroma open while the model is
+            # still loading in another thread
+            def chroma():
+                return Chroma(
+                    persist_directory=self.persist_directory,
+                    embedding_function=self.embedding_manager.lazy_embeddings()
+                )
+
+            if self.vector_storage == "chroma":
+                return chroma()
+
+            from model.compact_store import CompactVectorStore
+            store = CompactVectorStore(os.path.join(self.persist_directory, "compact"),
+                                       self.embedding_manager.lazy_embeddings(), dtype=self.vector_storage)
+            if not store.count() and os.path.exists(os.path.join(self.persist_directory, "chroma.sqlite3")):
+                # First start on the compact store: carry over what Chroma holds
+                copied = store.import_from(chroma())
+                logger.info(f"Copied {copied} chunks from Chroma into the {store.dtype} vector store")
+            return store
+        return self._component("vector_store", build)
+
+    @property
+    def wiki_tool(self):
+        def build():
+            from langchain_community.tools import WikipediaQueryRun
+            from langchain_community.utilities import WikipediaAPIWrapper
+            return WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper())
+        return self._component("wiki_tool", build)
+
+    @property
+    def wiki_compressor(self):
+        def build():
+            from model.extractive import ExtractiveCompressor
+            from model.text_splitter import DEFAULT_TOKENIZER, token_counter
+            return ExtractiveCompressor(self.embedding_manager, max_tokens=self.wiki_context_tokens,
+                                        count_tokens=token_counter(DEFAULT_TOKENIZER))
+        return self._component("wiki_compressor", build)
+
+    @property
+    def parent_store(self):
+        def build():
+            from model.parent_retrieval import ParentStore
+            return ParentStore(os.path.join(self.persist_directory, "parents.sqlite3"))
+        return self._component("parent_store", build)
+
+    @property
+    def ingestion(self):
+        def build():
+            from model.ingestion import IngestionPipeline
+            from database import manifests_collection
+            return IngestionPipeline(self.text_splitter, self.vector_store, self.parent_store, manifests_collection,
+                                     pdf_workers=self.pdf_workers)
+        return self._component("ingestion", build)
+
+    @property
+    def writes(self):
+        def build():
+            from model.write_behind import WriteBehindBuffer
+            return WriteBehindBuffer(users_collection, os.path.join(self.persist_directory, "journal"),
+                                     on_saved=self.on_writes_saved)
+        return self._component("writes", build)
+
+    @property
+    def conversations(self):
+        def build():
+            from model.conversation import ConversationMemory
+            return ConversationMemory(users_collection, self.writes, data_version=self.data_version)
+        return self._component("conversations", build)
+
+    @property
+    def libraries(self):
+        def build():
+            from model.libraries import LibraryRegistry
+            from database import libraries_collection
+            return LibraryRegistry(libraries_collection, users_collection,
+                                   os.path.join(self.persist_directory, "libraries.version"))
+        return self._component("libraries", build)
+
+    def _search_owners(self, user_id: str) -> List[str]:
+        """Owner ids whose chunks the user searches: their own and their libraries'"""
+        from model.libraries import library_owner
+        with span("mongo"):
+            return [user_id] + [library_owner(library_id) for library_id in self.libraries.subscriptions(user_id)]
+
+    def _retriever(self, user_id: str, k: int):
+        """Search the user's and their libraries' child chunks and return their parent sections
+
+        One search over all of them, so the best matches are merged by
+        similarity whichever owner they come from.
+        """
+        from model.parent_retrieval import ParentChildRetriever
+        owners = self._search_owners(user_id)
+        return ParentChildRetriever(
+            vector_store=self.vector_store,
+            parent_store=self.parent_store,
+            k=k,
+            search_filter={"user_id": owners[0] if len(owners) == 1 else {"$in": owners}}
+        )
+
+    @property
+    def quiz_engine(self):
+        def build():
+            from model.quiz_engine import QuizEngine
+            return QuizEngine(self.llm_router)
+        return self._component("quiz_engine", build)
+
+    @property
+    def precomputed(self):
+        def build():
+            from model.precompute import PrecomputedContentStore
+            from database import precomputed_collection
+            return PrecomputedContentStore(precomputed_collection)
+        return self._component("precomputed", build)
+
+    @property
+    def precomputer(self):
+        def build():
+            from model.precompute import Precomputer
+            return Precomputer(self, self.precomputed, calls_per_minute=self.precompute_calls_per_minute)
+        return self._component("precomputer", build)
+
+    def shutdown(self):
+        """Save buffered writes (also done at exit by atexit)"""
+        writes = self._components.get("writes")
+        if writes is not None:
+            writes.close()
+
+    def warmup_tasks(self) -> Dict[str, Any]:
+        """Independent warm-up steps for model.startup.WarmupOrchestrator"""
+        def warm_vector_store():
+            self.vector_store.get(limit=1)
+
+        def warm_imports():
+            # Modules otherwise imported on the first request
+            import langchain.chains
+            import langchain.chains.combine_documents
+            import langchain_core.prompts
+            import model.document_loader
+
+        return {
+            "embeddings": lambda: self.embedding_manager.warm(),
+            "vector_store": warm_vector_store,
+            "llm": lambda: self.llm_router.warm(),
+            "wikipedia": lambda: self.wiki_tool,
+            "text_splitter": lambda: self.text_splitter,
+            "imports": warm_imports,
+        }
+
+    def upload_materials(self, user_id: str, file_paths: List[str],
+                         original_names: Optional[List[str]] = None,
+                         digests: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Index uploaded files; re-uploads only re-embed the chunks that changed
+
+        Args:
+            user_id: Owner of the files
+            file_paths: Saved uploads
+            original_names: Names the user uploaded them under (defaults to the
+                saved name without the '<user_id>_<timestamp>_' prefix)
+            digests: sha256 of each file if already computed while saving
+        """
         try:
-            documents = []
-            for path in file_paths:
-                loader = EnhancedDocumentLoader(path)
-                docs = loader.load()
-                # Add metadata
-                for doc in docs:
-                    doc.metadata["user_id"] = user_id
-                    doc.metadata["uploaded_at"] = datetime.datetime.now().isoformat()
-                    doc.metadata["source_file"] = os.path.basename(path)
-                documents.extend(docs)
-            
-            if not documents:
+            names = original_names or [self._original_name(user_id, p) for p in file_paths]
+            totals = {"added": 0, "kept": 0, "removed": 0}
+            processed = 0
+
+            digests = digests or [None] * len(file_paths)
+            for path, name, digest in zip(file_paths, names, digests):
+                shared = self._library_copy(user_id, path, name, digest)
+                if shared:
+                    # Same bytes as a document of a subscribed library: link it
+                    processed += 1
+                    totals["shared"] = totals.get("shared", 0) + 1
+                    self._record_document(user_id, path, name, {"chunks": len(shared["chunks"])},
+                                          library=library_id_of(shared["user_id"]))
+                    continue
+                stats = self.ingestion.ingest_file(user_id, path, name, digest)
+                if stats is None:
+                    continue
+                processed += 1
+                for key in totals:
+                    totals[key] += stats[key]
+                self._record_document(user_id, path, name, stats)
+            
+            if not processed:
                 return {"status": "error", "message": "No content found in files"}
 
-            splits = self.text_splitter.split_documents(documents)
-            
-            # Add to vector store in batches to avoid exceeding max batch size
-            BATCH_SIZE = 100  # ChromaDB default max is 166, use 100 to be safe
-            for i in range(0, len(splits), BATCH_SIZE):
-                batch = splits[i:i + BATCH_SIZE]
-                self.vector_store.add_documents(batch)
-            
-            # Update user record in MongoDB
-            file_metadata = [{
-                "filename": os.path.basename(p), 
-                "uploaded_at": datetime.datetime.now()
-            } for p in file_paths]
+            self._refresh_precomputed(user_id)
             
+            shared = f", {totals['shared']} already in your course libraries" if totals.get("shared") else ""
+            return {
+                "status": "success",
+                "message": f"Processed {processed} files ({totals['added']} chunks added, "
+                           f"{totals['kept']} kept, {totals['removed']} removed{shared})",
+                **totals
+            }
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    def index_split_file(self, owner_id: str, path: str, name: str, digest: str,
+                         parents: List[Any], children: List[Any]) -> Dict[str, Any]:
+        """Store a file already loaded and split elsewhere (ingest_library.py) and list it
+
+        ``owner_id`` is a user id, or model.libraries.library_owner() of a library.
+        """
+        manifest = self.ingestion.manifests.find_one({"user_id": owner_id, "name": name})
+        stats = self.ingestion.index_split(owner_id, name, digest, parents, children, manifest)
+        library_id = library_id_of(owner_id)
+        if library_id:
+            self.libraries.record_document(library_id, path, name, stats["chunks"])
+        else:
+            self._record_document(owner_id, path, name, stats)
+        return stats
+
+    def _library_copy(self, user_id: str, path: str, name: str, digest: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Manifest of the same file in one of the user's libraries, unless they indexed it themselves"""
+        owners = self._search_owners(user_id)[1:]
+        if not owners or self.ingestion.manifests.find_one({"user_id": user_id, "name": name}, {"_id": 1}):
+            return None
+        from model.ingestion import file_digest
+        return self.ingestion.find_digest(owners, digest or file_digest(path))
+
+    def subscribe_library(self, user_id: str, library_id: str) -> bool:
+        """Add a library to what the user searches; False if it does not exist"""
+        if not self.libraries.subscribe(user_id, library_id):
+            return False
+        self._refresh_precomputed(user_id)
+        return True
+
+    def unsubscribe_library(self, user_id: str, library_id: str):
+        self.libraries.unsubscribe(user_id, library_id)
+        self._refresh_precomputed(user_id)
+
+    @staticmethod
+    def _original_name(user_id: str, path: str) -> str:
+        filename = os.path.basename(path)
+        match = re.match(rf"^{re.escape(user_id)}_\d+_(.+)$", filename)
+        return match.group(1) if match else filename
+
+    def _record_document(self, user_id: str, path: str, name: str, stats: Dict[str, Any],
+                         library: Optional[str] = None):
+        """Update the user's documents entry for this name in place, or add it
+
+        ``library`` marks an upload linked to that library's copy instead of indexed.
+        """
+        if stats.get("unchanged"):
+            exists = users_collection.count_documents({"_id": ObjectId(user_id), "documents.name": name}, limit=1)
+            if exists:
+                return
+
+        entry = {
+            "filename": os.path.basename(path),
+            "name": name,
+            "chunks": stats["chunks"],
+            "uploaded_at": datetime.datetime.now()
+        }
+        if library:
+            entry["library"] = library
+        result = users_collection.update_one(
+            {"_id": ObjectId(user_id), "documents.name": name},
+            {"$set": {"documents.$": entry}}
+        )
+        if result.matched_count == 0:
             users_collection.update_one(
                 {"_id": ObjectId(user_id)},
-                {"$push": {"documents": {"$each": file_metadata}}}
+                {"$push": {"documents": entry}}
             )
-            
-            return {"status": "success", "message": f"Processed {len(file_paths)} files ({len(splits)} chunks)"}
-        except Exception as e:
-            return {"status": "error", "message": str(e)}
 
     def ask_question(self, user_id: str, question: str) -> Dict[str, Any]:
         try:
             # Create retriever with user filter
-            retriever = self.vector_store.as_retriever(
-                search_kwargs={"filter": {"user_id": user_id}, "k": 4}
-            )
+            retriever = self._retriever(user_id, 4)
+            
+            # Follow-ups ("what are its types?") are searched together with
+            # the previous question, and recent turns go into the prompt
+            with span("conversation"):
+                turns = self.conversations.turns(user_id)
+            query = self.conversations.retrieval_query(turns, question)
             
             template = """You are a helpful Smart Campus Assistant. Use the following context to answer the student's question.
             Format your answer with clear bullet points and structured sections where applicable.
@@ -95,127 +433,180 @@ class SmartCampusAssistant:
             
             Context: {context}
             
+            Recent conversation (for resolving references in the question):
+            {history}
+            
             Question: {input}
             
             Answer:"""
             
-            prompt = PromptTemplate(template=template, input_variables=["context", "input"])
+            from langchain_core.prompts import PromptTemplate
+            prompt = PromptTemplate(template=template, input_variables=["context", "history", "input"])
             
-            # Create modern retrieval chain
-            from langchain.chains import create_retrieval_chain
+            # Retrieve, then stuff the documents into the prompt (what
+            # create_retrieval_chain does, with each stage timed on its own)
             from langchain.chains.combine_documents import create_stuff_documents_chain
             
-            combine_docs_chain = create_stuff_documents_chain(self.llm, prompt)
-            chain = create_retrieval_chain(retriever, combine_docs_chain)
+            from model.llm_router import TASK_ANSWER, plausible_text
             
-            response = chain.invoke({"input": question})
-            answer = response["answer"]
-            source_docs = response["context"]
+            with span("retrieval"):
+                source_docs = retriever.invoke(query)
+            inputs = {
+                "input": question,
+                "context": source_docs,
+                "history": self.conversations.history_text(turns) or "(none)"
+            }
+            answer = self.llm_router.run(
+                TASK_ANSWER,
+                lambda llm, config: create_stuff_documents_chain(llm, prompt).invoke(inputs, config=config),
+                accept=plausible_text,
+                priority=PRIORITY_INTERACTIVE
+            )
             
             sources = list(set([doc.metadata.get("source_file", "Unknown") for doc in source_docs]))
             
-            # Save history
-            users_collection.update_one(
-                {"_id": ObjectId(user_id)},
-                {"$push": {"history": {
-                    "question": question,
-                    "answer": answer,
-                    "sources": sources,
-                    "timestamp": datetime.datetime.now()
-                }}}
-            )
+            # Save history (written to Mongo in the background)
+            self.conversations.add_turn(user_id, question, answer, sources)
             
             return {"answer": answer, "sources": sources}
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             return {"answer": f"Error: {str(e)}", "sources": []}
 
 
     def summarize_notes(self, user_id: str, topic: str) -> str:
         try:
-            retriever = self.vector_store.as_retriever(
-                search_kwargs={"filter": {"user_id": user_id}, "k": 5}
-            )
-            docs = retriever.invoke(topic)
-            context = "\n\n".join([doc.page_content for doc in docs])
-            
-            if not context:
-                return "No relevant documents found for this topic."
-                
-            prompt = f"""Summarize the following content regarding '{topic}'. 
-            Make it comprehensive and well-structured.
-            
-            Formatting Rules:
-            - Use '### ' (Markdown H3) for all subheadings.
-            - Use bullet points ('- ') for all list items.
-            - Ensure there is a blank line between sections.
-            
-            Example Format:
-            ### Key Concepts
-            - Concept A: Description...
-            - Concept B: Description...
-            
-            ### Historical Context
-            - Event 1 happened in...
-            
-            Content:
-            {context}
-            """
-            
-            response = self.llm.invoke(prompt)
-            return response.content
+            cached = self._precomputed_entry(user_id, topic)
+            if cached and cached.get("summary"):
+                return cached["summary"]
+            from model.precompute import normalize_topic
+            key = ("summary", self.ingestion.fingerprint(*self._search_owners(user_id)), normalize_topic(topic))
+            return self.in_flight.do(key, lambda: self._summarize(user_id, topic))
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             return f"Error generating summary: {str(e)}"
 
-    def generate_practice_quiz(self, user_id: str, topic: str, num_questions: int) -> List[Dict]:
-        try:
-            retriever = self.vector_store.as_retriever(
-                search_kwargs={"filter": {"user_id": user_id}, "k": 5}
-            )
+    def _summarize(self, user_id: str, topic: str, priority: int = PRIORITY_SUMMARY) -> str:
+        retriever = self._retriever(user_id, 5)
+        with span("retrieval"):
             docs = retriever.invoke(topic)
-            context = "\n\n".join([doc.page_content for doc in docs])
-            
-            prompt = f"""Generate a multiple choice quiz with {num_questions} questions based on the following content about '{topic}'.
-            Return the result as a JSON array of objects, where each object has:
-            - question: str
-            - options: List[str] (4 options)
-            - correct_answer: str (the correct option text)
-            - explanation: str
-            
-            Do not include any markdown formatting like ```json. Just the raw JSON string.
-            
-            Content:
-            {context}
-            """
-            
-            response = self.llm.invoke(prompt)
-            content = response.content.strip()
+        context = "\n\n".join([doc.page_content for doc in docs])
+        
+        if not context:
+            return "No relevant documents found for this topic."
             
-            if content.startswith("```json"):
-                content = content[7:-3]
-            elif content.startswith("```"):
-                content = content[3:-3]
-                
-            return json.loads(content)
+        prompt = f"""Summarize the following content regarding '{topic}'. 
+        Make it comprehensive and well-structured.
+        
+        Formatting Rules:
+        - Use '### ' (Markdown H3) for all subheadings.
+        - Use bullet points ('- ') for all list items.
+        - Ensure there is a blank line between sections.
+        
+        Example Format:
+        ### Key Concepts
+        - Concept A: Description...
+        - Concept B: Description...
+        
+        ### Historical Context
+        - Event 1 happened in...
+        
+        Content:
+        {context}
+        """
+        
+        from model.llm_router import TASK_SUMMARY
+        return self.llm_router.invoke(TASK_SUMMARY, prompt, priority)
+
+    def generate_practice_quiz(self, user_id: str, topic: str, num_questions: int) -> List[Dict]:
+        try:
+            num_questions = int(num_questions)
+            cached = self._precomputed_entry(user_id, topic)
+            pool = cached.get("quiz_pool") if cached else None
+            if pool and len(pool) >= num_questions:
+                return random.sample(pool, num_questions)
+            from model.precompute import normalize_topic
+            key = ("quiz", self.ingestion.fingerprint(*self._search_owners(user_id)), normalize_topic(topic),
+                   num_questions)
+            return self.in_flight.do(key, lambda: self._generate_quiz(user_id, topic, num_questions))
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             return []
 
+    def _generate_quiz(self, user_id: str, topic: str, num_questions: int,
+                       priority: int = PRIORITY_QUIZ) -> List[Dict]:
+        # Batches are spread over different chunks, so fetch enough context
+        retriever = self._retriever(user_id, self.quiz_engine.context_size(num_questions))
+        with span("retrieval"):
+            docs = retriever.invoke(topic)
+        with span("quiz_generation"):
+            return self.quiz_engine.generate(topic, docs, num_questions, priority=priority)
+
+    def generate_topic_content(self, user_id: str, topic: str, quiz_questions: int,
+                               priority: int) -> Tuple[str, List[Dict]]:
+        """Fresh summary and quiz pool for a topic, at the given LLM priority
+
+        Unlike summarize_notes and generate_practice_quiz this skips
+        precomputed content and raises on failure (model.precompute uses it).
+        """
+        summary = self._summarize(user_id, topic, priority=priority)
+        return summary, self._generate_quiz(user_id, topic, quiz_questions, priority=priority)
+
+    def document_set_version(self, user_id: str) -> str:
+        from model.precompute import document_set_version
+        with span("mongo"):
+            user = users_collection.find_one({"_id": ObjectId(user_id)}, {"documents": 1})
+            documents = list(user.get("documents", [])) if user else []
+            # Library documents count too, so new library content is precomputed again
+            for library in self.libraries.subscribed(user_id):
+                documents.extend(library.get("documents", []))
+        return document_set_version(documents)
+
+    def _precomputed_entry(self, user_id: str, topic: str) -> Optional[Dict[str, Any]]:
+        if not self.precompute_enabled:
+            return None
+        version = self.document_set_version(user_id)
+        with span("precomputed_lookup"):
+            return self.precomputed.get(user_id, version, topic)
+
+    def _refresh_precomputed(self, user_id: str):
+        """Drop content for the old document set and queue the new topics"""
+        if not self.precompute_enabled:
+            return
+        try:
+            self.precomputed.invalidate(user_id)
+            topics = self.ingestion.topics(*self._search_owners(user_id))
+            self.precomputer.schedule(user_id, self.document_set_version(user_id), topics)
+        except Exception as e:
+            logger.error(f"Could not schedule precomputation: {e}")
+
     def get_upload_status(self, user_id: str) -> Dict[str, Any]:
         try:
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
+            with span("mongo"):
+                user = users_collection.find_one({"_id": ObjectId(user_id)})
             if not user:
-                return {"uploaded_documents": 0, "documents": []}
+                return {"uploaded_documents": 0, "documents": [], "library_documents": 0, "libraries": []}
             
             docs = user.get("documents", [])
+            with span("mongo"):
+                libraries = [self.libraries.summary(library) for library in self.libraries.subscribed(user_id)]
             return {
                 "uploaded_documents": len(docs),
-                "documents": docs
+                "documents": docs,
+                "library_documents": sum(len(library["documents"]) for library in libraries),
+                "libraries": libraries
             }
         except Exception:
-            return {"uploaded_documents": 0, "documents": []}
+            return {"uploaded_documents": 0, "documents": [], "library_documents": 0, "libraries": []}
 
     def get_conversation_history(self, user_id: str, limit: int = 10) -> List[Dict]:
         try:
             user = users_collection.find_one({"_id": ObjectId(user_id)})
+            # Include turns the background writer has not saved yet
+            user = self.writes.overlay(user_id, user)
             if not user:
                 return []
             
@@ -225,31 +616,38 @@ class SmartCampusAssistant:
             return []
 
     def clear_all_documents(self, user_id: str) -> Dict[str, str]:
-        # Ideally we delete from Chroma too, but for now just clear DB ref
+        from model.write_behind import CLEARED_AT, now_ms
+
+        self.conversations.forget(user_id)
+        # Let a batch already being written land before the arrays are emptied;
+        # items still queued elsewhere are older than the marker and skipped
+        self.writes.flush()
         users_collection.update_one(
             {"_id": ObjectId(user_id)},
-            {"$set": {"documents": [], "history": [], "quiz_scores": []}}
+            {"$set": {"documents": [], "history": [], "quiz_scores": [], CLEARED_AT: now_ms()}}
         )
+        # Remove the user's vectors, parent sections and manifests as well
+        self.ingestion.remove_owner(user_id)
+        if self.precompute_enabled:
+            self.precomputed.invalidate(user_id)
         return {"status": "success", "message": "Cleared all documents and history"}
 
     def submit_quiz_result(self, user_id: str, score: int, total: int, topic: str) -> bool:
         try:
-            users_collection.update_one(
-                {"_id": ObjectId(user_id)},
-                {"$push": {"quiz_scores": {
-                    "score": score,
-                    "total": total,
-                    "topic": topic,
-                    "timestamp": datetime.datetime.now()
-                }}}
-            )
+            # Written to Mongo in the background
+            self.writes.push(user_id, "quiz_scores", {
+                "score": score,
+                "total": total,
+                "topic": topic,
+                "timestamp": datetime.datetime.now()
+            })
             return True
         except Exception:
             return False
 
     def get_dashboard_stats(self, user_id: str) -> Dict[str, Any]:
         try:
-            user = users_collection.find_one({"_id": ObjectId(user_id)})
+            user = self.writes.overlay(user_id, users_collection.find_one({"_id": ObjectId(user_id)}))
             if not user:
                 return {"documents": 0, "questions": 0, "study_hours": 0, "quiz_score": 0}
             
@@ -313,9 +711,24 @@ class SmartCampusAssistant:
     def rag_system(self):
         return self
 
+    def _compress_wikipedia(self, query: str, content: str) -> str:
+        try:
+            with span("wiki_compress"):
+                compressed, stats = self.wiki_compressor.compress(query, content)
+        except Exception as e:
+            logger.warning(f"Could not compress Wikipedia content, sending it whole: {e}")
+            return content
+        if stats["tokens_after"] < stats["tokens_before"]:
+            logger.info(f"Wikipedia context for '{query}': {stats['tokens_before']} -> {stats['tokens_after']} tokens "
+                        f"({stats['sentences_after']}/{stats['sentences_before']} sentences)")
+        return compressed
+
     def search_wikipedia(self, query: str) -> Dict[str, Any]:
         try:
-            raw_content = self.wiki_tool.run(query)
+            with span("wikipedia"):
+                raw_content = self.wiki_tool.run(query)
+            if self.wiki_context_tokens:
+                raw_content = self._compress_wikipedia(query, raw_content)
             
             prompt = f"""Format the following Wikipedia content into a clear, structured answer with bullet points.
             Focus on the most important facts relevant to: '{query}'.
@@ -324,14 +737,17 @@ class SmartCampusAssistant:
             {raw_content}
             """
             
-            response = self.llm.invoke(prompt)
-            formatted_answer = response.content
+            # Reformatting fetched text is the cheap task the small model tries first
+            from model.llm_router import TASK_FORMAT
+            formatted_answer = self.llm_router.invoke(TASK_FORMAT, prompt, PRIORITY_INTERACTIVE)
             
             return {
                 "answer": formatted_answer, 
                 "sources": ["Wikipedia"], 
                 "related_topics": []
             }
+        except RateLimitExceeded:
+            raise
         except Exception as e:
             return {
                 "answer": f"Could not fetch from Wikipedia. Error: {str(e)}", 
@@ -0,0 +1,432 @@
+"""
+Compact vector store: scalar-quantized vectors in memory-mapped files
+
+Each chunk's embedding is stored twice, in append-only files:
+
+- quantized: int8 with one float32 scale per vector (4x smaller than
+  float32) or float16 (2x smaller), scanned for every query
+- float32: the exact vector, read only for the top candidates of a query
+  to rescore them
+
+The files are memory-mapped read-only, so processes opening the same store
+share one copy in the page cache instead of each holding the index on its
+heap, and the OS can drop pages that are not being searched. Ids, texts,
+metadata and the row of each vector are kept in SQLite (WAL, like
+ParentStore). Search is exact over the rows matching the filter (normally
+one user's chunks and their course libraries'), so there is no graph index
+to hold in memory.
+
+Deleted or replaced vectors leave dead rows; once they outnumber the live
+ones the files are rewritten under a new generation number. Writers take
+an exclusive file lock, so several processes can add to the same store.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are serialised
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+QUANTIZED_DTYPES = {"int8": np.int8, "float16": np.float16}
+
+# Candidates rescored with the float32 vectors, per result requested
+RESCORE_MULTIPLIER = 4
+
+# Rows dequantized per step of a scan (bounds the temporary float32 copy)
+SCAN_BLOCK = 32768
+
+# Dead rows tolerated before the files are rewritten (and never more than live ones)
+VACUUM_MIN_DEAD = 10000
+
+
+class _Mapped(NamedTuple):
+    generation: int
+    rows: int
+    quantized: np.ndarray
+    scales: Optional[np.ndarray]
+    full: np.ndarray
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Quantized vectors and, for int8, the per-vector scale that restores them"""
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+class CompactVectorStore(VectorStore):
+    """LangChain vector store over quantized, memory-mapped vectors
+
+    Scores from ``similarity_search_with_score`` are squared L2 distances
+    between the normalized vectors (lower is closer, from 0 to 4), the
+    scale of Chroma's default "l2" space, so thresholds carry over.
+    """
+
+    def __init__(self, directory: str, embedding_function: Embeddings, dtype: str = "int8",
+                 rescore_multiplier: int = RESCORE_MULTIPLIER):
+        """
+        Args:
+            directory: Where the vector files and the SQLite index live
+            embedding_function: Embeddings used for added texts and queries
+            dtype: "int8" or "float16"; an existing store keeps the dtype it
+                was created with
+            rescore_multiplier: Candidates rescored exactly per result
+        """
+        if dtype not in QUANTIZED_DTYPES:
+            raise ValueError(f"Unsupported vector dtype '{dtype}' (use one of {', '.join(QUANTIZED_DTYPES)})")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._embeddings = embedding_function
+        self.rescore_multiplier = rescore_multiplier
+        self._local = threading.local()
+        self._write_mutex = threading.Lock()
+        self._map_lock = threading.Lock()
+        self._maps: Optional[_Mapped] = None
+        self._row_cache: Dict[Tuple[int, str], np.ndarray] = {}
+
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " id TEXT PRIMARY KEY, row INTEGER NOT NULL, user_id TEXT,"
+                " document TEXT NOT NULL, metadata TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_user ON chunks (user_id, row)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.executemany("INSERT OR IGNORE INTO meta VALUES (?, ?)", [
+                ("dtype", dtype), ("dim", "0"), ("generation", "0"), ("rows", "0"), ("version", "0")
+            ])
+        self.dtype = self._meta()["dtype"]
+        if self.dtype != dtype:
+            logger.warning(f"Vector store in {directory} holds {self.dtype} vectors; ignoring requested {dtype}")
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embeddings
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.directory, "index.sqlite3"), timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def _meta(self, conn: Optional[sqlite3.Connection] = None) -> Dict[str, Any]:
+        rows = dict((conn or self._connection()).execute("SELECT key, value FROM meta").fetchall())
+        return {key: value if key == "dtype" else int(value) for key, value in rows.items()}
+
+    @staticmethod
+    def _set_meta(conn: sqlite3.Connection, **values):
+        conn.executemany("UPDATE meta SET value = ? WHERE key = ?", [(str(v), k) for k, v in values.items()])
+
+    @contextmanager
+    def _write_lock(self):
+        with self._write_mutex:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, "write.lock"), "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # --- Files -----------------------------------------------------------
+
+    def _path(self, kind: str, generation: int) -> str:
+        return os.path.join(self.directory, f"{kind}-{generation}.bin")
+
+    def _write_rows(self, generation: int, start: int, quantized: np.ndarray,
+                    scales: Optional[np.ndarray], full: np.ndarray):
+        # Written at the row offset rather than appended, so bytes left by
+        # a write that never got committed are simply overwritten
+        parts = [("quantized", quantized), ("scales", scales), ("vectors", full)]
+        for kind, array in parts:
+            if array is None:
+                continue
+            array = np.ascontiguousarray(array)
+            path = self._path(kind, generation)
+            with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+                f.seek(start * (array.nbytes // len(array)))
+                f.write(array.tobytes())
+
+    def _mapped(self, generation: int, rows: int, dim: int) -> Optional[_Mapped]:
+        """Read-only maps covering at least ``rows`` rows of ``generation``"""
+        if rows == 0:
+            return None
+        maps = self._maps
+        if maps is not None and maps.generation == generation and maps.rows >= rows:
+            return maps
+        with self._map_lock:
+            maps = self._maps
+            if maps is None or maps.generation != generation or maps.rows < rows:
+                def open_map(kind, dtype, shape):
+                    return np.memmap(self._path(kind, generation), dtype=dtype, mode="r", shape=shape)
+
+                maps = _Mapped(
+                    generation, rows,
+                    open_map("quantized", QUANTIZED_DTYPES[self.dtype], (rows, dim)),
+                    open_map("scales", np.float32, (rows,)) if self.dtype == "int8" else None,
+                    open_map("vectors", np.float32, (rows, dim)),
+                )
+                self._maps = maps
+        return maps
+
+    # --- Writes ----------------------------------------------------------
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_vectors(self._embeddings.embed_documents(texts), texts, metadatas, ids)
+
+    def add_vectors(self, vectors, texts: List[str], metadatas: Optional[List[dict]] = None,
+                    ids: Optional[List[str]] = None) -> List[str]:
+        """Add precomputed embeddings; an existing id is replaced"""
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [uuid.uuid4().hex for _ in texts]
+        quantized, scales = quantize(vectors, self.dtype)
+
+        with self._write_lock():
+            conn = self._connection()
+            meta = self._meta(conn)
+            dim = meta["dim"] or vectors.shape[1]
+            if vectors.shape[1] != dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store's {dim}")
+            start = meta["rows"]
+            self._write_rows(meta["generation"], start, quantized, scales, vectors)
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)", [
+                    (cid, start + i, meta_.get("user_id"), text, json.dumps(meta_, default=str))
+                    for i, (cid, text, meta_) in enumerate(zip(ids, texts, metadatas))
+                ])
+                self._set_meta(conn, dim=dim, rows=start + len(ids), version=meta["version"] + 1)
+            self._vacuum_if_needed(conn)
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any):
+        if not ids:
+            return
+        with self._write_lock():
+            conn = self._connection()
+            with conn:
+                conn.executemany("DELETE FROM chunks WHERE id = ?", [(i,) for i in ids])
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+            self._vacuum_if_needed(conn)
+
+    def _vacuum_if_needed(self, conn: sqlite3.Connection):
+        live = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        dead = self._meta(conn)["rows"] - live
+        if dead >= VACUUM_MIN_DEAD and dead > live:
+            self._vacuum(conn)
+
+    def vacuum(self):
+        """Rewrite the vector files without dead rows"""
+        with self._write_lock():
+            self._vacuum(self._connection())
+
+    def _vacuum(self, conn: sqlite3.Connection):
+        meta = self._meta(conn)
+        old = self._mapped(meta["generation"], meta["rows"], meta["dim"])
+        live = conn.execute("SELECT id, row FROM chunks ORDER BY row").fetchall()
+        generation = meta["generation"] + 1
+        for start in range(0, len(live), SCAN_BLOCK):
+            rows = np.array([row for _, row in live[start:start + SCAN_BLOCK]], dtype=np.int64)
+            self._write_rows(generation, start, old.quantized[rows],
+                             old.scales[rows] if old.scales is not None else None, old.full[rows])
+        with conn:
+            conn.executemany("UPDATE chunks SET row = ? WHERE id = ?", [(i, cid) for i, (cid, _) in enumerate(live)])
+            self._set_meta(conn, generation=generation, rows=len(live), version=meta["version"] + 1)
+        # Processes still mapping the old files keep their pages until they remap
+        for kind in ("quantized", "scales", "vectors"):
+            path = self._path(kind, meta["generation"])
+            if os.path.exists(path):
+                os.remove(path)
+        logger.info(f"Vacuumed vector store: {meta['rows'] - len(live)} dead rows dropped, {len(live)} kept")
+
+    # --- Reads -----------------------------------------------------------
+
+    @staticmethod
+    def _where(filter: Optional[dict]) -> Tuple[str, list]:
+        if not filter:
+            return "", []
+        clauses, params = [], []
+        for key, value in filter.items():
+            column = "user_id" if key == "user_id" else "json_extract(metadata, ?)"
+            if key.startswith("$") or (isinstance(value, dict) and list(value) != ["$in"]):
+                raise ValueError(f"Only equality and $in filters are supported, got {key}: {value}")
+            values = list(value["$in"]) if isinstance(value, dict) else [value]
+            if not values:
+                return " WHERE 0", []
+            # A user and their course libraries are searched with $in
+            clauses.append(f"{column} = ?" if len(values) == 1 else f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(([] if key == "user_id" else [f"$.{key}"]) + values)
+        return " WHERE " + " AND ".join(clauses), params
+
+    def _snapshot(self, filter: Optional[dict]) -> Tuple[np.ndarray, Optional[_Mapped]]:
+        """Rows matching the filter and maps covering them, from one consistent read"""
+        conn = self._connection()
+        where, params = self._where(filter)
+        conn.execute("BEGIN")
+        try:
+            meta = self._meta(conn)
+            key = (meta["version"], json.dumps(filter, sort_keys=True, default=str))
+            rows = self._row_cache.get(key)
+            if rows is None:
+                rows = np.array([r for (r,) in conn.execute(f"SELECT row FROM chunks{where}", params)],
+                                dtype=np.int64)
+                rows.sort()
+                if len(self._row_cache) > 256:
+                    self._row_cache.clear()
+                self._row_cache[key] = rows
+        finally:
+            conn.commit()
+        return rows, self._mapped(meta["generation"], meta["rows"], meta["dim"])
+
+    def _search(self, vector: np.ndarray, k: int, filter: Optional[dict]) -> Tuple[np.ndarray, np.ndarray]:
+        try:
+            rows, maps = self._snapshot(filter)
+        except FileNotFoundError:
+            # Files of the generation just read were vacuumed away meanwhile
+            rows, maps = self._snapshot(filter)
+        if maps is None or not len(rows):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        approx = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), SCAN_BLOCK):
+            block = rows[start:start + SCAN_BLOCK]
+            scores = maps.quantized[block].astype(np.float32) @ vector
+            if maps.scales is not None:
+                scores *= maps.scales[block]
+            approx[start:start + len(block)] = scores
+
+        n = min(len(rows), k * self.rescore_multiplier)
+        candidates = rows[np.argpartition(-approx, n - 1)[:n]] if n < len(rows) else rows
+        candidates = np.sort(candidates)
+        exact = maps.full[candidates] @ vector
+        order = np.argsort(-exact)[:k]
+        return candidates[order], exact[order]
+
+    def _documents(self, rows: np.ndarray) -> Dict[int, Document]:
+        if not len(rows):
+            return {}
+        placeholders = ",".join("?" for _ in rows)
+        found = self._connection().execute(
+            f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({placeholders})", [int(r) for r in rows]
+        ).fetchall()
+        return {row: Document(id=cid, page_content=text, metadata=json.loads(meta)) for row, cid, text, meta in found}
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[dict] = None) -> List[Tuple[Document, float]]:
+        vector = _normalize(np.asarray(embedding, dtype=np.float32))
+        rows, similarities = self._search(vector, k, filter)
+        docs = self._documents(rows)
+        # A row can vanish between the search and the lookup if it was deleted.
+        # For unit vectors the squared L2 distance is 2 - 2 * cosine similarity
+        return [(docs[int(r)], float(max(0.0, 2 - 2 * s))) for r, s in zip(rows, similarities) if int(r) in docs]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embeddings.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[dict] = None,
+                                    **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        # As Chroma does for its l2 space
+        return self._euclidean_relevance_score_fn
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None, limit: Optional[int] = None,
+            offset: Optional[int] = None, include: Optional[List[str]] = None, **kwargs: Any) -> Dict[str, Any]:
+        """Chroma-style ``get`` (ids, documents, metadatas and optionally embeddings)"""
+        include = ["documents", "metadatas"] if include is None else include
+        sql, params = self._where(where)
+        if ids is not None:
+            sql += (" AND " if sql else " WHERE ") + f"id IN ({','.join('?' for _ in ids)})"
+            params += list(ids)
+        sql += " ORDER BY row"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params += [-1 if limit is None else limit, offset or 0]
+        conn = self._connection()
+        found = conn.execute(f"SELECT id, row, document, metadata FROM chunks{sql}", params).fetchall()
+
+        result = {
+            "ids": [cid for cid, _, _, _ in found],
+            "documents": [text for _, _, text, _ in found] if "documents" in include else None,
+            "metadatas": [json.loads(meta) for _, _, _, meta in found] if "metadatas" in include else None,
+            "embeddings": None,
+        }
+        if "embeddings" in include:
+            meta = self._meta(conn)
+            maps = self._mapped(meta["generation"], meta["rows"], meta["dim"])
+            rows = np.array([row for _, row, _, _ in found], dtype=np.int64)
+            result["embeddings"] = maps.full[rows].tolist() if maps is not None and len(rows) else []
+        return result
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """Live and dead rows and bytes per vector in each file"""
+        meta = self._meta()
+        live = self.count()
+        quantized = meta["dim"] * np.dtype(QUANTIZED_DTYPES[self.dtype]).itemsize + (4 if self.dtype == "int8" else 0)
+        return {
+            "dtype": self.dtype,
+            "dim": meta["dim"],
+            "live": live,
+            "dead": meta["rows"] - live,
+            "scanned_bytes_per_vector": quantized,
+            "rescore_bytes_per_vector": meta["dim"] * 4,
+        }
+
+    def import_from(self, source: VectorStore, batch_size: int = 1000) -> int:
+        """Copy every chunk and its embedding from a Chroma store"""
+        copied = 0
+        while True:
+            batch = source.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=copied)
+            if not batch["ids"]:
+                return copied
+            self.add_vectors(batch["embeddings"], batch["documents"], batch["metadatas"], batch["ids"])
+            copied += len(batch["ids"])
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   directory: Optional[str] = None, **kwargs: Any) -> "CompactVectorStore":
+        if directory is None:
+            raise ValueError("CompactVectorStore.from_texts needs a directory")
+        ids = kwargs.pop("ids", None)
+        store = cls(directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
@@ -0,0 +1,124 @@
+import datetime
+import logging
+import re
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional
+
+from bson.objectid import ObjectId
+
+logger = logging.getLogger(__name__)
+
+# Pronouns and phrases that refer back to an earlier turn ("what are its
+# types?"), demonstratives standing for it rather than naming a new subject
+# ("what does that mean?", but not "what is this algorithm?"), and openings
+# that continue one ("and for UDP?")
+FOLLOW_UP = re.compile(
+    r"\b(it|its|they|them|their|he|she|him|his|her|the above|previous|the same|what else|anything else|"
+    r"tell me more|another example|how so)\b"
+    r"|\b(this|that|these|those)\s*(\?|$|\b(is|are|was|were|mean|means|do|does|work|works)\b)"
+    r"|^\s*(why\s+|how\s+)?(is|are|was|were|do|does|did)\s+(this|that|these|those)\b"
+    r"|^\s*(and|but|also|what about|how about)\b",
+    re.IGNORECASE
+)
+
+
+class ConversationMemory:
+    """Recent turns per user, bounded in turns per user and in users held
+
+    Each user's turns live in a fixed-size deque; users are kept in LRU
+    order and the least recently active are dropped past ``max_users``, so
+    memory stays bounded however many users are active. A user's recent
+    history is loaded from Mongo on first use, and new turns are appended
+    to Mongo through the write-behind buffer instead of on the request path.
+
+    With ``data_version`` (the UserVersions counter that serve.py workers
+    share), a user's turns are loaded again once another request, possibly
+    in another worker, has changed their data since they were loaded. A turn
+    asked in another worker is seen once that worker has saved it, within
+    the write-behind flush interval.
+    """
+
+    def __init__(self, collection, writes, max_turns: int = 6, max_users: int = 1000,
+                 answer_chars: int = 600, data_version: Optional[Callable[[str], int]] = None):
+        """
+        Args:
+            collection: Users collection holding the ``history`` array
+            writes: model.write_behind.WriteBehindBuffer for new turns
+            max_turns: Turns kept per user
+            max_users: Users kept in memory
+            answer_chars: Answer prefix kept in memory (Mongo gets it whole)
+            data_version: Returns a user's data version, which changes on
+                every write to their data in any worker
+        """
+        self.collection = collection
+        self.writes = writes
+        self.max_turns = max_turns
+        self.max_users = max_users
+        self.answer_chars = answer_chars
+        self.data_version = data_version
+        # user id -> [data version when loaded, recent turns]
+        self._users: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def turns(self, user_id: str) -> List[Dict[str, Any]]:
+        # Read before Mongo: a write landing in between makes the next call reload
+        version = self.data_version(user_id) if self.data_version is not None else None
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._users.move_to_end(user_id)
+                return list(entry[1])
+
+        user = self.collection.find_one(
+            {"_id": ObjectId(user_id)}, {"history": {"$slice": -self.max_turns}}
+        )
+        # Turns still waiting to be written are part of the history too
+        user = self.writes.overlay(user_id, user)
+        loaded = deque((self._compact(t) for t in (user or {}).get("history", [])), maxlen=self.max_turns)
+        with self._lock:
+            # Another request may have loaded or added turns meanwhile
+            entry = self._users.get(user_id)
+            if entry is None or entry[0] != version:
+                entry = self._users[user_id] = [version, loaded]
+            self._users.move_to_end(user_id)
+            self._evict()
+            return list(entry[1])
+
+    def add_turn(self, user_id: str, question: str, answer: str, sources: List[str]):
+        turn = {
+            "question": question,
+            "answer": answer,
+            "sources": sources,
+            "timestamp": datetime.datetime.now()
+        }
+        self.turns(user_id)
+        with self._lock:
+            entry = self._users.setdefault(user_id, [None, deque(maxlen=self.max_turns)])
+            entry[1].append(self._compact(turn))
+            self._users.move_to_end(user_id)
+            self._evict()
+        self.writes.push(user_id, "history", turn)
+
+    def retrieval_query(self, turns: List[Dict[str, Any]], question: str) -> str:
+        """Fold the previous question into follow-ups so retrieval has the subject"""
+        if not turns or not FOLLOW_UP.search(question):
+            return question
+        return f"{turns[-1]['question']}\n{question}"
+
+    @staticmethod
+    def history_text(turns: List[Dict[str, Any]], n: int = 3) -> str:
+        return "\n\n".join(f"Q: {t['question']}\nA: {t['answer']}" for t in turns[-n:])
+
+    def forget(self, user_id: str):
+        """Drop a user's memory and unsaved turns (their history was cleared)"""
+        with self._lock:
+            self._users.pop(user_id, None)
+        self.writes.discard(user_id)
+
+    def _compact(self, turn: Dict[str, Any]) -> Dict[str, Any]:
+        return {"question": turn.get("question", ""), "answer": (turn.get("answer") or "")[:self.answer_chars]}
+
+    def _evict(self):
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
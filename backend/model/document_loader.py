@@ -1,6 +1,8 @@
+import codecs
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Iterator, List, Optional, Tuple
 from langchain_core.documents import Document
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredWordDocumentLoader
 
@@ -14,6 +16,12 @@ except ImportError:
     PDFPLUMBER_AVAILABLE = False
     logger.warning("pdfplumber not installed. Table extraction will be limited.")
 
+try:
+    import pypdfium2
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    PDFIUM_AVAILABLE = False
+
 try:
     from pptx import Presentation
     PPTX_AVAILABLE = True
@@ -21,13 +29,233 @@ except ImportError:
     PPTX_AVAILABLE = False
     logger.warning("python-pptx not installed. PowerPoint support unavailable.")
 
+try:
+    import docx
+    DOCX_AVAILABLE = True
+except ImportError:
+    DOCX_AVAILABLE = False
+    logger.warning("python-docx not installed. Word files will be loaded with unstructured.")
+
+# Pages per process-pool task when a PDF is sharded
+PAGES_PER_SHARD = 8
+
+# Ruling-line geometry, matching pdfplumber's default table settings:
+# shorter edges are ignored, thinner paths count as lines and edges within
+# the tolerance of each other are treated as touching
+EDGE_MIN_LENGTH = 3
+EDGE_TOLERANCE = 3
+
+# Pages with more edges than this go straight to table extraction
+MAX_EDGES_CHECKED = 400
+
+
+def _may_have_tables(horizontal: List[tuple], vertical: List[tuple]) -> bool:
+    """Whether ruling lines could form a table under pdfplumber's "lines" strategy
+
+    A cell is two vertical edges crossed by the same two horizontal edges,
+    and pdfplumber drops tables of a single cell (a page border or boxed
+    heading), so at least two cells are required. Cells are counted per pair
+    of verticals without checking they are minimal, which can only err
+    towards extracting tables.
+
+    Args:
+        horizontal: (x0, x1, y) per horizontal edge
+        vertical: (x, y0, y1) per vertical edge
+    """
+    if len(horizontal) < 2 or len(vertical) < 2:
+        return False
+    if len(horizontal) + len(vertical) > MAX_EDGES_CHECKED:
+        return True
+
+    tol = EDGE_TOLERANCE
+    crossings = [
+        frozenset(
+            i for i, (x0, x1, y) in enumerate(horizontal)
+            if x0 - tol <= x <= x1 + tol and y0 - tol <= y <= y1 + tol
+        )
+        for x, y0, y1 in vertical
+    ]
+    cells = 0
+    for a in range(len(crossings)):
+        for b in range(a + 1, len(crossings)):
+            shared = len(crossings[a] & crossings[b])
+            cells += shared * (shared - 1) // 2
+            if cells >= 2:
+                return True
+    return False
+
+
+def _pdfium_ruling_lines(page) -> tuple:
+    """Horizontal and vertical edges of a pdfium page's vector paths
+
+    Paths are taken by their bounding box: thin ones are lines, anything
+    else contributes its four sides, as a rectangle does in pdfplumber.
+    """
+    import pypdfium2.raw as pdfium_c
+
+    horizontal, vertical = [], []
+    for obj in page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_PATH]):
+        left, bottom, right, top = obj.get_bounds()
+        width, height = right - left, top - bottom
+        if width < EDGE_MIN_LENGTH and height < EDGE_MIN_LENGTH:
+            continue
+        if height <= EDGE_MIN_LENGTH:
+            horizontal.append((left, right, (bottom + top) / 2))
+        elif width <= EDGE_MIN_LENGTH:
+            vertical.append(((left + right) / 2, bottom, top))
+        else:
+            horizontal += [(left, right, bottom), (left, right, top)]
+            vertical += [(left, bottom, top), (right, bottom, top)]
+    return horizontal, vertical
+
+
+def _pdfplumber_ruling_lines(page) -> tuple:
+    horizontal, vertical = [], []
+    for edge in page.edges:
+        if edge["orientation"] == "h":
+            horizontal.append((edge["x0"], edge["x1"], edge["top"]))
+        else:
+            vertical.append((edge["x0"], edge["top"], edge["bottom"]))
+    return horizontal, vertical
+
+
+def _pdf_page_count(file_path: str) -> int:
+    if PDFIUM_AVAILABLE:
+        pdf = pypdfium2.PdfDocument(file_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    import pdfplumber
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+
+def _load_pdf_shard(args) -> List[Document]:
+    """Process-pool entry point for _load_pdf_pages"""
+    return _load_pdf_pages(*args)
+
+
+def _load_pdf_pages(file_path: str, start: int, stop: int) -> List[Document]:
+    """Pages [start, stop) of a PDF, one Document per page with its tables appended
+
+    Text comes from pdfium when available, which is far cheaper than
+    pdfplumber's layout analysis. pdfplumber only parses pages whose
+    vector paths could form a ruled table; on every other page table
+    extraction cannot find anything, so ``has_tables`` stays accurate.
+    """
+    import pdfplumber
+
+    path = Path(file_path)
+    documents = []
+    pdfium_doc = pypdfium2.PdfDocument(file_path) if PDFIUM_AVAILABLE else None
+
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            for page_num in range(start, stop):
+                if pdfium_doc is not None:
+                    pdfium_page = pdfium_doc[page_num]
+                    text_page = pdfium_page.get_textpage()
+                    # pdfium marks hyphens at line breaks with U+FFFE
+                    text = text_page.get_text_range().replace("\r\n", "\n").replace("\ufffe", "-")
+                    candidate = _may_have_tables(*_pdfium_ruling_lines(pdfium_page))
+                    text_page.close()
+                    pdfium_page.close()
+                    page = pdf.pages[page_num] if candidate else None
+                else:
+                    page = pdf.pages[page_num]
+                    text = page.extract_text() or ""
+                    candidate = _may_have_tables(*_pdfplumber_ruling_lines(page))
+
+                tables = page.extract_tables() if candidate else []
+                if page is not None:
+                    # Release the parsed layout; pdfplumber caches it per page
+                    page.close()
+
+                # Combine text and tables
+                combined_content = text
+
+                if tables:
+                    for i, table in enumerate(tables):
+                        if table:
+                            table_text = EnhancedDocumentLoader._format_table(table, i)
+                            combined_content += f"\n\n{table_text}"
+
+                if combined_content.strip():
+                    doc = Document(
+                        page_content=combined_content,
+                        metadata={
+                            "source": file_path,
+                            "source_file": path.name,
+                            "page": page_num + 1,
+                            "file_type": "pdf",
+                            "has_tables": len(tables) > 0,
+                        }
+                    )
+                    documents.append(doc)
+    finally:
+        if pdfium_doc is not None:
+            pdfium_doc.close()
+
+    return documents
+
+
+def _docx_blocks(file_path: str) -> Iterator[Tuple[str, int, object]]:
+    """Body of a .docx in document order as (kind, heading level, content)
+
+    kind is "heading" (content is its text, level 0 for Title, N for Heading N),
+    "paragraph" (text, list items prefixed with "- ") or "table" (rows of
+    cell texts). Paragraphs inside tables only appear in their table.
+    """
+    from docx.oxml.ns import qn
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+
+    document = docx.Document(file_path)
+    # Paragraph.style scans every style of the document on each call
+    style_names = {style.style_id: style.name for style in document.styles}
+    for element in document.element.body.iterchildren():
+        if element.tag == qn("w:p"):
+            text = Paragraph(element, document).text.strip()
+            if not text:
+                continue
+            style = style_names.get(element.style, "") or ""
+            if style == "Title":
+                yield "heading", 0, text
+            elif style.startswith("Heading ") and style[8:].isdigit():
+                yield "heading", int(style[8:]), text
+            elif style.startswith("List"):
+                yield "paragraph", 0, f"- {text}"
+            else:
+                yield "paragraph", 0, text
+        elif element.tag == qn("w:tbl"):
+            rows = []
+            for row in Table(element, document).rows:
+                cells, seen = [], set()
+                for cell in row.cells:
+                    # A merged cell is returned once per grid column it spans
+                    if id(cell._tc) not in seen:
+                        seen.add(id(cell._tc))
+                        # Cells may hold several paragraphs; keep each row on one line
+                        cells.append(" ".join(cell.text.split()))
+                rows.append(cells)
+            if rows:
+                yield "table", 0, rows
+
 
 class EnhancedDocumentLoader:
     """Enhanced document loader supporting multiple educational formats"""
     
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, max_workers: Optional[int] = None):
+        """
+        Args:
+            file_path: Document to load
+            max_workers: Load page ranges of large PDFs in this many processes
+                (None or 1 loads in the calling process)
+        """
         self.file_path = file_path
         self.path = Path(file_path)
+        self.max_workers = max_workers
     
     def load(self) -> List[Document]:
         """Load document based on file type"""
@@ -58,41 +286,23 @@ class EnhancedDocumentLoader:
             return loader.load()
     
     def _load_pdf_with_pdfplumber(self) -> List[Document]:
-        """Load PDF using pdfplumber"""
-        import pdfplumber
-        
+        """Load PDF using pdfplumber, sharding page ranges across processes"""
+        page_count = _pdf_page_count(self.file_path)
+        if not self.max_workers or self.max_workers <= 1 or page_count <= PAGES_PER_SHARD:
+            return _load_pdf_pages(self.file_path, 0, page_count)
+
+        shards = [
+            (self.file_path, start, min(start + PAGES_PER_SHARD, page_count))
+            for start in range(0, page_count, PAGES_PER_SHARD)
+        ]
         documents = []
-        
-        with pdfplumber.open(self.file_path) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                text = page.extract_text() or ""
-                tables = page.extract_tables()
-                
-                # Combine text and tables
-                combined_content = text
-                
-                if tables:
-                    for i, table in enumerate(tables):
-                        if table:
-                            table_text = self._format_table(table, i)
-                            combined_content += f"\n\n{table_text}"
-                
-                if combined_content.strip():
-                    doc = Document(
-                        page_content=combined_content,
-                        metadata={
-                            "source": self.file_path,
-                            "source_file": self.path.name,
-                            "page": page_num + 1,
-                            "file_type": "pdf",
-                            "has_tables": len(tables) > 0,
-                        }
-                    )
-                    documents.append(doc)
-        
+        with ProcessPoolExecutor(max_workers=min(self.max_workers, len(shards))) as pool:
+            for docs in pool.map(_load_pdf_shard, shards):
+                documents.extend(docs)
         return documents
     
-    def _format_table(self, table: List[List[str]], index: int) -> str:
+    @staticmethod
+    def _format_table(table: List[List[str]], index: int) -> str:
         """Format table for better readability"""
         if not table:
             return ""
@@ -110,14 +320,72 @@ class EnhancedDocumentLoader:
         return "\n".join(lines)
     
     def _load_text(self) -> List[Document]:
-        """Load text files"""
-        loader = TextLoader(self.file_path, encoding='utf-8')
+        """Load text files (UTF-8, or UTF-16/32 with a byte order mark)"""
+        with open(self.file_path, 'rb') as f:
+            head = f.read(4)
+        encoding = 'utf-8-sig'
+        if head.startswith((codecs.BOM_UTF32_LE, codecs.BOM_UTF32_BE)):
+            encoding = 'utf-32'
+        elif head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            encoding = 'utf-16'
+        loader = TextLoader(self.file_path, encoding=encoding)
         return loader.load()
     
     def _load_word(self) -> List[Document]:
-        """Load Word documents"""
+        """Load Word documents (.docx natively, legacy .doc through unstructured)"""
+        if self.path.suffix.lower() == '.docx' and DOCX_AVAILABLE:
+            return self._load_docx()
         loader = UnstructuredWordDocumentLoader(self.file_path)
         return loader.load()
+
+    def _load_docx(self) -> List[Document]:
+        """Load a .docx with python-docx, one Document per heading section
+
+        A section runs from a heading to the next heading that follows some
+        body text, so a chapter heading directly followed by a subheading
+        stays with it. Headings are kept as markdown lines for the splitter
+        and tables are formatted like PDF tables.
+        """
+        documents = []
+        headings: List[Tuple[int, str]] = []
+        parts: List[str] = []
+        has_body = False
+        tables = 0
+
+        def flush():
+            content = "\n\n".join(parts)
+            if content.strip():
+                documents.append(Document(
+                    page_content=content,
+                    metadata={
+                        "source": self.file_path,
+                        "source_file": self.path.name,
+                        "section": len(documents) + 1,
+                        "section_title": headings[-1][1] if headings else "",
+                        "heading_path": " > ".join(text for _, text in headings),
+                        "file_type": "docx",
+                        "has_tables": tables > 0,
+                    }
+                ))
+
+        for kind, level, content in _docx_blocks(self.file_path):
+            if kind == "heading":
+                if has_body:
+                    flush()
+                    parts, has_body, tables = [], False, 0
+                while headings and headings[-1][0] >= level:
+                    headings.pop()
+                headings.append((level, content))
+                parts.append(f"{'#' * min(max(level, 1), 6)} {content}")
+            elif kind == "table":
+                parts.append(self._format_table(content, tables))
+                tables += 1
+                has_body = True
+            else:
+                parts.append(content)
+                has_body = True
+        flush()
+        return documents
     
     def _load_powerpoint(self) -> List[Document]:
         """Load PowerPoint presentations"""
@@ -169,9 +437,11 @@ class EnhancedDocumentLoader:
         
         for slide_num, slide in enumerate(prs.slides):
             content_parts = []
+            slide_title = ""
             
             # Extract title
             if slide.shapes.title:
+                slide_title = slide.shapes.title.text.strip()
                 content_parts.append(f"SLIDE TITLE: {slide.shapes.title.text}")
             
             # Extract text from shapes
@@ -187,6 +457,7 @@ class EnhancedDocumentLoader:
                         "source": self.file_path,
                         "source_file": self.path.name,
                         "slide": slide_num + 1,
+                        "slide_title": slide_title,
                         "file_type": "pptx",
                     }
                 )
@@ -1,25 +1,153 @@
 import logging
-from langchain_huggingface import HuggingFaceEmbeddings
+import os
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from metrics import span
 
 logger = logging.getLogger(__name__)
 
 
+class _PendingQuery:
+    __slots__ = ("text", "done", "vector", "error")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.done = threading.Event()
+        self.vector = None
+        self.error = None
+
+
+class QueryBatcher:
+    """Embed concurrent queries in shared forward passes
+
+    Callers queue their text and wait; one background thread takes
+    everything queued (up to ``max_batch``) and embeds it in a single batch.
+    Requests arriving while a batch is running simply queue for the next
+    one, so batches grow with load. After a batch of more than one query
+    the thread also lingers up to ``max_wait`` seconds for stragglers; a
+    lone query on an idle server is embedded immediately.
+    """
+
+    def __init__(self, embed_batch: Callable[[List[str]], List[List[float]]],
+                 max_batch: int = 16, max_wait: float = 0.002):
+        self.embed_batch = embed_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.queries = 0
+        self._queue: "queue.Queue[_PendingQuery]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker_pid = None
+
+    def embed(self, text: str) -> List[float]:
+        pending = _PendingQuery(text)
+        self._ensure_worker()
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.vector
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so each serve.py worker starts its own
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            threading.Thread(target=self._run, name="query-embedding-batcher", daemon=True).start()
+
+    def _take_batch(self, linger: bool) -> List[_PendingQuery]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait if linger else None
+        while len(batch) < self.max_batch:
+            try:
+                if deadline is None:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        linger = False
+        while True:
+            batch = self._take_batch(linger)
+            try:
+                vectors = self.embed_batch([p.text for p in batch])
+                for pending, vector in zip(batch, vectors):
+                    pending.vector = vector
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+            for pending in batch:
+                pending.done.set()
+            self.batches += 1
+            self.queries += len(batch)
+            linger = len(batch) > 1 and self.max_wait > 0
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "mean_batch_size": round(self.queries / self.batches, 2) if self.batches else None,
+        }
+
+
 class EmbeddingManager:
     """Manage embedding model for document vectorization"""
-    
-    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
+
+    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2", lazy: bool = False,
+                 query_batch_size: int = 16, query_batch_wait_ms: float = 2.0):
         """
         Initialize embedding model
-        
+
         Args:
             model_name: HuggingFace model name for embeddings
+            lazy: Defer loading the model until it is first used (or warmed)
+            query_batch_size: Most concurrent queries embedded in one forward
+                pass (1 embeds every query on its own thread)
+            query_batch_wait_ms: How long a batch under load waits for more
+                queries to arrive
         """
         self.model_name = model_name
-        self.embeddings = self._initialize_embeddings()
-    
+        self._embeddings = None
+        self._lock = threading.Lock()
+        self.query_batcher: Optional[QueryBatcher] = None
+        if query_batch_size > 1:
+            self.query_batcher = QueryBatcher(
+                lambda texts: self.embeddings.embed_documents(texts),
+                max_batch=query_batch_size, max_wait=query_batch_wait_ms / 1000
+            )
+        if not lazy:
+            self.warm()
+
+    @property
+    def embeddings(self):
+        """Loaded HuggingFace embeddings (loads the model on first access)"""
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = self._initialize_embeddings()
+        return self._embeddings
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._embeddings is not None
+
     def _initialize_embeddings(self):
         """Initialize HuggingFace embeddings"""
         try:
+            # Imported here: pulls in sentence-transformers and torch
+            from langchain_huggingface import HuggingFaceEmbeddings
+
             embeddings = HuggingFaceEmbeddings(
                 model_name=self.model_name,
                 model_kwargs={'device': 'cpu'},
@@ -30,15 +158,39 @@ class EmbeddingManager:
         except Exception as e:
             logger.error(f"Error initializing embeddings: {e}")
             raise
-    
+
+    def warm(self):
+        """Load the model and run one forward pass so the first query is fast"""
+        self.embeddings.embed_query("warm up")
+
     def get_embeddings(self):
         """Get the embedding function"""
         return self.embeddings
-    
+
+    def lazy_embeddings(self) -> Embeddings:
+        """Embedding function that only loads the model when first called"""
+        return _LazyEmbeddings(self)
+
     def embed_query(self, text: str):
-        """Embed a single query text"""
-        return self.embeddings.embed_query(text)
-    
+        """Embed a single query text (batched with concurrent queries)"""
+        if self.query_batcher is None:
+            return self.embeddings.embed_query(text)
+        return self.query_batcher.embed(text)
+
     def embed_documents(self, texts: list):
         """Embed multiple documents"""
         return self.embeddings.embed_documents(texts)
+
+
+class _LazyEmbeddings(Embeddings):
+    """Embeddings proxy so a vector store can be opened before the model is loaded"""
+
+    def __init__(self, manager: EmbeddingManager):
+        self.manager = manager
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.manager.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with span("embed_query"):
+            return self.manager.embed_query(text)
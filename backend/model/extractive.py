@@ -0,0 +1,86 @@
+"""
+Extractive compression of fetched text before it goes into a prompt
+
+WikipediaQueryRun returns the summaries of several pages, much of which has
+nothing to do with the question. The text is split into sentences, each is
+scored by cosine similarity to the query with the embedding model, and the
+best ones are kept up to a token budget, in their original order and under
+their page titles.
+"""
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PAGE_BREAK = re.compile(r"\n\n(?=Page: )")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])|\n+")
+
+
+def split_pages(text: str) -> List[Tuple[str, str]]:
+    """(title line, body) per "Page: <title>\\nSummary: <text>" block"""
+    pages = []
+    for block in PAGE_BREAK.split(text.strip()):
+        title, _, body = block.partition("\n")
+        if not title.startswith("Page: "):
+            title, body = "", block
+        pages.append((title, re.sub(r"^Summary:\s*", "", body.strip())))
+    return pages
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in SENTENCE_END.split(text) if s and s.strip()]
+
+
+class ExtractiveCompressor:
+    """Keep the sentences most similar to a query within a token budget"""
+
+    def __init__(self, embedding_manager, max_tokens: int = 350,
+                 count_tokens: Optional[Callable[[str], int]] = None):
+        """
+        Args:
+            embedding_manager: EmbeddingManager (or the sidecar's) scoring sentences
+            max_tokens: Budget for the kept sentences, page titles included
+            count_tokens: Token counter (defaults to 4 characters per token)
+        """
+        self.embedding_manager = embedding_manager
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens or (lambda text: (len(text) + 3) // 4)
+
+    def compress(self, query: str, text: str) -> Tuple[str, Dict[str, Any]]:
+        """Return the compressed text and its token and sentence counts"""
+        pages = split_pages(text)
+        sentences = [(p, s) for p, (_, body) in enumerate(pages) for s in split_sentences(body)]
+        tokens = [self.count_tokens(s) for _, s in sentences]
+        stats = {"tokens_before": self.count_tokens(text), "sentences_before": len(sentences)}
+
+        if sum(tokens) <= self.max_tokens or len(sentences) < 2:
+            return text, {**stats, "tokens_after": stats["tokens_before"], "sentences_after": len(sentences)}
+
+        vectors = np.asarray(self.embedding_manager.embed_documents([s for _, s in sentences]), dtype=np.float32)
+        query_vector = np.asarray(self.embedding_manager.embed_query(query), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query_vector) or 1.0)
+        scores = vectors @ query_vector / np.where(norms == 0, 1.0, norms)
+
+        # Best sentences first, skipping any that would overflow the budget
+        # (the best one is always kept); a page title is paid for with its
+        # first kept sentence
+        kept, titled, used = set(), set(), 0
+        for i in np.argsort(-scores):
+            page = sentences[i][0]
+            cost = tokens[i] + (self.count_tokens(pages[page][0]) if page not in titled else 0)
+            if kept and used + cost > self.max_tokens:
+                continue
+            kept.add(int(i))
+            titled.add(page)
+            used += cost
+
+        blocks = []
+        for p, (title, _) in enumerate(pages):
+            chosen = [s for i, (page, s) in enumerate(sentences) if page == p and i in kept]
+            if chosen:
+                blocks.append("\n".join(filter(None, [title, " ".join(chosen)])))
+        compressed = "\n\n".join(blocks)
+        return compressed, {**stats, "tokens_after": self.count_tokens(compressed), "sentences_after": len(kept)}
@@ -0,0 +1,208 @@
+import datetime
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# ChromaDB default max batch is 166, use 100 to be safe
+BATCH_SIZE = 100
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_documents(owner_id: str, path: str, name: str, pdf_workers: int = 1) -> List[Any]:
+    """Load a file into Documents carrying the owner and document name"""
+    from model.document_loader import EnhancedDocumentLoader
+
+    docs = EnhancedDocumentLoader(path, max_workers=pdf_workers).load()
+    uploaded_at = datetime.datetime.now().isoformat()
+    # Add metadata
+    for doc in docs:
+        doc.metadata["user_id"] = owner_id
+        doc.metadata["uploaded_at"] = uploaded_at
+        doc.metadata["source_file"] = os.path.basename(path)
+        doc.metadata["document_name"] = name
+    return docs
+
+
+def chunk_id(chunk) -> str:
+    """Deterministic id: the parent id already scopes owner, file and section"""
+    text_hash = hashlib.sha1(chunk.page_content.encode("utf-8")).hexdigest()[:16]
+    return f"{chunk.metadata['parent_id']}-{text_hash}"
+
+
+class IngestionPipeline:
+    """Index files per owner, re-embedding only chunks that changed
+
+    A manifest per (owner, document name) records the file hash and the ids
+    of its chunks and parent sections. Re-uploading a document diffs the new
+    chunk ids against the manifest: new chunks are embedded and upserted,
+    unchanged ones are left alone and stale ones are deleted.
+    """
+
+    def __init__(self, text_splitter, vector_store, parent_store, manifests, pdf_workers: int = 1):
+        """
+        Args:
+            text_splitter: SmartTextSplitter
+            vector_store: LangChain vector store (Chroma or the sidecar client)
+            parent_store: model.parent_retrieval.ParentStore
+            manifests: Mongo collection holding one manifest per document
+            pdf_workers: Processes used to load page ranges of large PDFs
+        """
+        self.text_splitter = text_splitter
+        self.vector_store = vector_store
+        self.parent_store = parent_store
+        self.manifests = manifests
+        self.pdf_workers = pdf_workers
+        # (owner, manifest state) -> whether the manifests cover all its chunks
+        self._covered_cache: "OrderedDict[tuple, bool]" = OrderedDict()
+        self._covered_lock = threading.Lock()
+
+    def ingest_file(self, owner_id: str, path: str, name: str,
+                    digest: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Index one file; returns chunk counts, or None if it had no content"""
+        digest = digest or file_digest(path)
+        manifest = self.manifests.find_one({"user_id": owner_id, "name": name})
+        if manifest and manifest.get("sha256") == digest:
+            return {"added": 0, "kept": len(manifest["chunks"]), "removed": 0,
+                    "chunks": len(manifest["chunks"]), "unchanged": True}
+
+        docs = load_documents(owner_id, path, name, self.pdf_workers)
+        if not docs:
+            return None
+
+        return self.index_documents(owner_id, name, digest, docs, manifest)
+
+    def index_documents(self, owner_id: str, name: str, digest: str, docs: List[Any],
+                        manifest: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Split loaded documents and apply the diff against the manifest"""
+        # Children are embedded; parents are stored as the context they expand to
+        parents, children = self.text_splitter.split_with_parents(docs)
+        return self.index_split(owner_id, name, digest, parents, children, manifest)
+
+    def index_split(self, owner_id: str, name: str, digest: str, parents: List[Any], children: List[Any],
+                    manifest: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Embed and store already split documents, applying the diff against the manifest
+
+        Loading and splitting can then run elsewhere (see ingest_library.py).
+        """
+        from model.precompute import extract_topics
+
+        new_chunks: Dict[str, Any] = {}
+        for child in children:
+            new_chunks.setdefault(chunk_id(child), child)
+
+        old_ids = set(manifest["chunks"]) if manifest else set()
+        to_add = [(cid, c) for cid, c in new_chunks.items() if cid not in old_ids]
+        removed = old_ids - new_chunks.keys()
+
+        self.parent_store.add(parents)
+        # Add to vector store in batches to avoid exceeding max batch size
+        for i in range(0, len(to_add), BATCH_SIZE):
+            batch = to_add[i:i + BATCH_SIZE]
+            self.vector_store.add_documents([c for _, c in batch], ids=[cid for cid, _ in batch])
+        # Delete only after the replacements are searchable
+        removed = list(removed)
+        for i in range(0, len(removed), BATCH_SIZE):
+            self.vector_store.delete(ids=removed[i:i + BATCH_SIZE])
+
+        parent_ids = list(dict.fromkeys(p.metadata["parent_id"] for p in parents))
+        if manifest:
+            self.parent_store.delete(list(set(manifest.get("parents", [])) - set(parent_ids)))
+
+        self.manifests.update_one(
+            {"user_id": owner_id, "name": name},
+            {"$set": {
+                "user_id": owner_id,
+                "name": name,
+                "sha256": digest,
+                "chunks": list(new_chunks),
+                "parents": parent_ids,
+                "topics": extract_topics(children, self.text_splitter),
+                "updated_at": datetime.datetime.now()
+            }},
+            upsert=True
+        )
+
+        logger.info(f"Indexed '{name}' for {owner_id}: {len(to_add)} added, "
+                    f"{len(new_chunks) - len(to_add)} kept, {len(removed)} removed")
+        return {"added": len(to_add), "kept": len(new_chunks) - len(to_add), "removed": len(removed),
+                "chunks": len(new_chunks), "unchanged": False}
+
+    def find_digest(self, owner_ids: List[str], digest: str) -> Optional[Dict[str, Any]]:
+        """Manifest of a document with this content indexed under one of the owners"""
+        if not owner_ids:
+            return None
+        return self.manifests.find_one({"user_id": {"$in": list(owner_ids)}, "sha256": digest})
+
+    def topics(self, *owner_ids: str) -> List[str]:
+        topics = []
+        for manifest in self.manifests.find({"user_id": {"$in": list(owner_ids)}}, {"topics": 1}):
+            topics.extend(manifest.get("topics", []))
+        return topics
+
+    def fingerprint(self, *owner_ids: str) -> str:
+        """Hash of the contents of the owners' indexed documents
+
+        Owners who indexed the same files under the same names (or search the
+        same libraries) get the same fingerprint, so their retrieval (and the
+        answers built on it) match. An owner is hashed by id instead when its
+        manifests do not account for all of its chunks (some were indexed
+        before manifests were kept) or it has nothing indexed, so only
+        content known to be identical is shared between users.
+        """
+        owners = sorted(set(owner_ids))
+        indexed: Dict[str, List[str]] = {}
+        for manifest in self.manifests.find({"user_id": {"$in": owners}},
+                                            {"user_id": 1, "sha256": 1, "name": 1, "updated_at": 1}):
+            entry = f"{manifest.get('sha256', '')}:{manifest.get('name', '')}"
+            indexed.setdefault(manifest["user_id"], []).append((entry, manifest.get("updated_at")))
+        parts = []
+        for owner in owners:
+            entries = indexed.get(owner)
+            if entries and self._covered(owner, entries):
+                parts.extend(entry for entry, _ in entries)
+            elif entries or self._has_chunks(owner):
+                parts.append(f"owner:{owner}")
+        parts = sorted(parts) or [f"owner:{owner}" for owner in owners]
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+    def _covered(self, owner_id: str, entries: List[tuple]) -> bool:
+        """Whether the owner's manifests list every chunk it has in the vector store
+
+        Counting means listing the owner's chunk ids, so the answer is kept
+        until the owner's manifests change.
+        """
+        state = (owner_id, hashlib.sha1(repr(sorted(entries, key=repr)).encode("utf-8")).hexdigest())
+        with self._covered_lock:
+            if state in self._covered_cache:
+                self._covered_cache.move_to_end(state)
+                return self._covered_cache[state]
+        listed = sum(len(m.get("chunks", [])) for m in self.manifests.find({"user_id": owner_id}, {"chunks": 1}))
+        stored = len(self.vector_store.get(where={"user_id": owner_id}, include=[])["ids"])
+        with self._covered_lock:
+            self._covered_cache[state] = covered = stored == listed
+            while len(self._covered_cache) > 10000:
+                self._covered_cache.popitem(last=False)
+        return covered
+
+    def _has_chunks(self, owner_id: str) -> bool:
+        return bool(self.vector_store.get(where={"user_id": owner_id}, limit=1, include=[])["ids"])
+
+    def remove_owner(self, owner_id: str):
+        """Delete every chunk, parent section and manifest of an owner"""
+        ids = self.vector_store.get(where={"user_id": owner_id}, include=[])["ids"]
+        for i in range(0, len(ids), BATCH_SIZE):
+            self.vector_store.delete(ids=ids[i:i + BATCH_SIZE])
+        self.parent_store.delete_user(owner_id)
+        self.manifests.delete_many({"user_id": owner_id})
@@ -0,0 +1,156 @@
+"""
+Shared course libraries: documents indexed once and attached to many users
+
+A library's files are indexed like a user's, under the owner id
+``library:<id>``, so their chunks, parent sections and manifests exist once
+however many students subscribe. A user's subscriptions are kept in the
+``libraries`` array of their user document, and retrieval searches the
+user's own chunks together with those of their libraries.
+
+Library content is also changed from outside the server, by the bulk
+ingestion CLI, so every change rewrites a version file next to the vector
+store. Its identity (inode and modification time) is the libraries'
+version, cheap enough for the server to check on every cached read. It is
+changed, and uploads are linked to a library document, only once the
+document's manifest is written, after its chunks are in the index the
+server searches (ingest_library.py writes through the server's sidecar, or
+runs while no server is up).
+"""
+import datetime
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+OWNER_PREFIX = "library:"
+LIBRARY_ID = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+
+def library_owner(library_id: str) -> str:
+    """Owner id the library's chunks and manifests are stored under"""
+    return f"{OWNER_PREFIX}{library_id}"
+
+
+def library_id_of(owner_id: str) -> Optional[str]:
+    return owner_id[len(OWNER_PREFIX):] if owner_id.startswith(OWNER_PREFIX) else None
+
+
+class LibraryRegistry:
+    """Libraries, their document lists and who subscribes to them"""
+
+    def __init__(self, collection, users_collection, version_path: str, cache_seconds: float = 30.0):
+        """
+        Args:
+            collection: Mongo collection with one document per library
+            users_collection: Users collection holding the subscriptions
+            version_path: File rewritten whenever a library's documents or
+                title change, shared by the server and the ingestion CLI
+            cache_seconds: How long a user's subscriptions are reused before
+                reading them again (changes made in this process apply at once)
+        """
+        self.collection = collection
+        self.users = users_collection
+        self.version_path = version_path
+        self.cache_seconds = cache_seconds
+        self._subscriptions: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def create(self, library_id: str, title: Optional[str] = None, created_by: Optional[str] = None) -> Dict[str, Any]:
+        """Return the library, creating it if it does not exist"""
+        if not LIBRARY_ID.match(library_id):
+            raise ValueError("Library ids are lowercase letters, digits, '-' and '_' (at most 64)")
+        self.collection.update_one(
+            {"_id": library_id},
+            {"$setOnInsert": {"title": title or library_id, "created_by": created_by,
+                              "created_at": datetime.datetime.now(), "documents": []}},
+            upsert=True
+        )
+        if title:
+            result = self.collection.update_one({"_id": library_id}, {"$set": {"title": title}})
+            if result.modified_count:
+                self._changed()
+        return self.collection.find_one({"_id": library_id})
+
+    def get(self, library_id: str) -> Optional[Dict[str, Any]]:
+        return self.collection.find_one({"_id": library_id})
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [self.summary(library) for library in self.collection.find({}).sort("_id", 1)]
+
+    def record_document(self, library_id: str, path: str, name: str, chunks: int):
+        """Update the library's entry for this document name in place, or add it"""
+        entry = {"filename": os.path.basename(path), "name": name, "chunks": chunks,
+                 "uploaded_at": datetime.datetime.now()}
+        result = self.collection.update_one({"_id": library_id, "documents.name": name},
+                                            {"$set": {"documents.$": entry}})
+        if result.matched_count == 0:
+            self.collection.update_one({"_id": library_id}, {"$push": {"documents": entry}})
+        self._changed()
+
+    def version(self) -> tuple:
+        """Changes whenever any library's documents or title change, in any process"""
+        try:
+            stat = os.stat(self.version_path)
+        except FileNotFoundError:
+            return (0, 0)
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _changed(self):
+        # A new file each time: a fresh inode tells writes apart even when
+        # they fall within one tick of the filesystem clock
+        temp = f"{self.version_path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temp, "w") as f:
+            f.write(str(time.time_ns()))
+        os.replace(temp, self.version_path)
+
+    def subscriptions(self, user_id: str) -> List[str]:
+        """Ids of the libraries the user subscribes to"""
+        now = time.monotonic()
+        cached = self._subscriptions.get(user_id)
+        if cached and now - cached[0] < self.cache_seconds:
+            return cached[1]
+        from bson.objectid import ObjectId
+        user = self.users.find_one({"_id": ObjectId(user_id)}, {"libraries": 1})
+        libraries = list(user.get("libraries", [])) if user else []
+        with self._lock:
+            if len(self._subscriptions) > 10000:
+                self._subscriptions.clear()
+            self._subscriptions[user_id] = (now, libraries)
+        return libraries
+
+    def subscribed(self, user_id: str) -> List[Dict[str, Any]]:
+        """The user's libraries with their document lists"""
+        ids = self.subscriptions(user_id)
+        if not ids:
+            return []
+        found = {library["_id"]: library for library in self.collection.find({"_id": {"$in": ids}})}
+        return [found[i] for i in ids if i in found]
+
+    def subscribe(self, user_id: str, library_id: str) -> bool:
+        """Subscribe the user; False if the library does not exist"""
+        from bson.objectid import ObjectId
+        if not self.get(library_id):
+            return False
+        self.users.update_one({"_id": ObjectId(user_id)}, {"$addToSet": {"libraries": library_id}})
+        self._forget(user_id)
+        return True
+
+    def unsubscribe(self, user_id: str, library_id: str):
+        """Unsubscribe the user, dropping their uploads that were linked to the library"""
+        from bson.objectid import ObjectId
+        self.users.update_one({"_id": ObjectId(user_id)}, {"$pull": {"libraries": library_id,
+                                                                     "documents": {"library": library_id}}})
+        self._forget(user_id)
+
+    def _forget(self, user_id: str):
+        with self._lock:
+            self._subscriptions.pop(user_id, None)
+
+    @staticmethod
+    def summary(library: Dict[str, Any]) -> Dict[str, Any]:
+        return {"id": library["_id"], "title": library.get("title", library["_id"]),
+                "documents": [d.get("name") for d in library.get("documents", [])]}
@@ -0,0 +1,219 @@
+"""
+Per-task model selection for LLM calls, with an optional small-model cascade
+
+Each task (formatting Wikipedia text, summaries, quizzes, grounded answers)
+is routed to its own chat model. A task can also cascade: the small model
+runs first and the call escalates to the task's model when the result is
+not accepted, i.e. a parse failure or an answer that looks unusable (empty,
+truncated, a refusal). Latency and tokens are recorded per task and model.
+"""
+import logging
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from metrics import LLM_SECONDS, span
+from model.utils import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+TASK_FORMAT = "format"
+TASK_SUMMARY = "summarize"
+TASK_QUIZ = "quiz"
+TASK_ANSWER = "answer"
+TASKS = (TASK_FORMAT, TASK_SUMMARY, TASK_QUIZ, TASK_ANSWER)
+
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
+DEFAULT_SMALL_MODEL = "llama-3.1-8b-instant"
+
+# USD per million (input, output) tokens on Groq
+MODEL_PRICES = {
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+    "llama-3.1-8b-instant": (0.05, 0.08),
+}
+
+# Openings of answers that mean the model did not do the task
+REFUSALS = ("i don't know", "i do not know", "i cannot", "i can't", "i'm sorry", "i am sorry",
+            "sorry,", "as an ai")
+
+
+def plausible_text(text: Any, min_chars: int = 40) -> bool:
+    """Whether a free-text completion looks usable enough to return"""
+    if not isinstance(text, str):
+        return False
+    stripped = text.strip()
+    return len(stripped) >= min_chars and not stripped.lower().startswith(REFUSALS)
+
+
+class UsageMeter(BaseCallbackHandler):
+    """Token counts of one call, from the provider's usage report if given
+
+    Without one (some streamed completions, or a stream closed early) they
+    are estimated at four characters per token.
+    """
+
+    def __init__(self):
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self._prompt_chars = 0
+        self._streamed_chars = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._prompt_chars += sum(len(str(m.content)) for batch in messages for m in batch)
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._prompt_chars += sum(len(p) for p in prompts)
+
+    def on_llm_new_token(self, token, **kwargs):
+        self._streamed_chars += len(token)
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        input_tokens, output_tokens = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        text_chars = 0
+        for generations in response.generations:
+            for generation in generations:
+                text_chars += len(generation.text or "")
+                metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if metadata and not usage:
+                    input_tokens += metadata.get("input_tokens", 0)
+                    output_tokens += metadata.get("output_tokens", 0)
+        self.input_tokens += input_tokens or self._prompt_chars // 4
+        self.output_tokens += output_tokens or max(text_chars, self._streamed_chars) // 4
+        self._prompt_chars = self._streamed_chars = 0
+
+    def on_llm_error(self, error, **kwargs):
+        # Also reached when a stream is closed before the end
+        self.input_tokens += self._prompt_chars // 4
+        self.output_tokens += self._streamed_chars // 4
+        self._prompt_chars = self._streamed_chars = 0
+
+
+class ModelRouter:
+    """Route each task to a chat model, optionally trying a small one first"""
+
+    def __init__(self, factory: Callable[[str], Any], routes: Optional[Dict[str, str]] = None,
+                 cascade: Iterable[str] = (), small_model: str = DEFAULT_SMALL_MODEL,
+                 default_model: str = DEFAULT_MODEL, governor=None):
+        """
+        Args:
+            factory: Builds a LangChain chat model from a model name
+            routes: Model per task; tasks not listed use ``default_model``
+            cascade: Tasks that try ``small_model`` first
+            small_model: First model of cascading tasks
+            default_model: Model of tasks without a route
+            governor: model.utils.LLMGovernor each attempt takes a slot from
+        """
+        self.factory = factory
+        self.routes = {task: (routes or {}).get(task, default_model) for task in TASKS}
+        self.cascade = {task for task in cascade if task}
+        self.small_model = small_model
+        self.governor = governor
+        self._models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def model(self, name: str):
+        model = self._models.get(name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(name)
+                if model is None:
+                    model = self._models[name] = self.factory(name)
+        return model
+
+    def warm(self):
+        """Build every model a task can be routed to"""
+        for name in {name for task in TASKS for name in self.models(task)}:
+            self.model(name)
+
+    def models(self, task: str) -> List[str]:
+        """Model names a call for ``task`` tries, in order"""
+        final = self.routes.get(task, self.routes[TASK_ANSWER])
+        if task in self.cascade and self.small_model != final:
+            return [self.small_model, final]
+        return [final]
+
+    def run(self, task: str, attempt: Callable[[Any, dict], Any], accept: Optional[Callable[[Any], bool]] = None,
+            priority: Optional[int] = None):
+        """Return attempt(model, config) from the first model whose result is accepted
+
+        ``config`` must be passed to the model's invoke/stream call so its
+        tokens are counted. The last model's result is returned as is; an
+        exception from an earlier model escalates like a rejected result.
+        With ``priority`` each attempt holds a governor slot.
+        """
+        names = self.models(task)
+        with self._lock:
+            self._task_stats(task)["calls"] += 1
+        for i, name in enumerate(names):
+            last = i == len(names) - 1
+            meter = UsageMeter()
+            start = time.perf_counter()
+            try:
+                slot = self.governor.slot(priority) if priority is not None and self.governor else nullcontext()
+                with slot, span("llm"):
+                    # Timed from when the call runs, not while it queued for a slot
+                    start = time.perf_counter()
+                    result = attempt(self.model(name), {"callbacks": [meter]})
+            except RateLimitExceeded:
+                raise
+            except Exception as e:
+                self._record(task, name, time.perf_counter() - start, meter, failed=True)
+                if last:
+                    raise
+                logger.warning(f"{name} failed on {task} ({e}), escalating to {names[i + 1]}")
+                self._escalated(task)
+                continue
+
+            self._record(task, name, time.perf_counter() - start, meter)
+            if last or accept is None or accept(result):
+                return result
+            logger.info(f"{name} result for {task} not accepted, escalating to {names[i + 1]}")
+            self._escalated(task)
+
+    def invoke(self, task: str, prompt: str, priority: int, accept: Callable[[Any], bool] = plausible_text) -> str:
+        """Completion text for a plain prompt"""
+        return self.run(task, lambda model, config: model.invoke(prompt, config=config).content,
+                        accept=accept, priority=priority)
+
+    def _task_stats(self, task: str) -> Dict[str, Any]:
+        return self._stats.setdefault(task, {"calls": 0, "escalations": 0, "models": {}})
+
+    def _escalated(self, task: str):
+        with self._lock:
+            self._task_stats(task)["escalations"] += 1
+
+    def _record(self, task: str, name: str, seconds: float, meter: UsageMeter, failed: bool = False):
+        LLM_SECONDS.observe((task, name), seconds)
+        with self._lock:
+            model = self._task_stats(task)["models"].setdefault(name, {"calls": 0, "failures": 0, "seconds": 0.0,
+                                                      "input_tokens": 0, "output_tokens": 0})
+            model["calls"] += 1
+            model["failures"] += int(failed)
+            model["seconds"] += seconds
+            model["input_tokens"] += meter.input_tokens
+            model["output_tokens"] += meter.output_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        """Calls, escalations, latency, tokens and estimated cost per task and model"""
+        with self._lock:
+            report = {}
+            for task, stats in self._stats.items():
+                models = {}
+                for name, m in stats["models"].items():
+                    price = MODEL_PRICES.get(name)
+                    models[name] = {
+                        "calls": m["calls"],
+                        "failures": m["failures"],
+                        "mean_ms": round(m["seconds"] / m["calls"] * 1000, 1),
+                        "input_tokens": m["input_tokens"],
+                        "output_tokens": m["output_tokens"],
+                        "cost_usd": round((m["input_tokens"] * price[0] + m["output_tokens"] * price[1]) / 1e6, 6)
+                        if price else None,
+                    }
+                report[task] = {"calls": stats["calls"], "escalations": stats["escalations"], "models": models}
+            return {"routes": {task: self.models(task) for task in TASKS}, "tasks": report}
@@ -0,0 +1,125 @@
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+from metrics import span
+
+
+class ParentStore:
+    """Parent sections (the context returned for matched child chunks)
+
+    Kept in a SQLite file next to the Chroma data: parents are never
+    embedded, and SQLite in WAL mode can be read by several worker
+    processes at once.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS parents ("
+                " id TEXT PRIMARY KEY, user_id TEXT, source_file TEXT,"
+                " content TEXT NOT NULL, metadata TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS parents_user ON parents (user_id)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def add(self, parents: Iterable[Document]):
+        rows = [
+            (
+                doc.metadata["parent_id"],
+                doc.metadata.get("user_id"),
+                doc.metadata.get("source_file"),
+                doc.page_content,
+                json.dumps(doc.metadata, default=str),
+            )
+            for doc in parents
+        ]
+        with self._connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO parents VALUES (?, ?, ?, ?, ?)", rows)
+
+    def get(self, ids: List[str]) -> Dict[str, Document]:
+        if not ids:
+            return {}
+        placeholders = ",".join("?" for _ in ids)
+        rows = self._connection().execute(
+            f"SELECT id, content, metadata FROM parents WHERE id IN ({placeholders})", list(ids)
+        ).fetchall()
+        return {
+            row[0]: Document(page_content=row[1], metadata=json.loads(row[2]))
+            for row in rows
+        }
+
+    def delete(self, ids: List[str]):
+        if not ids:
+            return
+        with self._connection() as conn:
+            conn.executemany("DELETE FROM parents WHERE id = ?", [(i,) for i in ids])
+
+    def delete_user(self, user_id: str):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM parents WHERE user_id = ?", (user_id,))
+
+
+class ParentChildRetriever(BaseRetriever):
+    """Search small child chunks, return the parent sections they belong to
+
+    Chunks indexed before parent/child splitting have no ``parent_id`` and
+    are returned as they are.
+    """
+
+    vector_store: VectorStore
+    parent_store: Any
+    k: int = 4
+    search_filter: Optional[dict] = None
+    fetch_multiplier: int = 3
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        # Several children of one parent often match; over-fetch so k
+        # distinct parents remain after grouping
+        with span("vector_search"):
+            children = self.vector_store.similarity_search(
+                query, k=self.k * self.fetch_multiplier, filter=self.search_filter
+            )
+
+        order: List[str] = []
+        standalone: Dict[str, Document] = {}
+        matches: Dict[str, int] = {}
+        for i, child in enumerate(children):
+            parent_id = child.metadata.get("parent_id")
+            key = parent_id or f"chunk:{i}"
+            if key not in matches:
+                order.append(key)
+                matches[key] = 0
+                if not parent_id:
+                    standalone[key] = child
+            matches[key] += 1
+
+        order = order[:self.k]
+        with span("parent_lookup"):
+            parents = self.parent_store.get([key for key in order if key not in standalone])
+
+        results = []
+        for key in order:
+            doc = standalone.get(key) or parents.get(key)
+            if doc is None:
+                # Parent missing (e.g. deleted concurrently): fall back to the child
+                doc = next(c for c in children if c.metadata.get("parent_id") == key)
+            doc.metadata["matched_chunks"] = matches[key]
+            results.append(doc)
+        return results
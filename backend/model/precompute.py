@@ -0,0 +1,179 @@
+import datetime
+import hashlib
+import logging
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from model.utils import PRIORITY_BACKGROUND, RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_topic(topic: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", topic.lower()).split())
+
+
+def document_set_version(documents: List[Dict[str, Any]]) -> str:
+    """Fingerprint of a user's document list; changes on every upload or clear"""
+    digest = hashlib.sha1()
+    for doc in sorted(documents, key=lambda d: (str(d.get("filename")), str(d.get("uploaded_at")))):
+        digest.update(f"{doc.get('filename')}|{doc.get('uploaded_at')}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def extract_topics(splits: List[Any], text_splitter, per_document: int = 5) -> List[str]:
+    """Main topics per document from slide titles and heading chunks
+
+    Args:
+        splits: Chunks produced by SmartTextSplitter (with metadata)
+        text_splitter: The SmartTextSplitter used, for heading extraction
+        per_document: Maximum topics kept for each source file
+    """
+    candidates: Dict[str, Counter] = {}
+    first_seen: Dict[str, int] = {}
+
+    for i, doc in enumerate(splits):
+        source = doc.metadata.get("source_file", "")
+        titles = []
+        if doc.metadata.get("slide_title"):
+            titles.append(doc.metadata["slide_title"])
+        if doc.metadata.get("content_type") == "heading":
+            titles.extend(text_splitter.extract_headings(doc.page_content))
+
+        for title in titles:
+            title = " ".join(title.split())
+            if not 3 <= len(title) <= 80 or len(title.split()) > 10:
+                continue
+            candidates.setdefault(source, Counter())[title] += 1
+            first_seen.setdefault(title, i)
+
+    topics: List[str] = []
+    seen = set()
+    for counter in candidates.values():
+        # Recurring titles first (a deck's section names), then document order
+        ranked = sorted(counter, key=lambda t: (-counter[t], first_seen[t]))
+        kept = 0
+        for title in ranked:
+            key = normalize_topic(title)
+            if key and key not in seen:
+                seen.add(key)
+                topics.append(title)
+                kept += 1
+                if kept >= per_document:
+                    break
+    return topics
+
+
+class PrecomputedContentStore:
+    """Summaries and quiz pools keyed by (user, document-set version, topic)
+
+    Entries are persisted to Mongo so every worker can serve them, with a
+    bounded in-process front cache for repeat hits.
+    """
+
+    def __init__(self, collection, max_cached: int = 1000):
+        self.collection = collection
+        self.max_cached = max_cached
+        self._cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, version: str, topic: str) -> Optional[Dict[str, Any]]:
+        key = (user_id, version, normalize_topic(topic))
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                return entry
+
+        entry = self.collection.find_one(
+            {"user_id": user_id, "version": version, "topic": key[2]},
+            {"_id": 0}
+        )
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+
+    def put(self, user_id: str, version: str, topic: str, summary: Optional[str], quiz_pool: List[Dict]):
+        key = (user_id, version, normalize_topic(topic))
+        entry = {
+            "user_id": user_id,
+            "version": version,
+            "topic": key[2],
+            "title": topic,
+            "summary": summary,
+            "quiz_pool": quiz_pool,
+            "created_at": datetime.datetime.now()
+        }
+        self.collection.update_one(
+            {"user_id": user_id, "version": version, "topic": key[2]},
+            {"$set": entry},
+            upsert=True
+        )
+        self._remember(key, entry)
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            for key in [k for k in self._cache if k[0] == user_id]:
+                del self._cache[key]
+        self.collection.delete_many({"user_id": user_id})
+
+    def topics(self, user_id: str, version: str) -> List[str]:
+        return [e["title"] for e in self.collection.find(
+            {"user_id": user_id, "version": version}, {"title": 1}
+        )]
+
+    def _remember(self, key: tuple, entry: Dict[str, Any]):
+        with self._lock:
+            self._cache[key] = entry
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+
+class Precomputer:
+    """Background stage that pre-generates summaries and quiz pools after upload
+
+    Each topic costs a summary and the quiz pool's batches in LLM calls. With
+    ``calls_per_minute`` set, topics are generated no faster than that, so an
+    upload spends a share of the process's LLM rate rather than all of it.
+    """
+
+    def __init__(self, assistant, store: PrecomputedContentStore, quiz_pool_size: int = 10, max_topics: int = 20,
+                 calls_per_minute: float = 0.0):
+        self.assistant = assistant
+        self.store = store
+        self.quiz_pool_size = quiz_pool_size
+        self.max_topics = max_topics
+        self.calls_per_topic = 1 + math.ceil(quiz_pool_size / assistant.quiz_engine.batch_size)
+        self.budget = None
+        if calls_per_minute > 0:
+            self.budget = RateLimiter(rate=calls_per_minute / 60,
+                                      capacity=max(self.calls_per_topic, calls_per_minute / 6))
+        # One job at a time: precomputation must not compete with live requests
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="precompute")
+
+    def schedule(self, user_id: str, version: str, topics: List[str]):
+        topics = topics[:self.max_topics]
+        if topics:
+            logger.info(f"Scheduling precomputation of {len(topics)} topics for user {user_id}")
+            self._executor.submit(self._run, user_id, version, topics)
+
+    def _run(self, user_id: str, version: str, topics: List[str]):
+        for topic in topics:
+            # A newer upload or a clear makes this job obsolete
+            if self.assistant.document_set_version(user_id) != version:
+                logger.info(f"Document set for user {user_id} changed; stopping precomputation")
+                return
+            if self.budget is not None:
+                self.budget.acquire("precompute", tokens=self.calls_per_topic, timeout=float("inf"))
+            try:
+                # Lowest LLM priority: live requests are served first
+                summary, quiz_pool = self.assistant.generate_topic_content(user_id, topic, self.quiz_pool_size,
+                                                                           priority=PRIORITY_BACKGROUND)
+                self.store.put(user_id, version, topic, summary, quiz_pool)
+            except Exception as e:
+                logger.error(f"Precomputation failed for topic '{topic}': {e}")
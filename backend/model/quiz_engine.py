@@ -0,0 +1,239 @@
+import json
+import logging
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from model.llm_router import TASK_QUIZ
+from model.utils import PRIORITY_QUIZ, RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalJSONParser:
+    """Extract complete top-level JSON objects from a streamed completion
+
+    The model is asked for a JSON array, but completions may be wrapped in
+    code fences, preceded by prose or cut off mid-way. Objects are parsed as
+    soon as their closing brace arrives; anything outside an object is ignored
+    and an object that fails to parse only loses that one item.
+    """
+
+    def __init__(self):
+        self._buffer: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.malformed = 0
+
+    def feed(self, text: str) -> List[Any]:
+        """Consume the next piece of text and return any objects it completed"""
+        objects = []
+        for ch in text:
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._buffer = [ch]
+                continue
+
+            self._buffer.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    raw = "".join(self._buffer)
+                    self._buffer = []
+                    try:
+                        objects.append(json.loads(raw))
+                    except json.JSONDecodeError:
+                        self.malformed += 1
+        return objects
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def validate_question(item: Any) -> Optional[Dict[str, Any]]:
+    """Return a cleaned question dict, or None if the item is unusable"""
+    if not isinstance(item, dict):
+        return None
+    question = str(item.get("question") or "").strip()
+    options = item.get("options")
+    if not question or not isinstance(options, list) or len(options) < 2:
+        return None
+    options = [str(o).strip() for o in options if str(o).strip()]
+    if len(set(options)) != len(options) or len(options) < 2:
+        return None
+
+    answer = str(item.get("correct_answer") or "").strip()
+    if answer not in options:
+        # Accept a letter ("B") or a case/whitespace variant of an option
+        letters = {chr(ord("A") + i): opt for i, opt in enumerate(options)}
+        lowered = {o.lower(): o for o in options}
+        answer = letters.get(answer.rstrip(").:").upper()) or lowered.get(answer.lower())
+        if answer is None:
+            return None
+
+    return {
+        "question": question,
+        "options": options,
+        "correct_answer": answer,
+        "explanation": str(item.get("explanation") or "").strip(),
+    }
+
+
+class QuizEngine:
+    """Generate multiple choice quizzes in parallel batches"""
+
+    def __init__(self, router, batch_size: int = 5, max_workers: int = 4, max_retries: int = 2):
+        """
+        Args:
+            router: model.llm_router.ModelRouter; each completion runs as its
+                "quiz" task (streamed when the model supports it) and takes a
+                slot from the router's governor
+            batch_size: Questions requested per completion
+            max_workers: Completions run concurrently
+            max_retries: Extra rounds to replace malformed or duplicate items
+        """
+        self.router = router
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+
+    def context_size(self, num_questions: int) -> int:
+        """How many chunks to retrieve so each batch gets its own context"""
+        batches = max(1, math.ceil(num_questions / self.batch_size))
+        return min(20, max(5, 3 * batches))
+
+    def generate(self, topic: str, docs: List[Any], num_questions: int,
+                 priority: int = PRIORITY_QUIZ) -> List[Dict[str, Any]]:
+        num_questions = max(1, int(num_questions))
+        questions: List[Dict[str, Any]] = []
+        seen: List[Tuple[str, set]] = []
+        round_index = 0
+
+        while len(questions) < num_questions and round_index <= self.max_retries:
+            missing = num_questions - len(questions)
+            counts = self._split_count(missing)
+            contexts = self._assign_contexts(docs, len(counts), offset=round_index)
+            avoid = [q["question"] for q in questions]
+
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(counts))) as pool:
+                batches = list(pool.map(
+                    lambda args: self._run_batch(topic, args[0], args[1], avoid, priority),
+                    zip(contexts, counts)
+                ))
+
+            for batch in batches:
+                for item in batch:
+                    if len(questions) < num_questions and self._is_new(item, seen):
+                        questions.append(item)
+
+            if len(questions) < num_questions:
+                logger.info(f"Quiz round {round_index}: {len(questions)}/{num_questions} usable questions, retrying the rest")
+            round_index += 1
+
+        return questions
+
+    def _split_count(self, total: int) -> List[int]:
+        batches = math.ceil(total / self.batch_size)
+        base, extra = divmod(total, batches)
+        return [base + (1 if i < extra else 0) for i in range(batches)]
+
+    def _assign_contexts(self, docs: List[Any], batches: int, offset: int = 0) -> List[str]:
+        """Deal chunks round-robin so batches cover different parts of the material"""
+        if not docs:
+            return [""] * batches
+        groups: List[List[str]] = [[] for _ in range(batches)]
+        per_batch = max(1, math.ceil(len(docs) / batches))
+        for i in range(max(len(docs), batches * per_batch)):
+            groups[i % batches].append(docs[(i + offset) % len(docs)].page_content)
+        return ["\n\n".join(dict.fromkeys(group)) for group in groups]
+
+    def _run_batch(self, topic: str, context: str, count: int, avoid: List[str],
+                   priority: int = PRIORITY_QUIZ) -> List[Dict[str, Any]]:
+        avoid_text = ""
+        if avoid:
+            avoid_text = "Do not repeat any of these existing questions:\n" + "\n".join(f"- {q}" for q in avoid) + "\n"
+
+        prompt = f"""Generate a multiple choice quiz with {count} questions based on the following content about '{topic}'.
+            Return the result as a JSON array of objects, where each object has:
+            - question: str
+            - options: List[str] (4 options)
+            - correct_answer: str (the correct option text)
+            - explanation: str
+
+            Do not include any markdown formatting like ```json. Just the raw JSON string.
+            {avoid_text}
+            Content:
+            {context}
+            """
+
+        # A cascade escalates to the next model when a batch comes back short
+        return self.router.run(TASK_QUIZ, lambda llm, config: self._collect(llm, prompt, count, config),
+                               accept=lambda valid: len(valid) >= count, priority=priority)
+
+    def _collect(self, llm, prompt: str, count: int, config: dict) -> List[Dict[str, Any]]:
+        parser = IncrementalJSONParser()
+        valid: List[Dict[str, Any]] = []
+        stream = self._stream(llm, prompt, config)
+        try:
+            for text in stream:
+                for obj in parser.feed(text):
+                    # Tolerate {"questions": [...]} style wrappers
+                    items = obj.get("questions", [obj]) if isinstance(obj, dict) else [obj]
+                    for item in items:
+                        question = validate_question(item)
+                        if question:
+                            valid.append(question)
+                        else:
+                            parser.malformed += 1
+                if len(valid) >= count:
+                    # Enough items: stop reading so the rest is not generated
+                    break
+        except RateLimitExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Quiz batch failed: {e}")
+        finally:
+            # Ends the completion now, so its tokens are counted with this call
+            stream.close()
+
+        if parser.malformed:
+            logger.info(f"Quiz batch dropped {parser.malformed} malformed item(s)")
+        return valid[:count]
+
+    @staticmethod
+    def _stream(llm, prompt: str, config: dict) -> Iterable[str]:
+        if hasattr(llm, "stream"):
+            for chunk in llm.stream(prompt, config=config):
+                yield chunk.content if hasattr(chunk, "content") else str(chunk)
+        else:
+            response = llm.invoke(prompt, config=config)
+            yield response.content
+
+    @staticmethod
+    def _is_new(item: Dict[str, Any], seen: List[Tuple[str, set]]) -> bool:
+        """Reject exact and near-duplicate questions (token overlap >= 0.8)"""
+        normalized = normalize_question(item["question"])
+        tokens = set(normalized.split())
+        for other, other_tokens in seen:
+            if normalized == other:
+                return False
+            union = tokens | other_tokens
+            if union and len(tokens & other_tokens) / len(union) >= 0.8:
+                return False
+        seen.append((normalized, tokens))
+        return True
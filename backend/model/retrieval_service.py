@@ -0,0 +1,335 @@
+"""
+Retrieval sidecar: one process owns the embedding model and the Chroma store,
+web workers talk to it over a Unix domain socket.
+
+Wire format: every message is a 4-byte big-endian length followed by a UTF-8
+JSON body. Requests are ``{"op": str, "args": dict}`` and responses are
+``{"ok": true, "result": ...}`` or ``{"ok": false, "error": str}``.
+"""
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct(">I")
+
+# Records which process serves campus_rag_db, and over which socket, so that
+# ingest_library.py can write through it instead of opening the store itself
+HOLDER_FILE = "holder.json"
+
+
+class RetrievalServiceError(Exception):
+    """Raised on the client when the sidecar reports a failure"""
+
+
+def _send(sock: socket.socket, payload: Dict[str, Any]):
+    body = json.dumps(payload).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(body)) + body)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("Retrieval service closed the connection")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def _recv(sock: socket.socket) -> Dict[str, Any]:
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return json.loads(_recv_exact(sock, size).decode("utf-8"))
+
+
+def _doc_to_dict(doc: Document) -> Dict[str, Any]:
+    return {"page_content": doc.page_content, "metadata": doc.metadata}
+
+
+def _doc_from_dict(data: Dict[str, Any]) -> Document:
+    return Document(page_content=data["page_content"], metadata=data.get("metadata") or {})
+
+
+def claim_store(persist_directory: str, socket_path: Optional[str] = None, ingesting: bool = False):
+    """Record this process as the one serving (or writing) the vector store in persist_directory
+
+    A server must not open the store while ingest_library.py writes to it
+    directly: its index would miss those chunks while the libraries'
+    version and upload links already point at them.
+
+    Args:
+        persist_directory: The campus_rag_db directory
+        socket_path: Socket of the retrieval sidecar, if other processes can
+            reach the store through one
+        ingesting: Claimed by ingest_library.py writing without a server
+
+    Raises:
+        RuntimeError: If another process is ingesting into the store
+    """
+    holder = store_holder(persist_directory)
+    if holder and holder.get("ingesting") and holder["pid"] != os.getpid():
+        raise RuntimeError(f"ingest_library.py (pid {holder['pid']}) is writing to {persist_directory}; "
+                           f"start the server once it has finished")
+    path = os.path.join(persist_directory, HOLDER_FILE)
+    temp = f"{path}.{os.getpid()}"
+    with open(temp, "w", encoding="utf-8") as f:
+        json.dump({"pid": os.getpid(), "socket": socket_path, "ingesting": ingesting}, f)
+    os.replace(temp, path)
+
+
+def store_holder(persist_directory: str) -> Optional[Dict[str, Any]]:
+    """The running process that serves the store (``pid`` and ``socket``), if any"""
+    try:
+        with open(os.path.join(persist_directory, HOLDER_FILE), encoding="utf-8") as f:
+            holder = json.load(f)
+    except (OSError, ValueError):
+        return None
+    try:
+        os.kill(holder["pid"], 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return holder
+
+
+class RetrievalServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve embedding and vector-store operations to local worker processes"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, assistant):
+        """
+        Args:
+            socket_path: Filesystem path of the Unix socket to listen on
+            assistant: A SmartCampusAssistant using a local (in-process) store
+        """
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.socket_path = socket_path
+        self.assistant = assistant
+        super().__init__(socket_path, _RequestHandler)
+
+    def dispatch(self, op: str, args: Dict[str, Any]) -> Any:
+        store = self.assistant.vector_store
+        embeddings = self.assistant.embedding_manager
+
+        if op == "ping":
+            return "pong"
+        if op == "embed_query":
+            return embeddings.embed_query(args["text"])
+        if op == "embed_documents":
+            return embeddings.embed_documents(args["texts"])
+        if op == "similarity_search_with_score":
+            results = store.similarity_search_with_score(
+                args["query"], k=args.get("k", 4), filter=args.get("filter")
+            )
+            return [[_doc_to_dict(doc), score] for doc, score in results]
+        if op == "add_documents":
+            docs = [_doc_from_dict(d) for d in args["documents"]]
+            return store.add_documents(docs, ids=args.get("ids"))
+        if op == "delete":
+            store.delete(ids=args.get("ids"))
+            return True
+        if op == "get":
+            return store.get(**args)
+        raise ValueError(f"Unknown retrieval op: {op}")
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                message = _recv(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                result = self.server.dispatch(message["op"], message.get("args") or {})
+                response = {"ok": True, "result": result}
+            except Exception as e:
+                logger.error(f"Retrieval op '{message.get('op')}' failed: {e}")
+                response = {"ok": False, "error": str(e)}
+            try:
+                _send(self.request, response)
+            except OSError:
+                return
+
+
+def run_retrieval_server(socket_path: str, warm: bool = True):
+    """Entry point for the sidecar process"""
+    from model.assistant import SmartCampusAssistant
+
+    # Started with spawn, so the environment is the only configuration it shares with app.py
+    assistant = SmartCampusAssistant(
+        api_key=None,
+        vector_storage=os.getenv("VECTOR_STORE", "chroma"),
+        query_batch_size=int(os.getenv("EMBED_QUERY_BATCH", "16")),
+        query_batch_wait_ms=float(os.getenv("EMBED_QUERY_WAIT_MS", "2"))
+    )
+    if warm:
+        assistant.embedding_manager.warm()
+        assistant.vector_store.get(limit=1)
+
+    server = RetrievalServer(socket_path, assistant)
+    claim_store(assistant.persist_directory, socket_path)
+    logger.info(f"Retrieval service listening on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class RetrievalClient:
+    """Thread-safe client; each thread keeps its own persistent connection"""
+
+    def __init__(self, socket_path: str, timeout: float = 60.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _reset(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = None
+
+    def call(self, op: str, **args) -> Any:
+        # One reconnect covers a sidecar restart or an idle connection drop
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                _send(sock, {"op": op, "args": args})
+                response = _recv(sock)
+                break
+            except (ConnectionError, OSError):
+                self._reset()
+                if attempt:
+                    raise
+        if not response.get("ok"):
+            raise RetrievalServiceError(response.get("error", "unknown error"))
+        return response["result"]
+
+    def ping(self) -> bool:
+        return self.call("ping") == "pong"
+
+
+class RemoteEmbeddings(Embeddings):
+    """Embeddings computed by the sidecar's model"""
+
+    def __init__(self, client: RetrievalClient):
+        self.client = client
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.client.call("embed_documents", texts=list(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.client.call("embed_query", text=text)
+
+
+class RemoteEmbeddingManager:
+    """Same interface as EmbeddingManager, backed by the sidecar"""
+
+    def __init__(self, client: RetrievalClient):
+        self.client = client
+        self.embeddings = RemoteEmbeddings(client)
+
+    @property
+    def is_loaded(self) -> bool:
+        return True
+
+    def warm(self):
+        self.client.ping()
+
+    def get_embeddings(self):
+        return self.embeddings
+
+    def lazy_embeddings(self) -> Embeddings:
+        return self.embeddings
+
+    def embed_query(self, text: str):
+        return self.embeddings.embed_query(text)
+
+    def embed_documents(self, texts: list):
+        return self.embeddings.embed_documents(texts)
+
+
+class RemoteVectorStore(VectorStore):
+    """LangChain vector store whose index lives in the retrieval sidecar"""
+
+    def __init__(self, client: RetrievalClient):
+        self.client = client
+        self._embeddings = RemoteEmbeddings(client)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embeddings
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        docs = [Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)]
+        return self.add_documents(docs, ids=ids)
+
+    def add_documents(self, documents: List[Document], ids: Optional[List[str]] = None,
+                      **kwargs: Any) -> List[str]:
+        return self.client.call(
+            "add_documents", documents=[_doc_to_dict(d) for d in documents], ids=ids
+        )
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        results = self.client.call("similarity_search_with_score", query=query, k=k, filter=filter)
+        return [(_doc_from_dict(doc), score) for doc, score in results]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any):
+        self.client.call("delete", ids=ids)
+
+    def get(self, **kwargs: Any) -> Dict[str, Any]:
+        return self.client.call("get", **kwargs)
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   client: Optional[RetrievalClient] = None, ids: Optional[List[str]] = None,
+                   **kwargs: Any) -> "RemoteVectorStore":
+        """Add texts to the sidecar's store and return a store attached to it
+
+        The sidecar owns the index and embeds with its own model, so
+        ``embedding`` is not used; ``client`` reaches the running sidecar.
+        """
+        if client is None:
+            raise ValueError("RemoteVectorStore.from_texts needs client= for the running retrieval service")
+        store = cls(client)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WarmupOrchestrator:
+    """Warm heavy components in background threads and report progress"""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    READY = "ready"
+    FAILED = "failed"
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self._tasks: Dict[str, Callable[[], Any]] = {}
+        self._state: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._started_at: Optional[float] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def add_task(self, name: str, fn: Callable[[], Any]):
+        """Register a warm-up step; steps run in parallel once started"""
+        with self._lock:
+            self._tasks[name] = fn
+            self._state[name] = {"state": self.PENDING, "seconds": None, "error": None}
+
+    def start(self):
+        """Start all registered steps without blocking the caller"""
+        if self._executor is not None:
+            return
+        self._started_at = time.perf_counter()
+        if not self._tasks:
+            self._done.set()
+            return
+        self._executor = ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(self._tasks)),
+            thread_name_prefix="warmup"
+        )
+        for name, fn in self._tasks.items():
+            self._executor.submit(self._run, name, fn)
+        self._executor.shutdown(wait=False)
+
+    def _run(self, name: str, fn: Callable[[], Any]):
+        with self._lock:
+            self._state[name]["state"] = self.RUNNING
+        start = time.perf_counter()
+        try:
+            fn()
+            state, error = self.READY, None
+            logger.info(f"Warm-up '{name}' ready in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            state, error = self.FAILED, str(e)
+            logger.error(f"Warm-up '{name}' failed: {e}")
+
+        with self._lock:
+            self._state[name].update({
+                "state": state,
+                "seconds": round(time.perf_counter() - start, 3),
+                "error": error
+            })
+            finished = all(s["state"] in (self.READY, self.FAILED) for s in self._state.values())
+        if finished:
+            self._done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until every step has finished (ready or failed)"""
+        return self._done.wait(timeout)
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return bool(self._state) and all(s["state"] == self.READY for s in self._state.values())
+
+    def status(self) -> Dict[str, Any]:
+        """Snapshot of warm-up progress for the health endpoint"""
+        with self._lock:
+            components = {name: dict(state) for name, state in self._state.items()}
+        finished = sum(1 for s in components.values() if s["state"] in (self.READY, self.FAILED))
+        elapsed = time.perf_counter() - self._started_at if self._started_at else 0.0
+        return {
+            "ready": bool(components) and all(s["state"] == self.READY for s in components.values()),
+            "started": self._started_at is not None,
+            "progress": round(finished / len(components), 2) if components else 1.0,
+            "elapsed_seconds": round(elapsed, 3),
+            "components": components
+        }
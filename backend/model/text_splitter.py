@@ -1,16 +1,78 @@
+import hashlib
+import logging
 import re
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+logger = logging.getLogger(__name__)
+
+
+# Checked in this order; the first category found anywhere in a chunk wins
+CLASSIFY_ORDER = ['formula', 'code', 'table', 'definition', 'list', 'heading']
+
+# Patterns that are searched line by line
+MULTILINE_PATTERNS = {'list', 'heading'}
+
+# Tables emitted by EnhancedDocumentLoader._format_table
+TABLE_BLOCK = re.compile(r'\[TABLE \d+\].*?\[END TABLE\]', re.DOTALL)
+
+DEFAULT_TOKENIZER = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+@lru_cache(maxsize=4)
+def token_counter(model_name: str) -> Callable[[str], int]:
+    """Count tokens the way the embedding model sees them
+
+    Falls back to a 4-characters-per-token estimate when the tokenizer
+    cannot be loaded (transformers missing or no cached model offline).
+    """
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        def count(text: str) -> int:
+            return len(tokenizer.encode(text, add_special_tokens=False))
+        return count
+    except Exception as e:
+        logger.warning(f"Tokenizer for {model_name} unavailable ({e}); estimating tokens from length")
+        return lambda text: (len(text) + 3) // 4
+
+
+def _split_with_parents_batch(args) -> Tuple[List[Document], List[Document]]:
+    """Process-pool entry point for SmartTextSplitter.split_with_parents"""
+    config, documents = args
+    return SmartTextSplitter(**config).split_with_parents(documents)
+
 
 class SmartTextSplitter:
-    """Intelligent text splitter that preserves educational content structure"""
-    
-    def __init__(self, chunk_size: int = 1200, chunk_overlap: int = 200):
+    """Intelligent text splitter that preserves educational content structure
+
+    Sizes are in embedding-model tokens. Each page or slide is packed into
+    parent sections of up to ``parent_chunk_size`` tokens, and each parent
+    into child chunks of up to ``chunk_size`` tokens, which are what gets
+    embedded. Tables are kept whole unless larger than the limit, in which
+    case they are split by rows with the header repeated.
+    """
+
+    def __init__(self, chunk_size: int = 250, chunk_overlap: int = 0,
+                 parent_chunk_size: int = 800, tokenizer_model: str = DEFAULT_TOKENIZER):
+        """
+        Args:
+            chunk_size: Max tokens per embedded child chunk (MiniLM reads 256
+                including its two special tokens; longer input is truncated)
+            chunk_overlap: Token overlap between consecutive text chunks
+            parent_chunk_size: Max tokens per parent section returned as context
+            tokenizer_model: HuggingFace tokenizer used to count tokens
+        """
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        
+        self.parent_chunk_size = parent_chunk_size
+        self.tokenizer_model = tokenizer_model
+        self._length = token_counter(tokenizer_model)
+
         # Educational content patterns
         self.structure_patterns = {
             'heading': r'^#{1,6}\s+.*$|^[A-Z][^.!?]*:$',
@@ -20,70 +82,221 @@ class SmartTextSplitter:
             'table': r'\|.*\|.*\|',
             'definition': r'^[A-Z][a-zA-Z\s]+:\s+',
         }
-        
-    def split_documents(self, documents: List[Document]) -> List[Document]:
-        """Split documents intelligently"""
-        all_splits = []
-        
-        for doc in documents:
-            splits = self._split_single_document(doc)
-            all_splits.extend(splits)
-        
-        return all_splits
-    
-    def _split_single_document(self, document: Document) -> List[Document]:
-        """Split a single document preserving structure"""
-        text = document.page_content
-        
+        self._compiled = {
+            name: re.compile(pattern, re.MULTILINE if name in MULTILINE_PATTERNS else 0)
+            for name, pattern in self.structure_patterns.items()
+        }
+
+        # Recursive splitters built once (split_text keeps no state between
+        # calls). Parents break at section and paragraph boundaries; children
+        # only need to match well, so they fill up to the limit sentence by
+        # sentence instead of leaving half-empty chunks at paragraph ends.
+        self._parent_splitter = self._recursive_splitter(parent_chunk_size, 0, [
+            "\n\n\n",  # Multiple newlines (major sections)
+            "\n\n",    # Paragraphs
+            "\n",      # Lines
+            ". ",      # Sentences
+            " ",       # Words
+            ""
+        ])
+        self._child_splitter = self._recursive_splitter(chunk_size, chunk_overlap, [
+            "\n\n\n",  # Multiple newlines (major sections)
+            ". ",      # Sentences
+            "\n",      # Lines
+            " ",       # Words
+            ""
+        ])
+
+    def _recursive_splitter(self, size: int, overlap: int, separators: List[str]) -> RecursiveCharacterTextSplitter:
         # Use recursive character splitter with educational separators
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.chunk_size,
-            chunk_overlap=self.chunk_overlap,
-            length_function=len,
-            separators=[
-                "\n\n\n",  # Multiple newlines (major sections)
-                "\n\n",    # Paragraphs
-                "\n",      # Lines
-                ". ",      # Sentences
-                " ",       # Words
-                ""
-            ]
+        return RecursiveCharacterTextSplitter(
+            chunk_size=size,
+            chunk_overlap=overlap,
+            length_function=self._length,
+            separators=separators
         )
-        
-        splits = splitter.split_text(text)
-        documents = []
-        
-        for i, split in enumerate(splits):
-            content_type = self._classify_content(split)
-            
-            doc = Document(
-                page_content=split,
+
+    @property
+    def config(self) -> dict:
+        return {
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "parent_chunk_size": self.parent_chunk_size,
+            "tokenizer_model": self.tokenizer_model,
+        }
+
+    def split_documents(self, documents: List[Document], max_workers: Optional[int] = None,
+                        batch_size: int = 500) -> List[Document]:
+        """Split documents into child chunks for embedding
+
+        Args:
+            documents: Documents to split
+            max_workers: Split batches of documents in this many processes
+                (None or 1 splits in the calling process)
+            batch_size: Documents per process-pool task
+        """
+        return self.split_with_parents(documents, max_workers, batch_size)[1]
+
+    def split_with_parents(self, documents: List[Document], max_workers: Optional[int] = None,
+                           batch_size: int = 500) -> Tuple[List[Document], List[Document]]:
+        """Split documents into (parent sections, child chunks)
+
+        Every child carries the ``parent_id`` of the section it came from.
+        """
+        if max_workers and max_workers > 1 and len(documents) > batch_size:
+            batches = [
+                (self.config, documents[i:i + batch_size])
+                for i in range(0, len(documents), batch_size)
+            ]
+            all_parents, all_children = [], []
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                for parents, children in pool.map(_split_with_parents_batch, batches):
+                    all_parents.extend(parents)
+                    all_children.extend(children)
+            return all_parents, all_children
+
+        all_parents, all_children = [], []
+
+        for doc in documents:
+            parents, children = self._split_single_document(doc)
+            all_parents.extend(parents)
+            all_children.extend(children)
+
+        return all_parents, all_children
+
+    def _split_single_document(self, document: Document) -> Tuple[List[Document], List[Document]]:
+        """Split a single document preserving structure"""
+        # Parent ids are content hashes scoped to the owner and document, so
+        # re-uploading a document reproduces the ids of unchanged sections
+        name = document.metadata.get('document_name') or document.metadata.get('source_file', '')
+        scope = f"{document.metadata.get('user_id', '')}\x00{name}"
+        parents, children = [], []
+
+        for p, parent_text in enumerate(self._pack(self._blocks(document.page_content),
+                                                   self.parent_chunk_size, self._parent_splitter)):
+            parent_id = hashlib.sha1(f"{scope}\x00{parent_text}".encode("utf-8")).hexdigest()[:24]
+            parents.append(Document(
+                page_content=parent_text,
                 metadata={
                     **document.metadata,
-                    "chunk_index": i,
-                    "content_type": content_type,
-                    "word_count": len(split.split()),
+                    "parent_id": parent_id,
+                    "parent_index": p,
+                    "token_count": self._length(parent_text),
                 }
-            )
-            documents.append(doc)
-        
-        return documents
-    
+            ))
+
+            for split in self._pack(self._blocks(parent_text), self.chunk_size, self._child_splitter):
+                content_type = self._classify_content(split)
+
+                children.append(Document(
+                    page_content=split,
+                    metadata={
+                        **document.metadata,
+                        "parent_id": parent_id,
+                        "chunk_index": len(children),
+                        "content_type": content_type,
+                        "word_count": len(split.split()),
+                    }
+                ))
+
+        return parents, children
+
+    def _blocks(self, text: str) -> List[str]:
+        """Text segments and whole tables, in order"""
+        blocks = []
+        position = 0
+        for match in TABLE_BLOCK.finditer(text):
+            blocks.append(text[position:match.start()])
+            blocks.append(match.group(0))
+            position = match.end()
+        blocks.append(text[position:])
+        return [b.strip() for b in blocks if b.strip()]
+
+    def _pack(self, blocks: List[str], limit: int, splitter: RecursiveCharacterTextSplitter) -> List[str]:
+        """Cut blocks into pieces of at most `limit` tokens
+
+        Text is split at the best separator, tables are kept whole when they
+        fit; adjacent small pieces (a short table next to a paragraph) are
+        then merged so no vector is wasted on a fragment.
+        """
+        pieces = []
+        for block in blocks:
+            if TABLE_BLOCK.fullmatch(block):
+                if self._length(block) <= limit:
+                    pieces.append(block)
+                else:
+                    pieces.extend(self._split_table(block, limit, splitter))
+            else:
+                pieces.extend(splitter.split_text(block))
+
+        merged, current_len = [], 0
+        for piece in pieces:
+            size = self._length(piece)
+            # +1 approximates the paragraph separator
+            if merged and current_len + size + 1 <= limit:
+                merged[-1] = f"{merged[-1]}\n\n{piece}"
+                current_len += size + 1
+            else:
+                merged.append(piece)
+                current_len = size
+        return merged
+
+    def _split_table(self, table: str, limit: int, splitter: RecursiveCharacterTextSplitter) -> List[str]:
+        """Split an oversized table on row boundaries, repeating its header"""
+        lines = table.split("\n")
+        header, rows, footer = lines[:3], lines[3:-1], lines[-1]
+        overhead = self._length("\n".join(header + [footer]))
+        pieces, current, current_len = [], [], overhead
+
+        for row in rows:
+            size = self._length(row) + 1
+            if current and current_len + size > limit:
+                pieces.append("\n".join(header + current + [footer]))
+                current, current_len = [], overhead
+            if overhead + size > limit:
+                # A single row too large for any chunk
+                pieces.extend(splitter.split_text(row))
+                continue
+            current.append(row)
+            current_len += size
+        if current:
+            pieces.append("\n".join(header + current + [footer]))
+        return pieces
+
+    def extract_headings(self, text: str) -> List[str]:
+        """Heading lines (markdown headings or 'Title:' lines) in a chunk"""
+        headings = []
+        for match in self._compiled['heading'].finditer(text):
+            # '[^.!?]*' may run across lines; the heading is the line ending in ':'
+            lines = match.group(0).strip().splitlines() or [""]
+            heading = lines[-1].strip().lstrip('#').strip().rstrip(':').strip()
+            if heading:
+                headings.append(heading)
+        return headings
+
     def _classify_content(self, text: str) -> str:
-        """Classify educational content type"""
-        text_lower = text.lower()
-        
-        if re.search(self.structure_patterns['formula'], text):
+        """Classify educational content type
+
+        Same result as searching each pattern in CLASSIFY_ORDER, but every
+        regex is guarded by a substring test the pattern cannot match
+        without, so most chunks cost a few C-level scans instead of six
+        regex searches.
+        """
+        patterns = self._compiled
+
+        if ('$' in text or '\\' in text) and patterns['formula'].search(text):
             return "formula"
-        elif re.search(self.structure_patterns['code'], text):
+        elif '```' in text and patterns['code'].search(text):
             return "code"
-        elif re.search(self.structure_patterns['table'], text):
+        elif ('[TABLE ' in text and TABLE_BLOCK.search(text)) or \
+                (text.count('|') >= 3 and patterns['table'].search(text)):
             return "table"
-        elif re.search(self.structure_patterns['definition'], text):
+        elif ':' in text and patterns['definition'].match(text):
             return "definition"
-        elif re.search(self.structure_patterns['list'], text, re.MULTILINE):
+        elif patterns['list'].search(text):
             return "list"
-        elif re.search(self.structure_patterns['heading'], text, re.MULTILINE):
+        elif ('#' in text or ':' in text) and patterns['heading'].search(text):
             return "heading"
         else:
             return "paragraph"
+
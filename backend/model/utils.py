@@ -1,68 +1,443 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
 import time
+import tracemalloc
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
 import psutil
 
+logger = logging.getLogger(__name__)
 
-class ConversationManager:
-    """Manage conversation history"""
-    
-    def __init__(self, max_history: int = 10):
-        self.max_history = max_history
-        self.history = []
-    
-    def add_exchange(self, question: str, answer: str):
-        """Add Q&A to history"""
-        self.history.append({
-            'question': question,
-            'answer': answer,
-            'timestamp': time.time()
-        })
-        
-        if len(self.history) > self.max_history:
-            self.history.pop(0)
-    
-    def get_recent_context(self, n: int = 3) -> str:
-        """Get recent conversation context"""
-        recent = self.history[-n:]
-        parts = []
-        for ex in recent:
-            parts.append(f"Q: {ex['question']}\nA: {ex['answer'][:100]}...")
-        return "\n\n".join(parts)
-    
-    def clear(self):
-        """Clear history"""
-        self.history.clear()
+MB = 1024 * 1024
 
 
 class MemoryMonitor:
-    """Monitor memory usage"""
+    """Sample process resources in the background and gate ingestion on memory
+
+    Samples RSS, thread count, open file handles and the on-disk size of the
+    vector store every ``interval`` seconds. While ingestion jobs run (see
+    ``track_job``) RSS is polled faster so each job gets its own peak.
+    Numbers are for the current process; under serve.py each worker
+    samples itself.
+    """
     
-    def __init__(self):
+    def __init__(self, interval: float = 30.0, watermark_mb: Optional[float] = None,
+                 chroma_dir: Optional[str] = None, history: int = 120, job_poll_interval: float = 0.25):
+        """
+        Args:
+            interval: Seconds between background samples
+            watermark_mb: RSS above which new ingestion is refused (None: never)
+            chroma_dir: Vector store directory whose size is reported
+            history: Samples, jobs and allocation traces kept
+            job_poll_interval: RSS polling interval while a job is running
+        """
         self.process = psutil.Process()
+        self.total_mb = psutil.virtual_memory().total / MB
+        self.interval = interval
+        self.watermark_mb = watermark_mb
+        self.chroma_dir = chroma_dir
+        self.job_poll_interval = job_poll_interval
+        self.samples = deque(maxlen=history)
+        self.jobs = deque(maxlen=history)
+        self.allocation_traces = deque(maxlen=history)
+        self._active_jobs: Dict[int, Dict[str, Any]] = {}
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._trace_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
     
     def check_memory(self) -> dict:
         """Check current memory"""
         memory_info = self.process.memory_info()
-        memory_mb = memory_info.rss / 1024 / 1024
+        memory_mb = memory_info.rss / MB
         
         return {
             'memory_mb': memory_mb,
-            'memory_percent': memory_mb / 2048 * 100,
+            'memory_percent': memory_mb / self.total_mb * 100,
+            'available_mb': psutil.virtual_memory().available / MB,
+        }
+    
+    def sample(self) -> dict:
+        """Take one sample of the process's resources"""
+        with self.process.oneshot():
+            rss_mb = self.process.memory_info().rss / MB
+            threads = self.process.num_threads()
+            handles = self.process.num_fds() if hasattr(self.process, "num_fds") else self.process.num_handles()
+        return {
+            'timestamp': time.time(),
+            'rss_mb': round(rss_mb, 1),
+            'memory_percent': round(rss_mb / self.total_mb * 100, 2),
+            'threads': threads,
+            'open_files': handles,
+            'chroma_disk_mb': round(directory_size(self.chroma_dir) / MB, 1) if self.chroma_dir else None,
+        }
+    
+    def ensure_started(self):
+        """Start the sampling thread once per process (threads do not survive fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="resource-monitor", daemon=True).start()
+    
+    def _run(self):
+        next_sample = 0.0
+        while True:
+            self._wake.clear()
+            now = time.monotonic()
+            if now >= next_sample:
+                try:
+                    self.samples.append(self.sample())
+                except Exception as e:
+                    logger.warning(f"Resource sample failed: {e}")
+                next_sample = now + self.interval
+            if self._active_jobs:
+                self._update_job_peaks()
+                self._wake.wait(self.job_poll_interval)
+            else:
+                self._wake.wait(max(0.0, next_sample - time.monotonic()))
+    
+    def _update_job_peaks(self):
+        rss_mb = self.process.memory_info().rss / MB
+        with self._lock:
+            for job in self._active_jobs.values():
+                job['peak_rss_mb'] = max(job['peak_rss_mb'], rss_mb)
+    
+    def over_watermark(self) -> bool:
+        return self.watermark_mb is not None and self.process.memory_info().rss / MB >= self.watermark_mb
+    
+    @contextmanager
+    def track_job(self, kind: str, **details):
+        """Attribute peak RSS to a job such as an upload
+
+        Jobs that overlap share the process, so each one's peak includes
+        whatever the others allocated at the same time.
+        """
+        self.ensure_started()
+        start_mb = self.process.memory_info().rss / MB
+        job = {'kind': kind, **details, 'started_at': time.time(),
+               'start_rss_mb': start_mb, 'peak_rss_mb': start_mb}
+        job_id = next(self._job_ids)
+        with self._lock:
+            self._active_jobs[job_id] = job
+        self._wake.set()
+        try:
+            yield job
+        finally:
+            self._update_job_peaks()
+            with self._lock:
+                del self._active_jobs[job_id]
+            end_mb = self.process.memory_info().rss / MB
+            job.update({
+                'seconds': round(time.time() - job['started_at'], 3),
+                'start_rss_mb': round(start_mb, 1),
+                'peak_rss_mb': round(max(job['peak_rss_mb'], end_mb), 1),
+                'peak_delta_mb': round(max(job['peak_rss_mb'], end_mb) - start_mb, 1),
+                'end_rss_mb': round(end_mb, 1),
+            })
+            self.jobs.append(job)
+    
+    @contextmanager
+    def trace_allocations(self, label: str, top: int = 15):
+        """Record the Python allocations made inside the block with tracemalloc
+
+        tracemalloc is process-wide, so only one block is traced at a time;
+        overlapping blocks run untraced. Allocations by other threads during
+        the block are included.
+        """
+        if not self._trace_lock.acquire(blocking=False):
+            yield
+            return
+        started = not tracemalloc.is_tracing()
+        try:
+            if started:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+            yield
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            stats = after.compare_to(before, 'lineno')[:top]
+            self.allocation_traces.append({
+                'label': label,
+                'timestamp': time.time(),
+                'peak_traced_mb': round(peak / MB, 2),
+                'top_allocations': [
+                    {'location': str(stat.traceback[0]), 'size_diff_kb': round(stat.size_diff / 1024, 1),
+                     'count_diff': stat.count_diff}
+                    for stat in stats
+                ],
+            })
+        finally:
+            if started:
+                tracemalloc.stop()
+            self._trace_lock.release()
+    
+    def report(self) -> dict:
+        """Current sample plus recent history, jobs and allocation traces"""
+        with self._lock:
+            active = [dict(job) for job in self._active_jobs.values()]
+        return {
+            'pid': os.getpid(),
+            'current': self.sample(),
+            'watermark_mb': self.watermark_mb,
+            'over_watermark': self.over_watermark(),
+            'system_memory_mb': round(self.total_mb, 1),
+            'samples': list(self.samples),
+            'active_jobs': active,
+            'jobs': list(self.jobs),
+            'allocation_traces': list(self.allocation_traces),
         }
 
 
+def directory_size(path: str) -> int:
+    """Total bytes of the files under a directory"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                # Removed while walking (e.g. a SQLite journal)
+                pass
+    return total
+
+
+class RateLimitExceeded(Exception):
+    """Request refused by a rate limit or the LLM governor"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
 class RateLimiter:
-    """Rate limit API calls"""
+    """Thread-safe token buckets, one per key (a user id, or a shared key)
     
-    def __init__(self, delay: float = 1.0):
-        self.delay = delay
-        self.last_request = 0
+    Each bucket holds up to ``capacity`` tokens and refills at ``rate``
+    tokens per second.
+    """
     
-    def wait_if_needed(self):
-        """Wait if needed"""
-        current = time.time()
-        elapsed = current - self.last_request
-        
-        if elapsed < self.delay:
-            time.sleep(self.delay - elapsed)
+    def __init__(self, rate: float, capacity: float, max_keys: int = 10000):
+        if rate <= 0 or capacity <= 0:
+            raise ValueError(f"RateLimiter needs a positive rate and capacity (got {rate}, {capacity})")
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def try_acquire(self, key: str, tokens: float = 1.0) -> float:
+        """Take tokens if available; returns 0, or the seconds until they will be"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.capacity, now]
+                # Forget the least recently used keys (their buckets were full anyway)
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            
+            if bucket[0] >= tokens:
+                bucket[0] -= tokens
+                return 0.0
+            return (tokens - bucket[0]) / self.rate
+    
+    def acquire(self, key: str, tokens: float = 1.0, timeout: float = 0.0):
+        """Take tokens, waiting up to ``timeout`` seconds for them
         
-        self.last_request = time.time()
+        Raises:
+            RateLimitExceeded: If the tokens are not available in time
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(key, tokens)
+            if wait == 0.0:
+                return
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                raise RateLimitExceeded("Too many requests, please slow down", retry_after=wait)
+            time.sleep(wait)
+
+
+# LLM call priorities (lower runs first) and how long each may queue
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SUMMARY = 1
+PRIORITY_QUIZ = 2
+PRIORITY_BACKGROUND = 3
+
+DEFAULT_DEADLINES = {
+    PRIORITY_INTERACTIVE: 15.0,
+    PRIORITY_SUMMARY: 30.0,
+    PRIORITY_QUIZ: 30.0,
+    PRIORITY_BACKGROUND: 600.0,
+}
+
+
+class LLMGovernor:
+    """Bounded, prioritised access to the LLM
+
+    At most ``max_concurrent`` calls run at once. Waiting calls are served
+    by priority, then arrival order, and give up with RateLimitExceeded
+    when their deadline passes or the queue is full. Each call also takes a
+    token from the shared rate limiter, keeping the whole process under the
+    provider's request rate. Only the first call in the queue takes one,
+    once a slot is free, so when the rate limit is what binds, tokens still
+    go to interactive calls first and calls that give up use none.
+    """
+    
+    def __init__(self, max_concurrent: int = 4, rate_limiter: Optional[RateLimiter] = None,
+                 max_queue: int = 32, deadlines: Optional[Dict[int, float]] = None):
+        self.max_concurrent = max_concurrent
+        self.rate_limiter = rate_limiter
+        self.max_queue = max_queue
+        self.deadlines = deadlines or DEFAULT_DEADLINES
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting: List[tuple] = []
+        self._sequence = itertools.count()
+    
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_INTERACTIVE):
+        """Hold one LLM slot for the duration of the block"""
+        deadline = time.monotonic() + self.deadlines.get(priority, DEFAULT_DEADLINES[PRIORITY_BACKGROUND])
+        self._enter(priority, deadline)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+    
+    def _enter(self, priority: int, deadline: float):
+        with self._cond:
+            if len(self._waiting) >= self.max_queue:
+                raise RateLimitExceeded("The assistant is busy, please try again shortly", retry_after=5.0)
+            
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, entry)
+            # A call waiting for a token may no longer be first
+            self._cond.notify_all()
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    timeout = remaining
+                    if self._waiting[0] == entry and self._active < self.max_concurrent:
+                        wait = self.rate_limiter.try_acquire("llm") if self.rate_limiter is not None else 0.0
+                        if wait == 0.0:
+                            heapq.heappop(self._waiting)
+                            self._active += 1
+                            # The next waiter may be able to run now
+                            self._cond.notify_all()
+                            return
+                        if wait > remaining:
+                            raise RateLimitExceeded("The assistant is busy, please try again shortly",
+                                                    retry_after=wait)
+                        timeout = wait
+                    elif remaining <= 0:
+                        raise RateLimitExceeded("The assistant is busy, please try again shortly", retry_after=5.0)
+                    self._cond.wait(timeout)
+            except RateLimitExceeded:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                # The next waiter may be able to run now
+                self._cond.notify_all()
+                raise
+    
+    def status(self) -> dict:
+        with self._cond:
+            return {'active': self._active, 'waiting': len(self._waiting), 'max_concurrent': self.max_concurrent}
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Run identical concurrent calls once and share the outcome
+
+    The first caller for a key runs the work; callers arriving with the same
+    key while it is in flight wait for it and get the same result, or the
+    same exception. Nothing is kept once the call finishes, so later calls
+    run again (caching is model.precompute's job).
+
+    Keys are tuples whose first item names the operation; counters are kept
+    per operation. "coalesced" counts the calls that were served by another
+    caller's work, i.e. the LLM calls avoided.
+    """
+
+    def __init__(self, timeout: float = 120.0):
+        self.timeout = timeout
+        self._flights: Dict[tuple, _Flight] = {}
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, operation: str, counter: str):
+        counters = self._counters.setdefault(operation, {'executed': 0, 'coalesced': 0, 'timeouts': 0})
+        counters[counter] += 1
+
+    def do(self, key: tuple, fn, timeout: Optional[float] = None):
+        """Return fn(), or the result of the identical call already running
+
+        Raises:
+            RateLimitExceeded: If a waiter's call does not finish within
+                ``timeout`` seconds (the call itself carries on)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self._count(key[0], 'executed')
+                leader = True
+            else:
+                flight.waiters += 1
+                self._count(key[0], 'coalesced')
+                leader = False
+
+        if leader:
+            try:
+                flight.result = fn()
+            except BaseException as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        if not flight.done.wait(self.timeout if timeout is None else timeout):
+            with self._lock:
+                self._count(key[0], 'timeouts')
+            raise RateLimitExceeded("The assistant is busy, please try again shortly", retry_after=5.0)
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'waiting': sum(f.waiters for f in self._flights.values()),
+                'operations': {op: dict(c) for op, c in self._counters.items()},
+                'llm_calls_avoided': sum(c['coalesced'] for c in self._counters.values()),
+            }
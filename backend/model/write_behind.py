@@ -0,0 +1,371 @@
+"""
+Write-behind persistence for items appended to users' arrays in Mongo
+
+Chat history and quiz results are appended with ``$push``. Doing that on the
+request path adds a Mongo round-trip to every ask and quiz submission, so
+WriteBehindBuffer queues the items and a background thread writes them in
+one bulk_write per flush.
+
+Clearing a user's arrays sets ``cleared_at`` on their document along with
+the empty arrays. Every process writes an item only if it was queued after
+that marker, so items still buffered anywhere (another worker, a batch being
+written, a journal) cannot reappear after the clear.
+"""
+import atexit
+import datetime
+import glob
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from bson import json_util
+from bson.objectid import ObjectId
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_NAME = re.compile(r"writes-(\d+)(\.replay)?\.jsonl$")
+
+# Set with the emptied arrays when a user's data is cleared
+CLEARED_AT = "cleared_at"
+
+
+def now_ms() -> datetime.datetime:
+    """The current time as Mongo stores it (milliseconds)"""
+    now = datetime.datetime.now()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WriteBehindBuffer:
+    """Queue appends to users' arrays and write them in bulk in the background
+
+    Items are written when ``max_batch`` are queued, or every
+    ``flush_interval`` seconds, and on exit. When a write fails, or one has
+    been running for more than ``slow_write`` seconds, items go to an
+    append-only journal file instead of waiting in memory only. The journal
+    is replayed once Mongo accepts writes again, or by the next process to
+    start if this one dies first. Replays use ``$addToSet``, so an item that
+    reached Mongo before a failure is not added twice.
+
+    Items not yet in Mongo are also kept in memory per user, and readers
+    merge them into what they read (``overlay``), so a user sees their own
+    writes immediately.
+    """
+
+    def __init__(self, collection, journal_dir: str, max_batch: int = 100,
+                 flush_interval: float = 1.0, slow_write: float = 2.0,
+                 on_saved: Optional[Callable[[str], None]] = None):
+        """
+        Args:
+            collection: Users collection holding the arrays
+            journal_dir: Directory for the journal files (one per process)
+            max_batch: Queued items that trigger a write before the interval
+            flush_interval: Seconds between background writes
+            slow_write: Seconds after which a running write counts as slow
+            on_saved: Called with a user id once items of that user are in
+                Mongo, where other processes can read them
+        """
+        self.collection = collection
+        self.journal_dir = journal_dir
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.slow_write = slow_write
+        self.on_saved = on_saved
+        os.makedirs(journal_dir, exist_ok=True)
+
+        self._queue: List[Dict[str, Any]] = []
+        # Events not in Mongo yet (queued, being written or journaled), per user
+        self._unsaved: Dict[str, List[Dict[str, Any]]] = {}
+        # Events in the journal, in journal order
+        self._journaled: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._write_started: Optional[float] = None
+        self._inflight: List[Dict[str, Any]] = []
+        self._inflight_journaled = False
+        self._writer_pid = None
+        # Background replays back off while Mongo keeps failing
+        self._retry_at = 0.0
+        self._retry_delay = 0.0
+        self._stats = {"written": 0, "bulk_writes": 0, "journaled": 0, "replayed": 0, "failures": 0,
+                       "skipped_cleared": 0}
+
+    def push(self, user_id: str, field: str, item: Dict[str, Any]):
+        """Queue ``item`` to be appended to the user's ``field`` array"""
+        self._ensure_writer()
+        # Mongo keeps milliseconds; truncating now lets a replayed item
+        # compare equal to the copy already stored
+        item = {k: v.replace(microsecond=v.microsecond // 1000 * 1000) if isinstance(v, datetime.datetime) else v
+                for k, v in item.items()}
+        event = {"user_id": user_id, "field": field, "item": item, "at": now_ms()}
+        with self._lock:
+            self._unsaved.setdefault(user_id, []).append(event)
+            slow = self._write_started is not None and time.monotonic() - self._write_started > self.slow_write
+            if slow and not self._inflight_journaled:
+                # Also keep the batch that is stuck; replaying it is harmless
+                # if the write does go through
+                self._journal(self._inflight)
+                self._inflight_journaled = True
+            if self._journaled or slow:
+                self._journal([event])
+            else:
+                self._queue.append(event)
+            full = len(self._queue) >= self.max_batch
+        if full:
+            self._wake.set()
+
+    def overlay(self, user_id: str, user: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """The user document as read from Mongo, plus the user's unsaved items"""
+        self._ensure_writer()
+        with self._lock:
+            events = list(self._unsaved.get(user_id, ()))
+        if not events or user is None:
+            return user
+
+        user = dict(user)
+        by_field: Dict[str, List[Dict[str, Any]]] = {}
+        for event in events:
+            by_field.setdefault(event["field"], []).append(event["item"])
+        for field, items in by_field.items():
+            stored = list(user.get(field) or [])
+            # An item may have been written after Mongo was read but before it
+            # left the unsaved list; it would then be at the end already
+            tail = stored[-len(items):]
+            user[field] = stored + [item for item in items if item not in tail]
+        return user
+
+    def discard(self, user_id: str):
+        """Drop the user's unsaved items (their arrays are being cleared)"""
+        with self._lock:
+            self._unsaved.pop(user_id, None)
+            self._queue = [e for e in self._queue if e["user_id"] != user_id]
+            if any(e["user_id"] == user_id for e in self._journaled):
+                # Replay drops the user's earlier journaled items at this marker
+                self._journal([{"user_id": user_id, "discard": True}])
+
+    def flush(self, force: bool = True):
+        """Write everything queued, and replay the journal, now
+
+        Args:
+            force: Replay even while backing off after failures
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._queue = self._queue, []
+                if self._journaled and batch:
+                    # Keep the order: these follow the journaled items
+                    self._journal(batch)
+                    batch = []
+                replay = bool(self._journaled) and (force or time.monotonic() >= self._retry_at)
+            if replay:
+                self._replay()
+            if batch:
+                self._write(batch)
+
+    def close(self):
+        """Flush on shutdown; journal what is queued if a write is stuck"""
+        if self._flush_lock.acquire(timeout=self.slow_write):
+            self._flush_lock.release()
+            self.flush()
+        else:
+            with self._lock:
+                batch, self._queue = self._queue, []
+                if batch:
+                    self._journal(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "queued": len(self._queue), "journal_backlog": len(self._journaled)}
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        with self._lock:
+            self._inflight, self._inflight_journaled = batch, False
+            self._write_started = time.monotonic()
+        try:
+            self._bulk_write(batch, "$push")
+        except Exception as e:
+            logger.error(f"Could not write {len(batch)} queued item(s), journaling them: {e}")
+            with self._lock:
+                self._stats["failures"] += 1
+                if not self._inflight_journaled:
+                    self._journal(batch)
+                self._back_off()
+            return
+        finally:
+            with self._lock:
+                elapsed = time.monotonic() - self._write_started
+                self._write_started, self._inflight = None, []
+        if elapsed > self.slow_write:
+            logger.warning(f"Writing {len(batch)} queued item(s) took {elapsed:.1f}s")
+        self._saved(batch)
+
+    def _bulk_write(self, events: List[Dict[str, Any]], operator: str):
+        # One update per (user, array), items in the order they were pushed
+        groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        for event in events:
+            if event.get("discard"):
+                for key in [k for k in groups if k[0] == event["user_id"]]:
+                    del groups[key]
+                continue
+            groups.setdefault((event["user_id"], event["field"]), []).append(event)
+        if not groups:
+            return
+        result = self.collection.bulk_write(self._updates(groups, operator), ordered=False)
+        skipped = self._write_after_clear(groups, operator) if result.matched_count < len(groups) else 0
+        with self._lock:
+            self._stats["bulk_writes"] += 1
+            self._stats["written"] += sum(len(group) for group in groups.values()) - skipped
+            self._stats["skipped_cleared"] += skipped
+
+    @classmethod
+    def _updates(cls, groups: Dict[tuple, List[Dict[str, Any]]], operator: str) -> list:
+        from pymongo import UpdateOne
+
+        return [UpdateOne(cls._unless_cleared(user_id, group),
+                          {operator: {field: {"$each": [e["item"] for e in group]}}})
+                for (user_id, field), group in groups.items()]
+
+    @staticmethod
+    def _unless_cleared(user_id: str, group: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Match the user unless their arrays were cleared after the group's first item was queued"""
+        query: Dict[str, Any] = {"_id": ObjectId(user_id)}
+        # Events journaled by older versions carry no time and are written as before
+        if all("at" in e for e in group):
+            query[CLEARED_AT] = {"$not": {"$gt": min(e["at"] for e in group)}}
+        return query
+
+    def _write_after_clear(self, groups: Dict[tuple, List[Dict[str, Any]]], operator: str) -> int:
+        """Write the items of rejected updates that were queued after the clear; returns the items dropped"""
+        users = {ObjectId(user_id) for user_id, _ in groups}
+        cleared = {str(u["_id"]): u.get(CLEARED_AT) for u in
+                   self.collection.find({"_id": {"$in": list(users)}}, {CLEARED_AT: 1})}
+        retry, skipped = {}, 0
+        for (user_id, field), group in groups.items():
+            marker = cleared.get(user_id)
+            if marker is None or not all("at" in e for e in group) or marker <= min(e["at"] for e in group):
+                continue  # written, or the user no longer exists
+            later = [e for e in group if e["at"] >= marker]
+            skipped += len(group) - len(later)
+            if later:
+                retry[(user_id, field)] = later
+        if retry:
+            self.collection.bulk_write(self._updates(retry, operator), ordered=False)
+        return skipped
+
+    def _saved(self, events: List[Dict[str, Any]]):
+        saved = {id(e) for e in events}
+        users = {e["user_id"] for e in events}
+        with self._lock:
+            for user_id in users:
+                remaining = [e for e in self._unsaved.get(user_id, ()) if id(e) not in saved]
+                if remaining:
+                    self._unsaved[user_id] = remaining
+                else:
+                    self._unsaved.pop(user_id, None)
+        if self.on_saved is not None:
+            for user_id in users:
+                self.on_saved(user_id)
+
+    def _back_off(self):
+        """Delay the next background replay (caller holds the lock)"""
+        self._retry_delay = min(30.0, max(self.flush_interval, self._retry_delay * 2))
+        self._retry_at = time.monotonic() + self._retry_delay
+
+    # Journal: one JSON event per line in writes-<pid>.jsonl. A replay moves
+    # the file aside to writes-<pid>.replay.jsonl, so items spilled while it
+    # runs start a new journal.
+
+    def _journal_path(self, replay: bool = False) -> str:
+        return os.path.join(self.journal_dir, f"writes-{os.getpid()}{'.replay' if replay else ''}.jsonl")
+
+    def _journal(self, events: List[Dict[str, Any]]):
+        """Append events to this process's journal (caller holds the lock)"""
+        with open(self._journal_path(), "a", encoding="utf-8") as f:
+            f.write("".join(json_util.dumps(e) + "\n" for e in events))
+        self._journaled.extend(events)
+        self._stats["journaled"] += sum(1 for e in events if not e.get("discard"))
+
+    def _replay(self):
+        replay_path = self._journal_path(replay=True)
+        with self._lock:
+            os.replace(self._journal_path(), replay_path)
+            events, self._journaled = self._journaled, []
+        try:
+            self._bulk_write(events, "$addToSet")
+        except Exception as e:
+            logger.error(f"Could not replay {len(events)} journaled item(s), will retry: {e}")
+            with self._lock:
+                self._stats["failures"] += 1
+                # Put the newer journal, if any, back behind the replayed part
+                if os.path.exists(self._journal_path()):
+                    with open(self._journal_path(), encoding="utf-8") as new, open(replay_path, "a") as old:
+                        old.write(new.read())
+                os.replace(replay_path, self._journal_path())
+                self._journaled = events + self._journaled
+                self._back_off()
+            return
+        os.remove(replay_path)
+        self._saved(events)
+        with self._lock:
+            self._stats["replayed"] += sum(1 for e in events if not e.get("discard"))
+            self._retry_delay = 0.0
+        logger.info(f"Replayed {len(events)} journaled item(s)")
+
+    def _recover(self):
+        """Take over journals left by processes that are gone (caller holds the lock)"""
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, "writes-*.jsonl"))):
+            match = JOURNAL_NAME.search(path)
+            pid = int(match.group(1)) if match else None
+            if pid is None or (pid != os.getpid() and _pid_alive(pid)):
+                continue
+            claimed = f"{path}.{os.getpid()}.claimed"
+            try:
+                # Only one process wins the rename
+                os.replace(path, claimed)
+            except OSError:
+                continue
+            with open(claimed, encoding="utf-8") as f:
+                events = [json_util.loads(line) for line in f if line.strip()]
+            if events:
+                self._journal(events)
+                for event in events:
+                    if event.get("discard"):
+                        self._unsaved.pop(event["user_id"], None)
+                    else:
+                        self._unsaved.setdefault(event["user_id"], []).append(event)
+                logger.info(f"Recovered {len(events)} journaled item(s) from {os.path.basename(path)}")
+            os.remove(claimed)
+
+    def _ensure_writer(self):
+        # Threads do not survive fork(), so each serve.py worker starts its own
+        if self._writer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer_pid = os.getpid()
+            self._recover()
+            atexit.register(self.close)
+            threading.Thread(target=self._write_loop, name="write-behind", daemon=True).start()
+
+    def _write_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush(force=False)
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e}")
@@ -0,0 +1,179 @@
+"""
+Multi-process server for Smart Campus Assistant
+
+    python serve.py --workers 4 --threads 8 --port 5000
+
+The parent process starts a single retrieval sidecar that loads the embedding
+model and opens campus_rag_db, binds the listening socket, imports the Flask
+app and then forks the worker processes. Workers share the listening socket
+and the already-imported app copy-on-write, and send every embedding and
+vector-search call to the sidecar over a Unix socket, so an extra worker costs
+the Flask/LLM-client footprint rather than another copy of the model and index.
+
+On platforms without fork() or Unix sockets this falls back to the regular
+single-process waitress server.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger("serve")
+
+
+def _sidecar_main(socket_path: str):
+    logging.basicConfig(level=logging.INFO)
+    from model.retrieval_service import run_retrieval_server
+    run_retrieval_server(socket_path)
+
+
+def start_sidecar(socket_path: str, timeout: float = 300.0):
+    """Start the retrieval sidecar and wait until it answers a ping"""
+    from model.retrieval_service import RetrievalClient
+
+    # spawn, not fork: the sidecar should not inherit the parent's threads
+    ctx = multiprocessing.get_context("spawn")
+    process = ctx.Process(target=_sidecar_main, args=(socket_path,), name="retrieval-sidecar")
+    process.start()
+
+    client = RetrievalClient(socket_path, timeout=5.0)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not process.is_alive():
+            raise RuntimeError(f"Retrieval sidecar exited with code {process.exitcode}")
+        try:
+            if os.path.exists(socket_path) and client.ping():
+                logger.info(f"Retrieval sidecar ready (pid {process.pid})")
+                return process
+        except OSError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("Retrieval sidecar did not become ready in time")
+
+
+def _stop(*_):
+    raise SystemExit(0)
+
+
+def _run_worker(listener: socket.socket, threads: int):
+    # Forked children inherit the parent's Python signal handlers. SIGTERM
+    # ends serve() so buffered writes are saved before the worker exits
+    # (it leaves with os._exit, which skips atexit).
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    import app as flask_app
+    from waitress import serve
+
+    flask_app.warmup.start()
+    try:
+        serve(flask_app.app, sockets=[listener], threads=threads)
+    finally:
+        flask_app.assistant.shutdown()
+
+
+def _fork_worker(listener: socket.socket, threads: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _run_worker(listener, threads)
+        except Exception:
+            logger.exception("Worker crashed")
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def serve_single(host: str, port: int, threads: int):
+    import app as flask_app
+    from model.retrieval_service import claim_store
+    from waitress import serve
+
+    claim_store(flask_app.assistant.persist_directory)
+
+    # Exit normally on SIGTERM so atexit handlers save buffered writes
+    signal.signal(signal.SIGTERM, _stop)
+
+    serve(flask_app.app, host=host, port=port, threads=threads)
+
+
+def serve_multi(host: str, port: int, workers: int, threads: int, socket_path: str):
+    sidecar = start_sidecar(socket_path)
+
+    # Workers import the app with the sidecar configured; warm-up threads are
+    # started per worker after fork because threads do not survive fork()
+    os.environ["RETRIEVAL_SOCKET"] = socket_path
+    os.environ["WARMUP_ON_STARTUP"] = "0"
+    import app  # pre-import so the forked workers share it
+
+    listener = socket.create_server((host, port), backlog=2048, reuse_port=False)
+    listener.setblocking(False)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    pids = [_fork_worker(listener, threads) for _ in range(workers)]
+    logger.info(f"Serving on http://{host}:{port} with {workers} workers x {threads} threads")
+
+    # Supervise: respawn crashed workers and the sidecar until asked to stop
+    while not stop.is_set():
+        for i, pid in enumerate(pids):
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                logger.warning(f"Worker {pid} exited with status {status}, restarting")
+                pids[i] = _fork_worker(listener, threads)
+        if not sidecar.is_alive():
+            logger.warning(f"Retrieval sidecar exited with code {sidecar.exitcode}, restarting")
+            sidecar = start_sidecar(socket_path)
+        stop.wait(1.0)
+
+    logger.info("Shutting down workers")
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in pids:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    sidecar.terminate()
+    sidecar.join(timeout=10)
+    listener.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Smart Campus Assistant API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes (1 = single-process waitress)")
+    parser.add_argument("--threads", type=int, default=8, help="Waitress threads per worker")
+    parser.add_argument("--socket", default=os.path.join(tempfile.gettempdir(), "campus_retrieval.sock"),
+                        help="Unix socket path for the retrieval sidecar")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    if args.workers <= 1 or not hasattr(os, "fork") or not hasattr(socket, "AF_UNIX"):
+        if args.workers > 1:
+            logger.warning("Multi-process mode needs fork() and Unix sockets; using a single process")
+        serve_single(args.host, args.port, args.threads)
+    else:
+        serve_multi(args.host, args.port, args.workers, args.threads, args.socket)
+
+
+if __name__ == "__main__":
+    main()
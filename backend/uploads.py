@@ -0,0 +1,257 @@
+"""
+Streaming multipart uploads with size, concurrency and file-type limits
+"""
+import codecs
+import hashlib
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import filetype
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# filetype inspects at most this many leading bytes
+SNIFF_BYTES = 8192
+
+# Legacy .doc/.ppt files are OLE2 compound files, which filetype does not
+# always identify more precisely
+OLE_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+
+# UTF-16 and UTF-32 text is full of NUL bytes but starts with a byte order mark
+TEXT_BOMS = (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE, codecs.BOM_UTF32_BE)
+
+# Detected kinds accepted for each extension; None means no binary signature
+EXPECTED_KINDS = {
+    "pdf": {"pdf"},
+    "docx": {"docx", "zip"},
+    "pptx": {"pptx", "zip"},
+    "doc": {"doc", "ole"},
+    "ppt": {"ppt", "ole"},
+    "txt": {None},
+    "md": {None},
+}
+
+
+class UploadError(Exception):
+    """Upload rejected; ``status`` is the HTTP status to answer with"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class SavedFile(NamedTuple):
+    path: str
+    name: str
+    sha256: str
+    size: int
+
+
+def detect_kind(head: bytes) -> Optional[str]:
+    """File kind from its leading bytes, or None for text without a signature"""
+    kind = filetype.guess(head)
+    if kind is not None:
+        return kind.extension
+    if head.startswith(OLE_SIGNATURE):
+        return "ole"
+    if head.startswith(TEXT_BOMS):
+        return None
+    if b"\x00" in head:
+        return "binary"
+    return None
+
+
+def extension_of(filename: str) -> str:
+    return filename.rsplit(".", 1)[1].lower() if "." in filename else ""
+
+
+class UploadLimiter:
+    """Caps uploads in flight, per process and per user
+
+    Each request reserves its declared size up front, so a user cannot
+    push more than ``max_user_bytes`` through concurrent requests.
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_per_user: int = 2, max_user_bytes: int = 150 * 1024 * 1024):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_user_bytes = max_user_bytes
+        self._lock = threading.Lock()
+        self._active = 0
+        self._users: Dict[str, Tuple[int, int]] = {}
+
+    @contextmanager
+    def reserve(self, user_id: str, size: int):
+        with self._lock:
+            count, in_flight = self._users.get(user_id, (0, 0))
+            if self._active >= self.max_concurrent:
+                raise UploadError("Server is busy processing other uploads, please retry shortly", 429)
+            if count >= self.max_per_user:
+                raise UploadError("Please wait for your current upload to finish", 429)
+            if in_flight + size > self.max_user_bytes:
+                raise UploadError("Too much data uploading at once, please upload fewer files", 413)
+            self._active += 1
+            self._users[user_id] = (count + 1, in_flight + size)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+                count, in_flight = self._users[user_id]
+                if count == 1:
+                    del self._users[user_id]
+                else:
+                    self._users[user_id] = (count - 1, in_flight - size)
+
+
+class _Part:
+    """A file part being written to ``<target>.part`` while it is hashed"""
+
+    def __init__(self, name: str, target: str):
+        self.name = name
+        self.target = target
+        self.temp = f"{target}.part"
+        self.head = b""
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.handle = None
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        self.digest.update(data)
+        if self.handle is None:
+            self.handle = open(self.temp, "wb")
+        self.handle.write(data)
+
+    def finish(self) -> SavedFile:
+        self.close()
+        os.replace(self.temp, self.target)
+        return SavedFile(self.target, self.name, self.digest.hexdigest(), self.size)
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.temp):
+            os.remove(self.temp)
+
+
+def receive_files(stream, boundary: bytes, upload_dir: str, prefix: str,
+                  field: str = "files", max_files: int = 5,
+                  max_file_bytes: int = 50 * 1024 * 1024) -> Tuple[List[SavedFile], List[str]]:
+    """Stream the file parts of a multipart body straight to disk
+
+    Files are written in chunks while hashed, so memory use does not grow
+    with their size. A file whose extension or leading bytes do not match
+    an accepted type is skipped without being written, as is a second file
+    with the same name (both would be saved to, and indexed as, one
+    document). If anything fails, every file written by this call is
+    removed.
+
+    Args:
+        stream: Request body stream (Flask's ``request.stream``)
+        boundary: Multipart boundary from the Content-Type header
+        upload_dir: Directory the files are saved in
+        prefix: Prepended to each saved filename to keep it unique
+        field: Form field holding the files
+        max_files: Most files accepted per request
+        max_file_bytes: Largest accepted file
+
+    Returns:
+        (saved files, names of rejected files)
+    """
+    # Events are drained after every read, so the decoder never holds much
+    # more than one chunk
+    decoder = MultipartDecoder(boundary, max_form_memory_size=CHUNK_SIZE + SNIFF_BYTES)
+    saved: List[SavedFile] = []
+    rejected: List[str] = []
+    part: Optional[_Part] = None
+    skipping = False
+    names = set()
+
+    def start(event: File):
+        nonlocal part, skipping
+        filename = secure_filename(event.filename or "")
+        part, skipping = None, True
+        if event.name != field:
+            return
+        if extension_of(filename) not in EXPECTED_KINDS:
+            rejected.append(event.filename or "")
+            return
+        if filename in names:
+            logger.warning(f"Rejected upload '{filename}': another file in the request has the same name")
+            rejected.append(event.filename or "")
+            return
+        if len(saved) >= max_files:
+            raise UploadError(f"At most {max_files} files can be uploaded at once", 400)
+        names.add(filename)
+        part, skipping = _Part(filename, os.path.abspath(os.path.join(upload_dir, f"{prefix}{filename}"))), False
+
+    def receive(data: bytes, more: bool):
+        nonlocal part, skipping
+        if skipping:
+            return
+        if part.size + len(part.head) + len(data) > max_file_bytes:
+            raise UploadError(f"'{part.name}' is larger than {max_file_bytes // (1024 * 1024)} MB", 413)
+
+        if part.handle is None and part.size == 0:
+            # Hold back the first bytes until the type can be checked
+            part.head += data
+            if len(part.head) < SNIFF_BYTES and more:
+                return
+            if detect_kind(part.head[:SNIFF_BYTES]) not in EXPECTED_KINDS[extension_of(part.name)]:
+                logger.warning(f"Rejected upload '{part.name}': content does not match its extension")
+                rejected.append(part.name)
+                part, skipping = None, True
+                return
+            data, part.head = part.head, b""
+
+        part.write(data)
+        if not more:
+            if part.size == 0:
+                part.discard()
+                rejected.append(part.name)
+            else:
+                saved.append(part.finish())
+            part, skipping = None, True
+
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, File):
+                    start(event)
+                elif isinstance(event, Data):
+                    receive(event.data, event.more_data)
+                else:
+                    # Plain form fields are not used by the upload route
+                    skipping = True
+                event = decoder.next_event()
+            if isinstance(event, Epilogue) or not chunk:
+                break
+        if part is not None:
+            raise UploadError("Upload ended before the last file was complete", 400)
+    except Exception as e:
+        if part is not None:
+            part.discard()
+        for f in saved:
+            if os.path.exists(f.path):
+                os.remove(f.path)
+        if isinstance(e, ValueError):
+            # Raised by the decoder for a truncated or malformed body
+            raise UploadError(f"Malformed upload: {e}", 400) from e
+        raise
+
+    return saved, rejected